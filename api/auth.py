@@ -14,6 +14,7 @@ from services.user_service import \
     list_users as list_users, \
     list_roles as list_roles, \
     list_role_users as list_role_users, \
+    iter_role_users as iter_role_users, \
     get_user as get_user, \
     create_user as create_user, \
     update_user as update_user, \
@@ -23,5 +24,5 @@ from services.user_service import \
 __all__ = [
     "get_current_user", "check_role", "assign_role", "is_anonymous",
     "get_user_groups", "create_group", "add_client_to_group", "get_users_in_group",
-    "list_users", "list_roles", "list_role_users", "get_user", "create_user", "update_user", "delete_user", "assign_role_to_user"
+    "list_users", "list_roles", "list_role_users", "iter_role_users", "get_user", "create_user", "update_user", "delete_user", "assign_role_to_user"
 ]
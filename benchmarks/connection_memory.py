@@ -0,0 +1,111 @@
+"""
+Memory per WebSocket connection
+
+Builds N connections subscribed to a few topics, together with the service indexes that
+reference them, and measures the allocated memory with tracemalloc. The slotted
+WebSocketConnection record (heartbeat state included, interned topics) is compared with
+the previous layout: a dict-backed connection with an asyncio.Event, heartbeat dicts keyed
+by connection id and a copy of every topic string per subscription.
+
+Usage:
+    python benchmarks/connection_memory.py [--connections N N ...] [--topics N]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tracemalloc
+import uuid
+from collections import deque
+
+# Add the parent directory to the sys.path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import install_fake_environment
+
+install_fake_environment()
+
+from services.websocket_service import WebSocketConnection
+
+
+class LegacyConnection:
+    """The connection layout before the slotted record"""
+    def __init__(self, connection_id: str):
+        self._websocket = None
+        self.connection_id = connection_id
+        self._service = None
+        self.user_id = None
+        self._subscribed_topics = set()
+        self._queue = deque()
+        self._queue_size = 256
+        self._overflow_policy = "drop_oldest"
+        self._queue_ready = asyncio.Event()
+        self._writer_task = None
+        self.dropped_frames = 0
+        self.codec = None
+        self.inbound = asyncio.Queue(maxsize=64)
+        self._dispatcher_task = None
+
+
+def subscribe_messages(topics: int):
+    """Topic names as they come out of a decoded subscribe frame, a new string every time"""
+    return [json.loads(json.dumps({"topic": f"session-{i}"}))["topic"] for i in range(topics)]
+
+
+def build_legacy(connections: int, topics: int):
+    registry, topic_subscribers, last_activity, ping_sent = {}, {}, {}, {}
+    for _ in range(connections):
+        connection_id = str(uuid.uuid4())
+        connection = registry[connection_id] = LegacyConnection(connection_id)
+        last_activity[connection_id] = 0.0
+        ping_sent[connection_id] = 0.0
+        for topic in subscribe_messages(topics):
+            connection._subscribed_topics.add(topic)
+            topic_subscribers.setdefault(topic, set()).add(connection_id)
+    return registry, topic_subscribers, last_activity, ping_sent
+
+
+def build_slotted(connections: int, topics: int):
+    registry, topic_subscribers = {}, {}
+    for _ in range(connections):
+        connection_id = str(uuid.uuid4())
+        connection = registry[connection_id] = WebSocketConnection(None, connection_id)
+        connection.last_activity = 0.0
+        connection.ping_sent = 0.0
+        for topic in subscribe_messages(topics):
+            topic = sys.intern(topic)
+            connection.add_subscription(topic)
+            topic_subscribers.setdefault(topic, set()).add(connection_id)
+    return registry, topic_subscribers
+
+
+def measure(build, connections: int, topics: int) -> float:
+    """Bytes allocated per connection"""
+    tracemalloc.start()
+    state = build(connections, topics)
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del state
+    return allocated / connections
+
+
+async def run(args):
+    print(f"Allocated memory per connection, {args.topics} topics each (lower is better)")
+    print(f"{'connections':>12} {'legacy (B)':>12} {'slotted (B)':>13} {'saved':>7}")
+    for connections in args.connections:
+        legacy = measure(build_legacy, connections, args.topics)
+        slotted = measure(build_slotted, connections, args.topics)
+        print(f"{connections:>12} {legacy:>12.0f} {slotted:>13.0f} {1 - slotted / legacy:>6.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, nargs="+", default=[1000, 10000, 20000])
+    parser.add_argument("--topics", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
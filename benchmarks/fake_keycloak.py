@@ -0,0 +1,291 @@
+"""
+An in-memory Keycloak realm served over HTTP
+
+Implements the OpenID Connect and admin endpoints the core calls (tokens, JWKS, users, realm
+roles, groups), with an optional latency per request, so python-keycloak clients can be
+pointed at it in tests and benchmarks. Access tokens are RS256 tokens signed with the key
+published on the certs endpoint.
+
+Usage:
+    realm = FakeKeycloak(latency=0.05)
+    realm.seed(users=100, roles=["cb-organizer", "cb-speaker"])
+    realm.start()
+    admin = realm.admin_client()
+    ...
+    realm.stop()
+"""
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional, Set
+
+# Add the parent directory to the sys.path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI, HTTPException, Request, Response
+from jwcrypto import jwk, jwt
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def page(items: List[dict], first: Optional[int], max: Optional[int]) -> List[dict]:
+    start = first or 0
+    return items[start:] if max is None or max < 0 else items[start:start + max]
+
+
+class FakeKeycloak:
+    """
+    Realm state and the HTTP server exposing it
+
+    Args:
+        realm: Name of the realm
+        latency: Seconds every request waits before it is answered
+    """
+    def __init__(self, realm: str = "coffeebreak", latency: float = 0.0):
+        self.realm = realm
+        self.latency = latency
+        self.requests = 0
+        # Requests being answered, and the most answered at once
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.users: Dict[str, dict] = {}
+        self.roles: Dict[str, dict] = {}
+        self.groups: Dict[str, dict] = {}
+        self.role_members: Dict[str, Set[str]] = {}
+        self.group_members: Dict[str, Set[str]] = {}
+        self.key = jwk.JWK.generate(kty="RSA", size=2048, kid=uuid.uuid4().hex)
+        self.port = free_port()
+        self._server = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def seed(self, users: int = 0, roles: Iterable[str] = (), groups: Iterable[str] = (), members_per_role: Optional[int] = None) -> None:
+        """Create users, roles and groups, every user is a member of every role unless limited"""
+        user_ids = [self.add_user({"username": f"user-{i}", "email": f"user-{i}@example.com", "enabled": True}) for i in range(users)]
+        for name in roles:
+            self.add_role(name)
+            self.role_members[name].update(user_ids[:members_per_role])
+        for name in groups:
+            self.add_group(name)
+
+    def add_user(self, representation: dict) -> str:
+        user_id = str(uuid.uuid4())
+        self.users[user_id] = {**representation, "id": user_id, "createdTimestamp": int(time.time() * 1000)}
+        return user_id
+
+    def add_role(self, name: str) -> dict:
+        role = self.roles.setdefault(name, {"id": str(uuid.uuid4()), "name": name, "composite": False, "clientRole": False})
+        self.role_members.setdefault(name, set())
+        return role
+
+    def add_group(self, name: str) -> str:
+        group_id = str(uuid.uuid4())
+        self.groups[group_id] = {"id": group_id, "name": name, "path": f"/{name}", "subGroupCount": 0}
+        self.group_members[group_id] = set()
+        return group_id
+
+    def issue_token(self, subject: str = "service-account", roles: Iterable[str] = (), expires_in: int = 300) -> str:
+        """Sign an access token with the realm key"""
+        now = int(time.time())
+        token = jwt.JWT(
+            header={"alg": "RS256", "typ": "JWT", "kid": self.key.key_id},
+            claims={
+                "iss": f"{self.url}/realms/{self.realm}",
+                "sub": subject,
+                "iat": now,
+                "exp": now + expires_in,
+                "typ": "Bearer",
+                "azp": "coffeebreak",
+                "realm_access": {"roles": list(roles)},
+            }
+        )
+        token.make_signed_token(self.key)
+        return token.serialize()
+
+    def admin_client(self, **kwargs):
+        """A python-keycloak admin client logged in to the realm"""
+        from keycloak import KeycloakAdmin
+        return KeycloakAdmin(
+            server_url=self.url,
+            realm_name=self.realm,
+            client_id="coffeebreak",
+            client_secret_key="secret",
+            **kwargs
+        )
+
+    def start(self) -> None:
+        """Serve the realm from a background thread"""
+        import uvicorn
+        config = uvicorn.Config(self.build_app(), host="127.0.0.1", port=self.port, log_level="warning", lifespan="off")
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=lambda: asyncio.run(self._server.serve()), daemon=True)
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.should_exit = True
+            self._thread.join()
+            self._server = None
+
+    def build_app(self) -> FastAPI:
+        app = FastAPI()
+        realm = "/realms/{realm}"
+        admin = "/admin/realms/{realm}"
+
+        @app.middleware("http")
+        async def count_and_delay(request: Request, call_next):
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            try:
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                return await call_next(request)
+            finally:
+                self.in_flight -= 1
+
+        def created(location: str) -> Response:
+            return Response(status_code=201, headers={"Location": location})
+
+        def user_or_404(user_id: str) -> dict:
+            if user_id not in self.users:
+                raise HTTPException(status_code=404, detail="User not found")
+            return self.users[user_id]
+
+        @app.post(realm + "/protocol/openid-connect/token")
+        async def token():
+            return {
+                "access_token": self.issue_token(),
+                "expires_in": 300,
+                "refresh_token": self.issue_token(expires_in=1800),
+                "refresh_expires_in": 1800,
+                "token_type": "Bearer",
+            }
+
+        @app.get(realm + "/protocol/openid-connect/certs")
+        async def certs():
+            return {"keys": [{**self.key.export_public(as_dict=True), "use": "sig", "alg": "RS256"}]}
+
+        @app.get(admin + "/users")
+        async def get_users(first: Optional[int] = None, max: Optional[int] = None, search: Optional[str] = None, username: Optional[str] = None):
+            users = list(self.users.values())
+            if search:
+                users = [u for u in users if search in u.get("username", "") or search in u.get("email", "")]
+            if username:
+                users = [u for u in users if u.get("username") == username]
+            return page(users, first, max)
+
+        @app.get(admin + "/users/count")
+        async def count_users():
+            return len(self.users)
+
+        @app.post(admin + "/users")
+        async def create_user(request: Request):
+            representation = await request.json()
+            if any(u.get("username") == representation.get("username") for u in self.users.values()):
+                raise HTTPException(status_code=409, detail="User exists with same username")
+            user_id = self.add_user(representation)
+            return created(f"{self.url}/admin/realms/{self.realm}/users/{user_id}")
+
+        @app.get(admin + "/users/{user_id}")
+        async def get_user(user_id: str):
+            return user_or_404(user_id)
+
+        @app.put(admin + "/users/{user_id}")
+        async def update_user(user_id: str, request: Request):
+            user_or_404(user_id).update(await request.json())
+            return Response(status_code=204)
+
+        @app.delete(admin + "/users/{user_id}")
+        async def delete_user(user_id: str):
+            user_or_404(user_id)
+            del self.users[user_id]
+            for members in (*self.role_members.values(), *self.group_members.values()):
+                members.discard(user_id)
+            return Response(status_code=204)
+
+        @app.get(admin + "/users/{user_id}/groups")
+        async def get_user_groups(user_id: str):
+            return [self.groups[g] for g, members in self.group_members.items() if user_id in members]
+
+        @app.put(admin + "/users/{user_id}/groups/{group_id}")
+        async def group_user_add(user_id: str, group_id: str):
+            self.group_members[group_id].add(user_id)
+            return Response(status_code=204)
+
+        @app.delete(admin + "/users/{user_id}/groups/{group_id}")
+        async def group_user_remove(user_id: str, group_id: str):
+            self.group_members[group_id].discard(user_id)
+            return Response(status_code=204)
+
+        @app.get(admin + "/users/{user_id}/role-mappings/realm")
+        async def get_realm_roles_of_user(user_id: str):
+            return [self.roles[name] for name, members in self.role_members.items() if user_id in members]
+
+        @app.post(admin + "/users/{user_id}/role-mappings/realm")
+        async def assign_realm_roles(user_id: str, request: Request):
+            for role in await request.json():
+                self.role_members[role["name"]].add(user_id)
+            return Response(status_code=204)
+
+        @app.get(admin + "/roles")
+        async def get_realm_roles():
+            return list(self.roles.values())
+
+        @app.post(admin + "/roles")
+        async def create_realm_role(request: Request):
+            name = (await request.json())["name"]
+            self.add_role(name)
+            return created(f"{self.url}/admin/realms/{self.realm}/roles/{name}")
+
+        @app.get(admin + "/roles/{role_name}")
+        async def get_realm_role(role_name: str):
+            if role_name not in self.roles:
+                raise HTTPException(status_code=404, detail="Could not find role")
+            return self.roles[role_name]
+
+        @app.get(admin + "/roles/{role_name}/users")
+        async def get_realm_role_members(role_name: str, first: Optional[int] = None, max: Optional[int] = None):
+            if role_name not in self.roles:
+                raise HTTPException(status_code=404, detail="Could not find role")
+            members = sorted(self.role_members[role_name], key=lambda user_id: self.users[user_id]["username"])
+            return page([self.users[user_id] for user_id in members], first, max)
+
+        @app.get(admin + "/groups")
+        async def get_groups(first: Optional[int] = None, max: Optional[int] = None, search: Optional[str] = None):
+            groups = [g for g in self.groups.values() if not search or search in g["name"]]
+            return page(groups, first, max)
+
+        @app.post(admin + "/groups")
+        async def create_group(request: Request):
+            name = (await request.json())["name"]
+            if any(g["name"] == name for g in self.groups.values()):
+                raise HTTPException(status_code=409, detail="Top level group named already exists")
+            group_id = self.add_group(name)
+            return created(f"{self.url}/admin/realms/{self.realm}/groups/{group_id}")
+
+        @app.get(admin + "/groups/{group_id}")
+        async def get_group(group_id: str):
+            if group_id not in self.groups:
+                raise HTTPException(status_code=404, detail="Could not find group by id")
+            return self.groups[group_id]
+
+        @app.get(admin + "/groups/{group_id}/members")
+        async def get_group_members(group_id: str, first: Optional[int] = None, max: Optional[int] = None):
+            members = [self.users[user_id] for user_id in self.group_members.get(group_id, ())]
+            return page(members, first, max)
+
+        return app
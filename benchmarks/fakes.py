@@ -0,0 +1,89 @@
+"""
+Local stand-ins for the external services, so the app can run in-process without
+Keycloak, MongoDB or a real database
+"""
+import os
+import sys
+import tempfile
+import time
+from functools import lru_cache
+
+# Add the parent directory to the sys.path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FAKE_ENVIRONMENT = {
+    "KEYCLOAK_URL": "http://127.0.0.1:1",
+    "KEYCLOAK_REALM": "coffeebreak",
+    "KEYCLOAK_CLIENT_ID": "benchmark",
+    "KEYCLOAK_CLIENT_SECRET": "benchmark",
+    # Motor connects lazily, nothing is sent to this address unless a Mongo route is called
+    "MONGODB_URI": "mongodb://127.0.0.1:1/coffeebreak",
+    "DATABASE_URI": f"sqlite:///{os.path.join(tempfile.gettempdir(), 'coffeebreak_benchmark.db')}",
+    # A single process, nothing to relay
+    "WORKER_BUS_BACKEND": "local",
+}
+
+
+def install_fake_environment() -> None:
+    """Point the configuration at the fakes, must run before the app modules are imported"""
+    for key, value in FAKE_ENVIRONMENT.items():
+        os.environ.setdefault(key, value)
+
+
+@lru_cache(maxsize=None)
+def realm_key():
+    """The key the fake realm signs its tokens with"""
+    from jwcrypto import jwk
+    return jwk.JWK.generate(kty="RSA", size=2048, kid="benchmark")
+
+
+def issue_token(user: str, expires_in: int = 86400) -> str:
+    """An access token of the fake realm for a user, verified locally like a Keycloak one"""
+    from jwcrypto import jwt
+    now = int(time.time())
+    token = jwt.JWT(
+        header={"alg": "RS256", "typ": "JWT", "kid": realm_key().key_id},
+        claims={
+            "iss": f"{os.environ['KEYCLOAK_URL'].rstrip('/')}/realms/{os.environ['KEYCLOAK_REALM']}",
+            "sub": user,
+            "preferred_username": user,
+            "iat": now,
+            "exp": now + expires_in,
+            "typ": "Bearer",
+            "realm_access": {"roles": []},
+        }
+    )
+    token.make_signed_token(realm_key())
+    return token.serialize()
+
+
+class FakeKeycloakOpenID:
+    """
+    Serves the key of the fake realm, the tokens of issue_token are verified with it
+    """
+    def certs(self) -> dict:
+        return {"keys": [{**realm_key().export_public(as_dict=True), "use": "sig", "alg": "RS256"}]}
+
+    def introspect(self, token: str) -> dict:
+        # Only tokens that are not JWTs get here
+        return {"active": False}
+
+
+def create_app():
+    """
+    Build an app with the real-time routes, backed by the fakes
+    """
+    install_fake_environment()
+
+    from fastapi import FastAPI
+    import dependencies.auth as auth
+    auth.keycloak_openid = FakeKeycloakOpenID()
+
+    from dependencies.database import Base, engine
+    from routes import websocket, notifications
+    Base.metadata.create_all(bind=engine, checkfirst=True)
+
+    app = FastAPI()
+    app.include_router(websocket.router)
+    app.include_router(notifications.router, prefix="/notifications")
+    return app
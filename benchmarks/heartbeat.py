@@ -0,0 +1,76 @@
+"""
+Idle CPU cost of connection liveness tracking
+
+Compares the previous approach (one monitor task per connection waking every second)
+with the HeartbeatScheduler (one task waking only when a deadline expires).
+
+Usage:
+    python benchmarks/heartbeat.py [--duration SECONDS] [--connections N N ...]
+"""
+import argparse
+import asyncio
+import sys
+import os
+import time
+
+# Add the parent directory to the sys.path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.heartbeat import HeartbeatScheduler, HeartbeatState
+
+IDLE_TIMEOUT = 60
+
+
+async def polling_monitors(connections: int, duration: float) -> float:
+    """One task per connection checking its idle time every second"""
+    last_activity = {str(i): time.time() for i in range(connections)}
+
+    async def monitor(connection_id: str):
+        while True:
+            if time.time() - last_activity[connection_id] >= IDLE_TIMEOUT:
+                pass
+            await asyncio.sleep(1)
+
+    start = time.process_time()
+    tasks = [asyncio.create_task(monitor(connection_id)) for connection_id in last_activity]
+    await asyncio.sleep(duration)
+    elapsed = time.process_time() - start
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return elapsed
+
+
+async def heartbeat_scheduler(connections: int, duration: float) -> float:
+    """A single scheduler tracking every connection"""
+    async def on_timeout(_):
+        pass
+
+    scheduler = HeartbeatScheduler(lambda _: None, on_timeout, idle_timeout=IDLE_TIMEOUT)
+    start = time.process_time()
+    tracked = [HeartbeatState() for _ in range(connections)]
+    for connection in tracked:
+        scheduler.add(connection)
+    await asyncio.sleep(duration)
+    elapsed = time.process_time() - start
+    scheduler.stop()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--connections", type=int, nargs="+", default=[100, 1000, 5000, 10000])
+    args = parser.parse_args()
+
+    print(f"Idle CPU over {args.duration}s (process time, lower is better)")
+    print(f"{'connections':>12} {'polling (ms)':>14} {'scheduler (ms)':>16} {'speedup':>9}")
+    for connections in args.connections:
+        polling = asyncio.run(polling_monitors(connections, args.duration))
+        scheduler = asyncio.run(heartbeat_scheduler(connections, args.duration))
+        speedup = polling / scheduler if scheduler else float("inf")
+        print(f"{connections:>12} {polling * 1000:>14.1f} {scheduler * 1000:>16.1f} {speedup:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
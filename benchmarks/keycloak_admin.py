@@ -0,0 +1,84 @@
+"""
+Event loop stalls caused by Keycloak admin calls
+
+Runs N concurrent user listings against the fake Keycloak (benchmarks/fake_keycloak.py)
+with a simulated latency, first calling python-keycloak directly from the coroutines as the
+services used to, then through the thread pool of AsyncKeycloakAdmin. A ticker task measures
+how long the event loop (and so every WebSocket) was unable to run.
+
+Usage:
+    python benchmarks/keycloak_admin.py [--calls N] [--latency S] [--threads N]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+# Add the parent directory to the sys.path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import install_fake_environment
+
+install_fake_environment()
+
+from benchmarks.fake_keycloak import FakeKeycloak
+from services.keycloak_admin import AsyncKeycloakAdmin
+
+TICK = 0.001
+
+
+async def measure(calls: int, call) -> tuple:
+    """Run the calls concurrently, returns the elapsed time and the longest loop stall"""
+    stall = 0.0
+
+    async def ticker():
+        nonlocal stall
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(TICK)
+            stall = max(stall, time.perf_counter() - start - TICK)
+
+    ticking = asyncio.create_task(ticker())
+    await asyncio.sleep(TICK)
+    start = time.perf_counter()
+    await asyncio.gather(*(call() for _ in range(calls)))
+    elapsed = time.perf_counter() - start
+    # Let the ticker see the last stall
+    await asyncio.sleep(TICK * 2)
+    ticking.cancel()
+    return elapsed, stall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds Keycloak takes per request")
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    realm = FakeKeycloak(latency=args.latency)
+    realm.seed(users=50)
+    realm.start()
+    admin = realm.admin_client()
+    admin.get_users()
+    client = AsyncKeycloakAdmin(lambda: admin, max_workers=args.threads)
+
+    async def blocking():
+        return admin.get_users()
+
+    async def run():
+        return await measure(args.calls, blocking), await measure(args.calls, client.get_users)
+
+    (direct, direct_stall), (pooled, pooled_stall) = asyncio.run(run())
+    client.shutdown()
+    realm.stop()
+
+    print(f"{args.calls} concurrent calls, {args.latency * 1000:.0f} ms per Keycloak request")
+    print(f"{'mode':<22}{'total ms':>10}{'max stall ms':>14}")
+    print(f"{'direct (blocking)':<22}{direct * 1000:>10.1f}{direct_stall * 1000:>14.1f}")
+    print(f"{'thread pool':<22}{pooled * 1000:>10.1f}{pooled_stall * 1000:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
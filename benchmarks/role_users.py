@@ -0,0 +1,73 @@
+"""
+Latency of the users of every role
+
+Lists the members of every "cb-" role against the fake Keycloak (benchmarks/fake_keycloak.py)
+with a simulated latency: one role after the other as list_role_users used to, then with the
+concurrent aggregation of services/user_service.py on a cold and on a warm directory cache.
+
+Usage:
+    python benchmarks/role_users.py [--roles N] [--users N] [--latency S]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+# Add the parent directory to the sys.path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import install_fake_environment
+
+install_fake_environment()
+
+from benchmarks.fake_keycloak import FakeKeycloak
+import services.directory as directory
+import services.keycloak_admin as keycloak_admin
+from services.keycloak_admin import AsyncKeycloakAdmin
+from services.user_service import list_role_users
+
+
+async def timed(call) -> float:
+    start = time.perf_counter()
+    await call()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--roles", type=int, default=12)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds Keycloak takes per request")
+    args = parser.parse_args()
+
+    realm = FakeKeycloak(latency=args.latency)
+    realm.seed(users=args.users, roles=[f"cb-role-{i}" for i in range(args.roles)])
+    realm.start()
+    admin = realm.admin_client()
+    admin.get_realm_roles()
+    client = AsyncKeycloakAdmin(lambda: admin)
+    keycloak_admin._keycloak_admin = client
+    directory._directory = directory.DirectoryCache(client)
+
+    async def serial():
+        for role in await client.get_realm_roles():
+            if role["name"].startswith("cb-"):
+                await client.get_realm_role_members(role["name"])
+
+    async def run():
+        return await timed(serial), await timed(list_role_users), await timed(list_role_users)
+
+    serial_time, cold, warm = asyncio.run(run())
+    client.shutdown()
+    realm.stop()
+
+    print(f"{args.roles} roles of {args.users} users, {args.latency * 1000:.0f} ms per Keycloak request")
+    print(f"{'mode':<24}{'ms':>10}")
+    print(f"{'serial':<24}{serial_time * 1000:>10.1f}")
+    print(f"{'concurrent, cold cache':<24}{cold * 1000:>10.1f}")
+    print(f"{'concurrent, warm cache':<24}{warm * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+Load test of the /ws endpoint
+
+Starts the app in-process (see benchmarks/fakes.py), opens simulated clients that authenticate,
+subscribe to a topic and ping, then broadcasts to that topic and reports:
+
+- delivery latency (p50/p99) from broadcast to reception by each client
+- broadcast throughput (deliveries per second)
+- process memory per connection (client and server sides share the process)
+
+Usage:
+    python benchmarks/websocket_load.py [--clients N] [--broadcasts N] [--payload-bytes N]
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import statistics
+import sys
+import threading
+import time
+
+# Add the parent directory to the sys.path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import create_app, issue_token
+
+TOPIC = "benchmark"
+
+
+def rss_bytes() -> int:
+    """Resident memory of the process"""
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def raise_file_limit(clients: int) -> None:
+    """Each simulated client needs a socket on both ends"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = clients * 2 + 100
+    if soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard), hard))
+        if hard < needed:
+            print(f"Warning: the open file limit ({hard}) is too low for {clients} clients")
+
+
+class Server:
+    """Runs uvicorn with the app in a background thread with its own event loop"""
+    def __init__(self, port: int):
+        import uvicorn
+        config = uvicorn.Config(create_app(), host="127.0.0.1", port=port, lifespan="off", log_level="warning")
+        self.server = uvicorn.Server(config)
+        self.loop = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self.server.serve())
+
+    def start(self):
+        self._thread.start()
+        while not self.server.started:
+            time.sleep(0.05)
+
+    def call(self, coroutine):
+        """Run a coroutine on the server loop and wait for it"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def stop(self):
+        self.server.should_exit = True
+        self._thread.join()
+
+
+class Client:
+    """A simulated attendee"""
+    def __init__(self, url: str, user: str, expected: int, ping_interval: float):
+        self.url = url
+        self.user = user
+        self.expected = expected
+        self.ping_interval = ping_interval
+        self.latencies = []
+        self.done = asyncio.Event()
+        self._websocket = None
+
+    async def connect(self):
+        from websockets.asyncio.client import connect
+        # Protocol-level pings are disabled, the application heartbeat is exercised instead
+        self._websocket = await connect(self.url, ping_interval=None, max_size=None)
+        await self._websocket.send(json.dumps({"type": "authenticate", "token": issue_token(self.user)}))
+        await self._expect("authentication_result")
+        await self._websocket.send(json.dumps({"type": "subscribe", "topic": TOPIC}))
+        await self._expect("subscription_result")
+
+    async def _expect(self, message_type: str):
+        while True:
+            message = json.loads(await self._websocket.recv())
+            if message.get("type") == message_type:
+                return message
+
+    async def run(self):
+        pinger = asyncio.create_task(self._ping()) if self.ping_interval else None
+        try:
+            async for frame in self._websocket:
+                received_at = time.perf_counter()
+                message = json.loads(frame)
+                if message.get("topic") == TOPIC:
+                    self.latencies.append(received_at - message["data"]["sent_at"])
+                    if len(self.latencies) >= self.expected:
+                        self.done.set()
+                        break
+        finally:
+            if pinger:
+                pinger.cancel()
+
+    async def _ping(self):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            await self._websocket.send(json.dumps({"type": "ping"}))
+
+    async def close(self):
+        await self._websocket.close()
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def run_clients(server: Server, args) -> dict:
+    from services.websocket_service import WebSocketService
+    service = WebSocketService()
+    url = f"ws://127.0.0.1:{server.server.config.port}/ws"
+
+    rss_before = rss_bytes()
+    clients = [Client(url, f"user-{i}", args.broadcasts, args.ping_interval) for i in range(args.clients)]
+    started = time.perf_counter()
+    for batch in range(0, len(clients), args.connect_batch):
+        await asyncio.gather(*(client.connect() for client in clients[batch:batch + args.connect_batch]))
+    connect_time = time.perf_counter() - started
+    rss_after = rss_bytes()
+
+    receivers = [asyncio.create_task(client.run()) for client in clients]
+    padding = "x" * args.payload_bytes
+
+    started = time.perf_counter()
+    for _ in range(args.broadcasts):
+        server.call(service.broadcast_to_topic(TOPIC, {"sent_at": time.perf_counter(), "padding": padding}))
+        if args.interval:
+            await asyncio.sleep(args.interval)
+    try:
+        await asyncio.wait_for(asyncio.gather(*(client.done.wait() for client in clients)), args.timeout)
+    except asyncio.TimeoutError:
+        print("Warning: timed out waiting for every delivery")
+    elapsed = time.perf_counter() - started
+
+    for receiver in receivers:
+        receiver.cancel()
+    await asyncio.gather(*(client.close() for client in clients), return_exceptions=True)
+
+    latencies = [latency for client in clients for latency in client.latencies]
+    return {
+        "clients": args.clients,
+        "broadcasts": args.broadcasts,
+        "connect_time": connect_time,
+        "memory_per_connection": (rss_after - rss_before) / args.clients,
+        "deliveries": len(latencies),
+        "expected": args.clients * args.broadcasts,
+        "throughput": len(latencies) / elapsed if elapsed else 0,
+        "p50": percentile(latencies, 0.50) if latencies else float("nan"),
+        "p99": percentile(latencies, 0.99) if latencies else float("nan"),
+        "mean": statistics.fmean(latencies) if latencies else float("nan"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--broadcasts", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=0.05, help="seconds between broadcasts")
+    parser.add_argument("--payload-bytes", type=int, default=256)
+    parser.add_argument("--ping-interval", type=float, default=5.0, help="seconds between client pings, 0 disables")
+    parser.add_argument("--connect-batch", type=int, default=200, help="clients connecting concurrently")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    raise_file_limit(args.clients)
+    server = Server(free_port())
+    server.start()
+    try:
+        results = asyncio.run(run_clients(server, args))
+    finally:
+        server.stop()
+
+    print(f"clients:               {results['clients']}")
+    print(f"broadcasts:            {results['broadcasts']}")
+    print(f"connect time:          {results['connect_time']:.2f}s")
+    print(f"memory / connection:   {results['memory_per_connection'] / 1024:.1f} KiB (client and server)")
+    print(f"deliveries:            {results['deliveries']}/{results['expected']}")
+    print(f"throughput:            {results['throughput']:.0f} deliveries/s")
+    print(f"latency p50:           {results['p50'] * 1000:.1f} ms")
+    print(f"latency p99:           {results['p99'] * 1000:.1f} ms")
+    print(f"latency mean:          {results['mean'] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Write throughput of events and messages, one transaction per row against batched transactions
+
+Saves N events into a file-backed SQLite database, first one commit per event as
+EventBus.publish_event did, then through EventBus.save_event where concurrent producers share
+the transactions of the write batcher, and through EventBus.publish_event called from a thread
+pool as sync routes and plugins do. Then sends N messages end to end through
+MessageBus.send_notification to a handler, against storing them with one commit each and
+calling the handler inline as the MessageBus did. The commits of every mode are counted.
+
+Usage:
+    python benchmarks/write_batching.py [--events N] [--producers N] [--batch-size N] [--delay S]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime
+
+# Add the parent directory to the sys.path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import install_fake_environment
+
+install_fake_environment()
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+
+from dependencies.database import Base
+from models.event import Event
+from models.message import Message, RecipientType
+from schemas.event import EventRequest, EventType
+from schemas.notification import NotificationRequest
+from services.event_bus import EventBus
+from services.message_bus import MessageBus
+
+MESSAGE_TYPE = "benchmark"
+
+
+def make_event(i: int) -> EventRequest:
+    return EventRequest(
+        event_type=EventType.ENDPOINT_CALL,
+        timestamp=datetime.now(UTC),
+        payload=f"check-in {i}",
+        details={"attendee": i}
+    )
+
+
+def make_message(i: int) -> NotificationRequest:
+    return NotificationRequest(type=MESSAGE_TYPE, recipient_type="BROADCAST", payload=f"reminder {i}", priority=1)
+
+
+def handle(notification: NotificationRequest) -> None:
+    pass
+
+
+def per_event(bus: EventBus, events: int) -> float:
+    start = time.perf_counter()
+    for i in range(events):
+        bus.db.add(bus._new_event(make_event(i)))
+        bus.db.commit()
+    return time.perf_counter() - start
+
+
+async def batched(bus: EventBus, events: int, producers: int) -> float:
+    async def produce(offset: int):
+        for i in range(offset, events, producers):
+            await bus.save_event(make_event(i))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(produce(offset) for offset in range(producers)))
+    elapsed = time.perf_counter() - start
+    await bus.writer.stop()
+    return elapsed
+
+
+async def from_threads(bus: EventBus, events: int, producers: int) -> float:
+    await EventBus.start()
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=producers) as pool:
+        start = time.perf_counter()
+        await asyncio.gather(*(loop.run_in_executor(pool, bus.publish_event, make_event(i)) for i in range(events)))
+        elapsed = time.perf_counter() - start
+    await bus.writer.stop()
+    return elapsed
+
+
+async def per_message(db: Session, messages: int) -> float:
+    start = time.perf_counter()
+    for i in range(messages):
+        notification = make_message(i)
+        message = Message(
+            type=notification.type,
+            recipient_type=RecipientType(notification.recipient_type),
+            recipient=notification.recipient,
+            payload=notification.payload,
+            priority=notification.priority
+        )
+        db.add(message)
+        db.commit()
+        db.refresh(message)
+        handle(notification)
+    return time.perf_counter() - start
+
+
+async def send_notifications(bus: MessageBus, messages: int, producers: int) -> float:
+    async def produce(offset: int):
+        for i in range(offset, messages, producers):
+            await bus.send_notification(make_message(i))
+
+    await bus.register_message_handler(MESSAGE_TYPE, handle)
+    start = time.perf_counter()
+    await asyncio.gather(*(produce(offset) for offset in range(producers)))
+    # Until every message is handled and marked delivered
+    await bus.join()
+    elapsed = time.perf_counter() - start
+    await bus.stop()
+    return elapsed
+
+
+def measure(engine, run):
+    commits = []
+
+    def count(connection):
+        commits.append(1)
+
+    event.listen(engine, "commit", count)
+    try:
+        return run(), len(commits)
+    finally:
+        event.remove(engine, "commit", count)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=2000, help="events and messages written by every mode")
+    parser.add_argument("--producers", type=int, default=200, help="concurrent tasks or threads writing")
+    parser.add_argument("--batch-size", type=int, default=None, help="most rows per transaction")
+    parser.add_argument("--delay", type=float, default=None, help="seconds a batch waits for more rows")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'events.db')}", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=engine)
+        event_bus = EventBus(Session(bind=engine))
+        message_bus = MessageBus(Session(bind=engine))
+        for writer in (event_bus.writer, message_bus.writer):
+            if args.batch_size is not None:
+                writer.max_size = args.batch_size
+            if args.delay is not None:
+                writer.max_delay = args.delay
+
+        results = [
+            ("events, commit each", *measure(engine, lambda: per_event(event_bus, args.events))),
+            ("events, batched", *measure(engine, lambda: asyncio.run(batched(event_bus, args.events, args.producers)))),
+            ("events, from threads", *measure(engine, lambda: asyncio.run(from_threads(event_bus, args.events, args.producers)))),
+            ("messages, commit each", *measure(engine, lambda: asyncio.run(per_message(Session(bind=engine), args.events)))),
+            ("messages, batched", *measure(engine, lambda: asyncio.run(send_notifications(message_bus, args.events, args.producers)))),
+        ]
+        with Session(bind=engine) as db:
+            assert db.query(Event).count() == 3 * args.events
+            assert db.query(Message).count() == 2 * args.events
+            assert db.query(Message).filter(Message.delivered.is_(True)).count() == args.events
+        engine.dispose()
+
+    print(f"{'mode':<24}{'seconds':>10}{'rows/s':>10}{'commits':>10}")
+    for mode, seconds, commits in results:
+        print(f"{mode:<24}{seconds:>10.3f}{args.events / seconds:>10.0f}{commits:>10}")
+    print(f"({args.producers} producers)")
+
+
+if __name__ == "__main__":
+    main()
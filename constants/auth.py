@@ -0,0 +1,17 @@
+import os
+
+# Seconds the realm signing keys (JWKS) are used before they are fetched again
+JWKS_CACHE_TTL = int(os.getenv("JWKS_CACHE_TTL", "3600"))
+# Least seconds between two fetches triggered by a token signed with an unknown key
+JWKS_MIN_REFRESH_INTERVAL = int(os.getenv("JWKS_MIN_REFRESH_INTERVAL", "30"))
+# Seconds of clock skew tolerated on the exp and nbf claims
+JWT_LEEWAY = int(os.getenv("JWT_LEEWAY", "60"))
+# Issuer (iss) of the accepted tokens, e.g. https://sso.example.com/realms/coffeebreak, unset accepts any
+JWT_ISSUER = os.getenv("JWT_ISSUER")
+# Comma-separated audiences (aud) and clients (azp) a token must name one of, unset accepts any
+JWT_AUDIENCES = [audience for audience in os.getenv("JWT_AUDIENCES", "").split(",") if audience]
+JWT_AUTHORIZED_PARTIES = [client for client in os.getenv("JWT_AUTHORIZED_PARTIES", "").split(",") if client]
+# Validated tokens kept in memory, the least recently used are dropped first
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+# Seconds the claims of a validated token are reused, never past the token expiry
+TOKEN_CACHE_TTL = int(os.getenv("TOKEN_CACHE_TTL", "300"))
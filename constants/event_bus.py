@@ -0,0 +1,6 @@
+import os
+
+# Seconds an async event handler can run before it is cancelled
+EVENT_BUS_HANDLER_TIMEOUT = float(os.getenv("EVENT_BUS_HANDLER_TIMEOUT", "10"))
+# Most events handled in the background at once, publishers wait for a slot beyond that
+EVENT_BUS_BACKGROUND_LIMIT = int(os.getenv("EVENT_BUS_BACKGROUND_LIMIT", "100"))
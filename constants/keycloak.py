@@ -0,0 +1,14 @@
+import os
+
+# Threads running the Keycloak admin calls, also the most calls in flight to Keycloak at once
+KEYCLOAK_ADMIN_THREADS = int(os.getenv("KEYCLOAK_ADMIN_THREADS", "8"))
+# Seconds the directory cache keeps what it read from Keycloak
+DIRECTORY_USERS_TTL = int(os.getenv("DIRECTORY_USERS_TTL", "60"))
+DIRECTORY_ROLES_TTL = int(os.getenv("DIRECTORY_ROLES_TTL", "300"))
+DIRECTORY_GROUPS_TTL = int(os.getenv("DIRECTORY_GROUPS_TTL", "300"))
+# Members of roles and groups
+DIRECTORY_MEMBERS_TTL = int(os.getenv("DIRECTORY_MEMBERS_TTL", "60"))
+# Seconds between two background refreshes of the cached entries about to expire, 0 to disable
+DIRECTORY_REFRESH_INTERVAL = int(os.getenv("DIRECTORY_REFRESH_INTERVAL", "0"))
+# Realm roles whose members are fetched at once when listing the users of every role
+ROLE_MEMBERS_CONCURRENCY = int(os.getenv("ROLE_MEMBERS_CONCURRENCY", "8"))
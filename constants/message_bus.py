@@ -0,0 +1,22 @@
+import os
+
+# Number of tasks dispatching queued messages to their handlers
+MESSAGE_BUS_WORKERS = int(os.getenv("MESSAGE_BUS_WORKERS", "4"))
+# Maximum number of messages waiting for a worker, producers wait when it is full
+MESSAGE_BUS_QUEUE_SIZE = int(os.getenv("MESSAGE_BUS_QUEUE_SIZE", "10000"))
+# Seconds an async handler can run before it is cancelled
+MESSAGE_BUS_HANDLER_TIMEOUT = float(os.getenv("MESSAGE_BUS_HANDLER_TIMEOUT", "10"))
+# Maximum number of messages of the same type handled at once, 0 for no limit
+MESSAGE_BUS_TYPE_CONCURRENCY = int(os.getenv("MESSAGE_BUS_TYPE_CONCURRENCY", "0"))
+
+# Undelivered messages claimed by the outbox dispatcher in one go
+MESSAGE_OUTBOX_BATCH_SIZE = int(os.getenv("MESSAGE_OUTBOX_BATCH_SIZE", "100"))
+# Seconds between two looks at the outbox for messages to deliver again
+MESSAGE_OUTBOX_POLL_INTERVAL = float(os.getenv("MESSAGE_OUTBOX_POLL_INTERVAL", "5"))
+# Seconds a worker owns the messages it claimed, after that another worker can deliver them
+MESSAGE_OUTBOX_LEASE = float(os.getenv("MESSAGE_OUTBOX_LEASE", "60"))
+# Attempts after which a message is no longer retried
+MESSAGE_OUTBOX_MAX_ATTEMPTS = int(os.getenv("MESSAGE_OUTBOX_MAX_ATTEMPTS", "10"))
+# Delay before the first retry, doubled on every attempt up to MESSAGE_OUTBOX_BACKOFF_MAX seconds
+MESSAGE_OUTBOX_BACKOFF_BASE = float(os.getenv("MESSAGE_OUTBOX_BACKOFF_BASE", "1"))
+MESSAGE_OUTBOX_BACKOFF_MAX = float(os.getenv("MESSAGE_OUTBOX_BACKOFF_MAX", "300"))
@@ -0,0 +1,6 @@
+import os
+
+# Seconds before the groups of an online user are fetched again for group notifications
+GROUP_MEMBERSHIP_TTL = int(os.getenv("GROUP_MEMBERSHIP_TTL", "300"))
+# Largest page of notifications a client can request at once
+NOTIFICATIONS_PAGE_SIZE_MAX = 200
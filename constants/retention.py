@@ -0,0 +1,21 @@
+import os
+from enum import StrEnum
+
+
+class RetentionMode(StrEnum):
+    """What happens to rows older than their retention period"""
+    ARCHIVE = "archive"  # copy them to the archived_records table, then delete them
+    DELETE = "delete"  # delete them
+
+
+# Set to "true" to archive or delete old rows, every row is kept forever by default
+RETENTION_ENABLED = os.getenv("RETENTION_ENABLED", "false").lower() == "true"
+RETENTION_MODE = RetentionMode(os.getenv("RETENTION_MODE", RetentionMode.ARCHIVE))
+# Seconds between two retention passes
+RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL", "3600"))
+# Rows moved per transaction, small batches keep the hot tables available during a pass
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "1000"))
+# Retention periods in days
+NOTIFICATION_RETENTION_DAYS = int(os.getenv("NOTIFICATION_RETENTION_DAYS", "30"))
+MESSAGE_RETENTION_DAYS = int(os.getenv("MESSAGE_RETENTION_DAYS", "7"))
+EVENT_RETENTION_DAYS = int(os.getenv("EVENT_RETENTION_DAYS", "30"))
@@ -0,0 +1,32 @@
+import os
+from enum import StrEnum
+
+
+class OverflowPolicy(StrEnum):
+    """What to do when a connection's outbound queue is full"""
+    DROP_OLDEST = "drop_oldest"  # discard the oldest queued frame
+    COALESCE = "coalesce"  # replace the queued frame of the same topic (falls back to drop_oldest)
+    DISCONNECT = "disconnect"  # close the connection, the client is too slow to keep up
+
+
+# Maximum number of frames buffered per connection before the overflow policy kicks in
+WEBSOCKET_SEND_QUEUE_SIZE = int(os.getenv("WEBSOCKET_SEND_QUEUE_SIZE", "256"))
+WEBSOCKET_OVERFLOW_POLICY = OverflowPolicy(os.getenv("WEBSOCKET_OVERFLOW_POLICY", OverflowPolicy.DROP_OLDEST))
+# Close code sent to connections dropped for falling behind (1013 = try again later)
+WEBSOCKET_OVERFLOW_CLOSE_CODE = 1013
+# Maximum number of received frames waiting for the dispatcher before the reader stops reading
+WEBSOCKET_RECEIVE_QUEUE_SIZE = int(os.getenv("WEBSOCKET_RECEIVE_QUEUE_SIZE", "64"))
+# JSON encoder used for outbound frames ("orjson" or "json"), unset picks the fastest available
+WEBSOCKET_SERIALIZER = os.getenv("WEBSOCKET_SERIALIZER")
+# Idle time in seconds before a connection is pinged (60 seconds to match client)
+WEBSOCKET_IDLE_TIMEOUT = 60
+# Time in seconds a pinged connection has to answer with a PONG
+WEBSOCKET_PONG_TIMEOUT = 15
+# Close code sent to connections that did not answer a PING (1001 = going away)
+WEBSOCKET_HEARTBEAT_CLOSE_CODE = 1001
+# Number of recent frames kept per topic for clients resuming after a reconnect (0 disables replays)
+WEBSOCKET_REPLAY_BUFFER_SIZE = int(os.getenv("WEBSOCKET_REPLAY_BUFFER_SIZE", "100"))
+# Maximum number of concurrent sends in flight during a fan-out to many connections
+WEBSOCKET_FANOUT_CONCURRENCY = int(os.getenv("WEBSOCKET_FANOUT_CONCURRENCY", "100"))
+# Largest size in bytes a compressed frame received from a client may decompress to
+WEBSOCKET_MAX_DECOMPRESSED_SIZE = int(os.getenv("WEBSOCKET_MAX_DECOMPRESSED_SIZE", str(1024 * 1024)))
@@ -0,0 +1,18 @@
+import os
+from enum import StrEnum
+
+
+class WorkerBusBackend(StrEnum):
+    """Transport used to relay WebSocket deliveries between workers"""
+    LOCAL = "local"  # single worker, nothing is relayed
+    UNIX = "unix"  # Unix domain datagram sockets, for workers on the same host
+
+
+WORKER_BUS_BACKEND = WorkerBusBackend(os.getenv("WORKER_BUS_BACKEND", WorkerBusBackend.UNIX))
+# Directory holding one socket per worker, must be shared by all workers of a deployment and by no other.
+# Unset, each worker uses a directory named after its parent process (the gunicorn master)
+WORKER_BUS_SOCKET_DIR = os.getenv("WORKER_BUS_SOCKET_DIR")
+# Largest datagram sent to a peer, bigger payloads are split in chunks reassembled by the peer
+WORKER_BUS_CHUNK_SIZE = int(os.getenv("WORKER_BUS_CHUNK_SIZE", str(64 * 1024)))
+# Datagrams waiting for a busy peer to read its socket, payloads beyond it are dropped for that peer
+WORKER_BUS_PEER_QUEUE_SIZE = int(os.getenv("WORKER_BUS_PEER_QUEUE_SIZE", "4096"))
@@ -0,0 +1,6 @@
+import os
+
+# Most rows written in one transaction by a write batcher
+WRITE_BATCH_MAX_SIZE = int(os.getenv("WRITE_BATCH_MAX_SIZE", "500"))
+# Seconds a batch waits for more rows once its first row arrived
+WRITE_BATCH_MAX_DELAY = float(os.getenv("WRITE_BATCH_MAX_DELAY", "0.005"))
@@ -8,7 +8,11 @@ from keycloak.exceptions import KeycloakError
 from datetime import datetime, timedelta, UTC
 from uuid import uuid4
 from jose import jwt, JWTError
+from jwcrypto.common import JWException
+from dependencies.jwks import RealmKeyCache, UnknownSigningKeyError, UnsignedTokenError
+from dependencies.token_cache import TokenCache
 from fastapi import Request
+from constants.auth import JWT_ISSUER, JWT_AUDIENCES, JWT_AUTHORIZED_PARTIES
 
 
 def custom_urljoin(a, b):
@@ -61,6 +65,18 @@ keycloak_admin = KeycloakAdmin(
     verify=os.getenv("ENVIRONMENT", "development") == "production"
 )
 
+# Signing keys of the realm, tokens are verified without a round-trip to Keycloak
+realm_keys = RealmKeyCache(
+    lambda: keycloak_openid.certs(),
+    # Tokens carry the public URL of Keycloak, which often differs from KEYCLOAK_URL, so the
+    # issuer is only checked when it is configured
+    issuer=JWT_ISSUER,
+    audiences=JWT_AUDIENCES,
+    authorized_parties=JWT_AUTHORIZED_PARTIES
+)
+# Claims of the tokens validated recently, polling clients are validated about once per token
+token_cache = TokenCache()
+
 oauth2_scheme = OAuth2PasswordBearer(
     tokenUrl="/api/v1/token", auto_error=False)
 
@@ -107,33 +123,56 @@ def get_current_user(force_auth: bool = True):
                 raise HTTPException(
                     status_code=401, detail="Authentication error")
 
-        try:
-            if not token:
-                raise HTTPException(status_code=401, detail="No token provided")
-            token_info = keycloak_openid.decode_token(
-                token,
-                key=keycloak_openid.public_key(),
-                verify_signature=False,  # ou True se tiver certeza que está OK
-                verify_aud=True,
-                exp=True
-            )
-            token_info["type"] = "authenticated"
-            return token_info
-        except Exception as decode_error:
-            logger.warning(f"Decode failed: {decode_error}")
-            try:
-                user_info = keycloak_openid.introspect(token)
-                if user_info.get("active"):
-                    user_info["type"] = "authenticated"
-                    return user_info
-            except Exception as introspect_error:
-                logger.error(f"Introspect failed: {introspect_error}")
-                
-        raise HTTPException(status_code=401, detail="Authentication error")
+        if not token:
+            raise HTTPException(status_code=401, detail="No token provided")
+        return verify_token(token)
 
     return _get_current_user
 
 
+def verify_token(token: str) -> dict:
+    """
+    Validate a Keycloak access token and return its claims.
+    Raises HTTPException(401) if the token is not valid.
+
+    The signature and claims are checked locally with the cached realm keys, Keycloak is only
+    asked to introspect tokens that are not JWTs (e.g. opaque tokens). The claims of valid
+    tokens are cached, until the token expires at the latest.
+    """
+    if not isinstance(token, str) or not token:
+        raise HTTPException(status_code=401, detail="No token provided")
+    token_info = token_cache.get(token)
+    if token_info is None:
+        token_info = _validate_token(token)
+        token_cache.put(token, token_info)
+    return token_info
+
+
+def _validate_token(token: str) -> dict:
+    try:
+        token_info = realm_keys.verify(token)
+        token_info["type"] = "authenticated"
+        return token_info
+    except UnsignedTokenError as unsigned:
+        logger.debug(f"Local verification not possible: {unsigned}")
+    except (UnknownSigningKeyError, JWException) as invalid:
+        logger.warning(f"Invalid token: {invalid}")
+        raise HTTPException(status_code=401, detail="Authentication error")
+    except Exception as keys_error:
+        logger.error(f"Failed to get the realm keys: {keys_error}")
+        raise HTTPException(status_code=401, detail="Authentication error")
+
+    try:
+        user_info = keycloak_openid.introspect(token)
+        if user_info.get("active"):
+            user_info["type"] = "authenticated"
+            return user_info
+    except Exception as introspect_error:
+        logger.error(f"Introspect failed: {introspect_error}")
+
+    raise HTTPException(status_code=401, detail="Authentication error")
+
+
 def check_role(required_roles: list):
     def role_verifier(user_info: dict = Depends(get_current_user())):
         user_roles = user_info.get("realm_access", {}).get("roles", [])
@@ -1,6 +1,9 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, literal, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from typing import List
 import os
 import logging
 logger = logging.getLogger("coffeebreak.core")
@@ -22,3 +25,62 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def upgrade_schema(bind: Engine = engine) -> List[str]:
+    """
+    Add the columns and indexes of the models that tables created by an older version lack
+
+    create_all only creates the missing tables, this runs after it at startup. Added columns must be
+    nullable or have a scalar default, which the existing rows get. Running it again is a no-op.
+
+    Returns:
+        List[str]: The columns and indexes that were added, as "table.name"
+    """
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in columns:
+                continue
+            try:
+                with bind.begin() as connection:
+                    connection.execute(text(_add_column_ddl(bind, table, column)))
+            except DBAPIError:
+                # Another instance sharing the database may have added it first
+                if column.name not in {c["name"] for c in inspect(bind).get_columns(table.name)}:
+                    raise
+                continue
+            added.append(f"{table.name}.{column.name}")
+
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in indexes:
+                continue
+            with bind.begin() as connection:
+                index.create(connection, checkfirst=True)
+            added.append(f"{table.name}.{index.name}")
+
+    for name in added:
+        logger.info(f"Added {name} to the database schema")
+    return added
+
+
+def _add_column_ddl(bind: Engine, table, column) -> str:
+    """ALTER TABLE statement adding a column, with its scalar default so existing rows get a value"""
+    preparer = bind.dialect.identifier_preparer
+    ddl = f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} {column.type.compile(dialect=bind.dialect)}"
+    default = column.default.arg if column.default is not None and column.default.is_scalar else None
+    if default is not None:
+        value = literal(default, column.type).compile(dialect=bind.dialect, compile_kwargs={"literal_binds": True})
+        ddl += f" DEFAULT {value}"
+    if not column.nullable:
+        if default is None:
+            raise RuntimeError(f"Cannot add {table.name}.{column.name} to existing rows, it is not nullable and has no default")
+        ddl += " NOT NULL"
+    return ddl
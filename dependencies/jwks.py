@@ -0,0 +1,143 @@
+from typing import Callable, Iterable, Optional
+from jwcrypto import jwk, jws, jwt
+from jwcrypto.common import JWException, json_decode
+from constants.auth import JWKS_CACHE_TTL, JWKS_MIN_REFRESH_INTERVAL, JWT_LEEWAY
+import logging
+import threading
+import time
+
+logger = logging.getLogger("coffeebreak.core")
+
+# Asymmetric algorithms Keycloak signs access tokens with
+SIGNING_ALGORITHMS = ["RS256", "RS384", "RS512", "PS256", "PS384", "PS512", "ES256", "ES384", "ES512"]
+
+
+class UnknownSigningKeyError(Exception):
+    """The token is not signed by any key of the realm, even after fetching them again"""
+
+
+class UnsignedTokenError(Exception):
+    """The token is not a signed JWT (e.g. an opaque token), only Keycloak can validate it"""
+
+
+class RealmKeyCache:
+    """
+    The signing keys of the realm, for verifying tokens without asking Keycloak
+
+    The JWKS is fetched on first use and again once `ttl` seconds have passed, or when a token
+    names a key id (kid) that is not known yet, which is how a key rotation shows up. Fetches
+    caused by unknown key ids are at most one every `min_refresh_interval` seconds, so tokens
+    with made-up key ids cannot make every request call Keycloak. Safe to use from threads.
+
+    Besides the signature and validity period, verify checks that the token is an access token
+    ("typ" claim) issued by the realm, and for the configured audiences and clients if any.
+
+    Args:
+        fetch_certs: Returns the JWKS of the realm, e.g. KeycloakOpenID.certs
+        issuer: Expected "iss" claim, not checked if None
+        audiences: The "aud" claim must contain one of them, not checked if empty
+        authorized_parties: The "azp" claim must be one of them, not checked if empty
+        token_type: Expected "typ" claim, not checked if None
+    """
+    def __init__(
+        self,
+        fetch_certs: Callable[[], dict],
+        ttl: float = JWKS_CACHE_TTL,
+        min_refresh_interval: float = JWKS_MIN_REFRESH_INTERVAL,
+        leeway: int = JWT_LEEWAY,
+        issuer: Optional[str] = None,
+        audiences: Iterable[str] = (),
+        authorized_parties: Iterable[str] = (),
+        token_type: Optional[str] = "Bearer"
+    ):
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.leeway = leeway
+        self.issuer = issuer
+        self.audiences = set(audiences)
+        self.authorized_parties = set(authorized_parties)
+        self.token_type = token_type
+        self._fetch_certs = fetch_certs
+        self._keys: Optional[jwk.JWKSet] = None
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self) -> jwk.JWKSet:
+        """Fetch the keys of the realm"""
+        keys = jwk.JWKSet()
+        for key in self._fetch_certs().get("keys", []):
+            # Keys for encryption are also listed, only the signing ones verify tokens
+            if key.get("use", "sig") == "sig":
+                keys.add(jwk.JWK(**key))
+        self._keys = keys
+        self._fetched_at = time.monotonic()
+        logger.info(f"Fetched {len(keys['keys'])} realm signing keys")
+        return keys
+
+    def get_key(self, kid: Optional[str]) -> Optional[jwk.JWK]:
+        """Get the signing key with an id, fetching the keys again if they expired or the id is new"""
+        with self._lock:
+            age = time.monotonic() - self._fetched_at
+            if self._keys is None or age >= self.ttl:
+                self.refresh()
+                age = 0
+            key = self._find(kid)
+            if key is None and age >= self.min_refresh_interval:
+                self.refresh()
+                key = self._find(kid)
+            return key
+
+    def verify(self, token: str) -> dict:
+        """
+        Check the signature, validity period and claims of a token
+
+        Returns:
+            dict: The claims of the token
+
+        Raises:
+            UnsignedTokenError: The token is not a signed JWT
+            UnknownSigningKeyError: No key of the realm signed the token
+            JWException: The token is malformed, its signature does not match, it expired or
+                it was not issued as an access token for this service
+        """
+        header = self._header(token)
+        if header.get("alg") not in SIGNING_ALGORITHMS:
+            raise UnknownSigningKeyError(f"Token signed with {header.get('alg')}")
+        key = self.get_key(header.get("kid"))
+        if key is None:
+            raise UnknownSigningKeyError(f"No realm key with id {header.get('kid')}")
+
+        verified = jwt.JWT(algs=SIGNING_ALGORITHMS)
+        verified.leeway = self.leeway
+        verified.deserialize(token, key)
+        claims = json_decode(verified.claims)
+        self._check_claims(claims)
+        return claims
+
+    def _check_claims(self, claims: dict) -> None:
+        if self.issuer is not None and claims.get("iss") != self.issuer:
+            raise jwt.JWTInvalidClaimValue(f"Invalid 'iss' value {claims.get('iss')}")
+        if self.token_type is not None and claims.get("typ") != self.token_type:
+            raise jwt.JWTInvalidClaimValue(f"Invalid 'typ' value {claims.get('typ')}")
+        if self.audiences:
+            audience = claims.get("aud", [])
+            if self.audiences.isdisjoint([audience] if isinstance(audience, str) else audience):
+                raise jwt.JWTInvalidClaimValue(f"Invalid 'aud' value {audience}")
+        if self.authorized_parties and claims.get("azp") not in self.authorized_parties:
+            raise jwt.JWTInvalidClaimValue(f"Invalid 'azp' value {claims.get('azp')}")
+
+    def _find(self, kid: Optional[str]) -> Optional[jwk.JWK]:
+        if kid is not None:
+            return self._keys.get_key(kid)
+        # Without a key id the realm must have a single signing key
+        keys = list(self._keys)
+        return keys[0] if len(keys) == 1 else None
+
+    @staticmethod
+    def _header(token: str) -> dict:
+        token_jws = jws.JWS()
+        try:
+            token_jws.deserialize(token)
+        except (JWException, ValueError) as e:
+            raise UnsignedTokenError(f"Not a signed token: {str(e)}")
+        return json_decode(token_jws.objects.get("protected", "{}"))
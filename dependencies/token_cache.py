@@ -0,0 +1,74 @@
+from collections import OrderedDict
+from typing import Optional, Tuple
+from constants.auth import TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL
+import hashlib
+import threading
+import time
+
+
+class TokenCache:
+    """
+    Claims of the tokens validated recently, so a token is validated about once
+
+    Entries are keyed by a digest of the token (the tokens themselves are not kept), dropped
+    once `ttl` seconds have passed or the token expired, whichever comes first, and the least
+    recently used entries are evicted beyond `max_size`. Safe to use from threads.
+    """
+    def __init__(self, max_size: int = TOKEN_CACHE_SIZE, ttl: float = TOKEN_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # digest -> (wall clock time the entry expires at, claims)
+        self._entries: "OrderedDict[bytes, Tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[dict]:
+        """Get the claims of a token validated before, None if it has to be validated"""
+        digest = self._digest(token)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None and entry[0] > time.time():
+                self._entries.move_to_end(digest)
+                self.hits += 1
+                # The callers may change the claims, they get their own copy
+                return dict(entry[1])
+            if entry is not None:
+                del self._entries[digest]
+            self.misses += 1
+            return None
+
+    def put(self, token: str, claims: dict) -> None:
+        """Remember the claims of a valid token, until its exp claim at the latest"""
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        if isinstance(claims.get("exp"), (int, float)):
+            expires_at = min(expires_at, claims["exp"])
+        digest = self._digest(token)
+        with self._lock:
+            self._entries[digest] = (expires_at, dict(claims))
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, token: Optional[str] = None) -> None:
+        """Forget a token (e.g. after a logout), or every token"""
+        with self._lock:
+            if token is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(self._digest(token), None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -13,10 +13,16 @@ import logging
 from contextlib import asynccontextmanager
 from plugin_loader import plugin_loader
 from dependencies.app import set_current_app
-from dependencies.database import engine, Base
+from dependencies.database import engine, Base, upgrade_schema
 from swagger import configure_swagger_ui
 from plugin_loader import plugin_unloader
 from defaults import initialize_defaults
+from services.worker_bus import get_worker_bus
+from services.retention import get_retention_service
+from services.message_bus import MessageBus
+from services.event_bus import EventBus
+from services.keycloak_admin import get_keycloak_admin
+from services.directory import get_directory
 from sqlalchemy.exc import OperationalError
 
 logger = logging.getLogger("coffeebreak")
@@ -78,6 +84,8 @@ async def lifespan(app: FastAPI):
         try:
             # Create tables with checkfirst=True to avoid errors with existing objects
             Base.metadata.create_all(bind=engine, checkfirst=True)
+            # Tables created by an older version get the columns and indexes added since
+            upgrade_schema(engine)
         except OperationalError as e:
             logger.error(f"Database connection error: {e}")
             raise RuntimeError("Could not connect to the database")
@@ -126,10 +134,39 @@ async def lifespan(app: FastAPI):
         logger.debug(
             f"Route: {route.path} [{route.methods if hasattr(route, 'methods') else 'WebSocket'}]")
 
+    # Relay real-time deliveries between workers
+    worker_bus = get_worker_bus()
+    await worker_bus.start()
+
+    # Deliver again the messages whose handlers failed or did not finish before a restart
+    message_bus = MessageBus()
+    await message_bus.start()
+    # Coroutine event handlers of events published from threadpool routes run on this loop
+    await EventBus.start()
+
+    # Cache of the Keycloak users, roles and groups, refreshed in the background if configured
+    directory = get_directory()
+    await directory.start()
+
+    # Archive old notifications, messages and events in the background
+    retention_service = get_retention_service()
+    if retention_service is not None:
+        await retention_service.start()
+
     try:
         yield
     finally:
+        if retention_service is not None:
+            await retention_service.stop()
+        await directory.stop()
+        # Let the queued messages reach their handlers before the worker bus goes away
+        await message_bus.stop()
+        # The event bus only exists once a plugin used it
+        if EventBus._instance is not None:
+            await EventBus._instance.stop()
+        await worker_bus.stop()
         await plugin_unloader(routes_app)
+        get_keycloak_admin().shutdown()
 
 
 app.router.lifespan_context = lifespan
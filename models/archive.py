@@ -0,0 +1,17 @@
+from dependencies.database import Base
+from sqlalchemy import Column, Integer, String, DateTime, JSON, Index
+from datetime import UTC, datetime
+
+class ArchivedRecord(Base):
+    """A row moved out of a hot table by the retention job"""
+    __tablename__ = "archived_records"
+    __table_args__ = (
+        Index("ix_archived_records_source", "source", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    source = Column(String, nullable=False)  # Name of the table the row came from
+    record_id = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=True)
+    archived_at = Column(DateTime, default=lambda: datetime.now(UTC))
+    data = Column(JSON, nullable=False)
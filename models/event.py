@@ -7,6 +7,6 @@ class Event(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     event_type = Column(String, index=True)
-    timestamp = Column(DateTime, default=lambda: datetime.now(UTC))
+    timestamp = Column(DateTime, default=lambda: datetime.now(UTC), index=True)
     payload = Column(String)
     details = Column(JSON)
\ No newline at end of file
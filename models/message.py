@@ -1,11 +1,22 @@
 from dependencies.database import Base
-from sqlalchemy import Column, Integer, String, Boolean, DateTime
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Index
 from sqlalchemy.types import Enum as SQLAlchemyEnum
 from schemas.notification import RecipientType
 from datetime import UTC, datetime
 
 class Message(Base):
+    """
+    A message sent through the MessageBus, the table doubles as its outbox
+
+    Undelivered messages are claimed by one worker at a time (claimed_by until claimed_until)
+    and retried from next_attempt_at until their handlers succeed, skipping the handlers listed
+    in handled_by (a JSON list) that already succeeded.
+    """
     __tablename__ = "messages"
+    __table_args__ = (
+        # The outbox dispatcher only looks at the undelivered messages that are due
+        Index("ix_messages_outbox", "delivered", "next_attempt_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     type = Column(String, nullable=False)
@@ -14,4 +25,10 @@ class Message(Base):
     payload = Column(String, nullable=False)
     priority = Column(Integer, nullable=False)
     delivered = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=datetime.now(UTC))
+    created_at = Column(DateTime, default=lambda: datetime.now(UTC), index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(String, nullable=True)
+    next_attempt_at = Column(DateTime, default=lambda: datetime.now(UTC))
+    claimed_by = Column(String, nullable=True)
+    claimed_until = Column(DateTime, nullable=True)
+    handled_by = Column(String, nullable=True)
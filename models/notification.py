@@ -1,21 +1,54 @@
 from dependencies.database import Base
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
 from sqlalchemy.types import Enum as SQLAlchemyEnum
 from schemas.notification import RecipientType
 from datetime import UTC, datetime
 
 class Notification(Base):
     __tablename__ = "notifications"
+    __table_args__ = (
+        # Unread lookups filter on the recipient and page through the ids
+        Index("ix_notifications_recipient", "recipient_type", "recipient", "id"),
+        Index("ix_notifications_created_at", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     recipient_type = Column(SQLAlchemyEnum(RecipientType), nullable=False)
     recipient = Column(String, nullable=True)  # Can be null for BROADCAST
     payload = Column(String, nullable=False)
-    created_at = Column(DateTime, default=datetime.now(UTC))
+    created_at = Column(DateTime, default=lambda: datetime.now(UTC))
 
 class NotificationRead(Base):
     __tablename__ = "notification_reads"
+    __table_args__ = (
+        # The primary key starts with notification_id, lookups are per user
+        Index("ix_notification_reads_user", "user_id", "notification_id"),
+    )
 
     notification_id = Column(Integer, ForeignKey("notifications.id"), primary_key=True)
     user_id = Column(String, primary_key=True)
-    read_at = Column(DateTime, default=datetime.now(UTC)) 
\ No newline at end of file
+    read_at = Column(DateTime, default=lambda: datetime.now(UTC))
+
+class NotificationReadWatermark(Base):
+    """Every notification with an id up to read_up_to counts as read by the user"""
+    __tablename__ = "notification_read_watermarks"
+
+    user_id = Column(String, primary_key=True)
+    read_up_to = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC))
+
+class NotificationCounter(Base):
+    """
+    Unread notifications of a user, as counted up to a notification id
+
+    Notifications created after counted_up_to are added to the count the next time it is read,
+    so new notifications never have to update a row per recipient. The count is made against the
+    groups of the user at the time (a sorted JSON list) and made again once they change.
+    """
+    __tablename__ = "notification_counters"
+
+    user_id = Column(String, primary_key=True)
+    unread = Column(Integer, nullable=False, default=0)
+    counted_up_to = Column(Integer, nullable=False, default=0)
+    groups = Column(String, nullable=True)
+    updated_at = Column(DateTime, default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC))
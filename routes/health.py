@@ -1,7 +1,8 @@
 from fastapi import APIRouter
+from dependencies.auth import token_cache
 
 router = APIRouter()
 
 @router.get("/")
 async def health():
-    return {"status": "ok"}
\ No newline at end of file
+    return {"status": "ok", "token_cache": token_cache.stats()}
@@ -1,11 +1,12 @@
-from fastapi import APIRouter, Depends, WebSocket, HTTPException
+from fastapi import APIRouter, Depends, WebSocket, HTTPException, Query
 from dependencies.auth import get_current_user
 from sqlalchemy.orm import Session
-from dependencies.database import get_db
+from dependencies.database import get_db, SessionLocal
 from services.notifications import NotificationService
 from services.websocket_service import WebSocketService, WebSocketConnection
-from schemas.notification import NotificationResponse
-from typing import List
+from schemas.notification import MarkReadRequest, NotificationResponse
+from constants.notifications import NOTIFICATIONS_PAGE_SIZE_MAX
+from typing import List, Optional
 import logging
 
 logger = logging.getLogger("coffeebreak.notifications")
@@ -18,38 +19,55 @@ websocket_service = WebSocketService()
 async def handle_notification_message(connection: WebSocketConnection, message: dict):
     logger.debug(f"Received notification message: {message}")
     try:
-        notification_service = NotificationService(None)
-        action = message.get("action")
+        # WebSocket actions are not tied to a request, each one gets its own session
+        with SessionLocal() as db:
+            notification_service = NotificationService()
+            action = message.get("action")
+
+            if action == "mark_read":
+                notification_ids = message.get("notification_ids", [])
+                # Inclusive [first id, last id] pairs, to mark a whole page at once
+                ranges = [(int(first), int(last)) for first, last in message.get("ranges", [])]
+                count = await notification_service.mark_notifications_read(db, connection.user_id, notification_ids, ranges)
+                await connection.send("notifications", {
+                    "action": "mark_read",
+                    "status": "success",
+                    "notification_ids": notification_ids,
+                    "ranges": ranges,
+                    "count": count
+                })
+
+            elif action == "get_unread":
+                # Optional keyset pagination, the next page starts before the last id received
+                limit = message.get("limit")
+                if limit is not None:
+                    limit = max(1, min(int(limit), NOTIFICATIONS_PAGE_SIZE_MAX))
+                before_id = message.get("before_id")
+                notifications = await notification_service.get_user_notifications(
+                    db,
+                    connection.user_id,
+                    before_id=int(before_id) if before_id is not None else None,
+                    limit=limit
+                )
+                # Convert notifications to NotificationResponse format
+                notification_responses = [NotificationResponse.model_validate(n).model_dump() for n in notifications]
+                await connection.send("notifications", {
+                    "action": "unread_notifications",
+                    "status": "success",
+                    "notifications": notification_responses,
+                    "next_before_id": notifications[-1].id if limit is not None and len(notifications) == limit else None
+                })
+
+            else:
+                logger.warning(f"Unknown notification action: {action}")
+                await connection.send("notifications", {
+                    "status": "error",
+                    "message": "Unknown action"
+                })
 
-        if action == "mark_read":
-            notification_ids = message.get("notification_ids", [])
-            await notification_service.mark_notifications_read(connection.user_id, notification_ids)
-            await connection.send({
-                "action": "mark_read",
-                "status": "success",
-                "notification_ids": notification_ids
-            })
-        
-        elif action == "get_unread":
-            notifications = await notification_service.get_user_notifications(connection.user_id)
-            # Convert notifications to NotificationResponse format
-            notification_responses = [NotificationResponse.model_validate(n).model_dump() for n in notifications]
-            await connection.send({
-                "action": "unread_notifications",
-                "status": "success",
-                "notifications": notification_responses
-            })
-        
-        else:
-            logger.warning(f"Unknown notification action: {action}")
-            await connection.send({
-                "status": "error",
-                "message": "Unknown action"
-            })
-            
     except Exception as e:
         logger.error(f"Error handling notification message: {str(e)}")
-        await connection.send({
+        await connection.send("notifications", {
             "status": "error",
             "message": "Internal server error"
         })
@@ -59,6 +77,13 @@ async def handle_notification_subscription(connection: WebSocketConnection):
     """Handle new subscription to notifications topic"""
     logger.debug(f"New subscription to notifications topic from connection {connection.connection_id}")
     NotificationService().add_connection(connection)
+    if connection.is_authenticated():
+        # Send the badge count right away, it is pushed again whenever it changes
+        try:
+            with SessionLocal() as db:
+                await NotificationService().track_unread_count(db, connection.user_id)
+        except Exception as e:
+            logger.error(f"Failed to send the unread count: {str(e)}")
 
 @websocket_service.on_unsubscribe("notifications")
 async def handle_notification_unsubscribe(connection: WebSocketConnection):
@@ -68,12 +93,34 @@ async def handle_notification_unsubscribe(connection: WebSocketConnection):
 
 @router.get("/", response_model=List[NotificationResponse])
 async def get_notifications(
+    before_id: Optional[int] = Query(None, description="Only return notifications older than this id"),
+    limit: Optional[int] = Query(None, ge=1, le=NOTIFICATIONS_PAGE_SIZE_MAX, description="Maximum number of notifications"),
+    userdata: dict = Depends(get_current_user(force_auth=False)),
+    db: Session = Depends(get_db)
+):
+    """Get the unread notifications for the user (authenticated or anonymous), newest first"""
+    notification_service = NotificationService()
+    return await notification_service.get_user_notifications(db, userdata["sub"], before_id=before_id, limit=limit)
+
+@router.get("/unread-count")
+async def get_unread_count(
+    userdata: dict = Depends(get_current_user(force_auth=False)),
+    db: Session = Depends(get_db)
+):
+    """Get the number of unread notifications for the user"""
+    notification_service = NotificationService()
+    return {"count": await notification_service.get_unread_count(db, userdata["sub"])}
+
+@router.post("/read")
+async def mark_notifications_read(
+    request: MarkReadRequest,
     userdata: dict = Depends(get_current_user(force_auth=False)),
     db: Session = Depends(get_db)
 ):
-    """Get all unread notifications for the user (authenticated or anonymous)"""
-    notification_service = NotificationService(db)
-    return await notification_service.get_user_notifications(userdata["sub"])
+    """Mark notifications as read by id and by inclusive id ranges"""
+    notification_service = NotificationService()
+    count = await notification_service.mark_notifications_read(db, userdata["sub"], request.notification_ids, request.ranges)
+    return {"status": "success", "message": "Notifications marked as read", "count": count}
 
 @router.post("/{notification_id}/read")
 async def mark_notification_read(
@@ -82,8 +129,8 @@ async def mark_notification_read(
     db: Session = Depends(get_db)
 ):
     """Mark a specific notification as read"""
-    notification_service = NotificationService(db)
-    await notification_service.mark_notifications_read(userdata["sub"], [notification_id])
+    notification_service = NotificationService()
+    await notification_service.mark_notifications_read(db, userdata["sub"], [notification_id])
     return {"status": "success", "message": "Notification marked as read"}
 
 @router.post("/read-all")
@@ -92,15 +139,10 @@ async def mark_all_notifications_read(
     db: Session = Depends(get_db)
 ):
     """Mark all unread notifications as read"""
-    notification_service = NotificationService(db)
-    # Get all unread notifications first
-    notifications = await notification_service.get_user_notifications(userdata["sub"])
-    notification_ids = [n.id for n in notifications]
-    # Mark them all as read
-    if notification_ids:
-        await notification_service.mark_notifications_read(userdata["sub"], notification_ids)
+    notification_service = NotificationService()
+    count = await notification_service.mark_all_notifications_read(db, userdata["sub"])
     return {
         "status": "success", 
         "message": "All notifications marked as read",
-        "count": len(notification_ids)
+        "count": count
     }
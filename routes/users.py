@@ -1,7 +1,9 @@
-from typing import List, Dict
-from fastapi import APIRouter, Depends, HTTPException, Request
+from typing import AsyncIterator, List, Dict, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from schemas.user import User as UserSchema, UserCreate
-from dependencies.auth import get_current_user, check_role, keycloak_admin
+from dependencies.auth import get_current_user, check_role
+from services.directory import get_directory
 from services.user_service import (
     create_user,
     get_user,
@@ -9,9 +11,11 @@ from services.user_service import (
     update_user,
     delete_user,
     list_roles,
-    list_role_users
+    list_role_users,
+    iter_role_users
 )
 from exceptions.user import UserError
+import json
 import logging
 
 logger = logging.getLogger("coffeebreak.core")
@@ -77,14 +81,30 @@ async def list_roles_endpoint():
 
 
 @router.get("/roles/users/", dependencies=[Depends(check_role(["manage_users"]))])
-async def list_roles_endpoint():
+async def list_roles_endpoint(
+    first: Optional[int] = Query(None, ge=0, description="Index of the first member of each role"),
+    max: Optional[int] = Query(None, ge=1, description="Maximum number of members of each role"),
+    stream: bool = Query(False, description="Stream one JSON line per role as soon as its members arrive")
+):
+    if stream:
+        return StreamingResponse(_stream_role_users(first, max), media_type="application/x-ndjson")
     try:
-        role_users = await list_role_users()
+        role_users = await list_role_users(first, max)
         return role_users
     except UserError as e:
         raise HTTPException(status_code=e.status_code, detail=str(e))
 
 
+async def _stream_role_users(first: Optional[int], max: Optional[int]) -> AsyncIterator[str]:
+    try:
+        async for role_name, users in iter_role_users(first, max):
+            yield json.dumps({"role": role_name, "users": users}) + "\n"
+    except UserError as e:
+        # The status is already sent, the error is the last line
+        logger.error(f"Failed to stream the role users: {str(e)}")
+        yield json.dumps({"error": str(e)}) + "\n"
+
+
 @router.get("/{user_id}", response_model=UserSchema, dependencies=[Depends(check_role(["manage_users"]))])
 async def get_user_endpoint(user_id: str):
     try:
@@ -128,7 +148,7 @@ async def get_permissions():
     Returns a dictionary with permissions list, excluding native Keycloak roles.
     """
     try:
-        roles = keycloak_admin.get_realm_roles()
+        roles = await get_directory().roles()
 
         permissions = []
 
@@ -1,10 +1,8 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from typing import Optional
-from services.websocket_service import WebSocketService
-from dependencies.auth import get_current_user
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException
+from services.websocket_service import WebSocketService, WebSocketConnection
+from dependencies.auth import verify_token
 import uuid
 import logging
-import json
 import asyncio
 
 logger = logging.getLogger("coffeebreak.websocket")
@@ -12,7 +10,7 @@ logger = logging.getLogger("coffeebreak.websocket")
 # Configure CORS for WebSocket
 router = APIRouter()
 
-async def send_subscription_confirmation(websocket: WebSocket, topic: str, status: str, message: str = None):
+async def send_subscription_confirmation(connection: WebSocketConnection, topic: str, status: str, message: str = None):
     """Helper function to send subscription confirmation"""
     response = {
         "type": "subscription_result",
@@ -21,13 +19,161 @@ async def send_subscription_confirmation(websocket: WebSocket, topic: str, statu
     }
     if message:
         response["message"] = message
-    
+    if status == "success":
+        # Position in the topic stream, for resuming after a reconnect
+        websocket_service = WebSocketService()
+        response["stream"] = websocket_service.stream_id
+        response["seq"] = websocket_service.last_seq(topic)
+
     try:
-        await websocket.send_json(response)
+        await connection._send(response)
         logger.debug(f"Sent subscription confirmation for topic {topic}: {status}")
     except Exception as e:
         logger.error(f"Failed to send subscription confirmation: {str(e)}")
 
+async def handle_client_message(connection: WebSocketConnection, message: dict):
+    """
+    Handle a message received from a client, called by the connection dispatcher
+    (PING/PONG frames are answered by the receive loop and never reach this function)
+    """
+    websocket_service = WebSocketService()
+    connection_id = connection.connection_id
+    message_type = message.get("type", "")
+    logger.debug(f"Received message type: {message_type}")
+
+    # Handle authentication message
+    if message_type == "authenticate":
+        token = message.get("token")
+        if not isinstance(token, str) or not token:
+            await connection._send({
+                "type": "authentication_result",
+                "status": "error",
+                "message": "Invalid authentication token"
+            })
+            return
+
+        try:
+            # Set a timeout for authentication
+            user = await asyncio.wait_for(
+                asyncio.to_thread(verify_token, token),
+                timeout=10.0
+            )
+
+            # Associate user_id with the connection
+            await websocket_service.authenticate(connection_id, user["sub"])
+
+            # Optional binary encoding / compression requested by the client
+            encoding, compression = websocket_service.negotiate_codec(
+                message.get("encoding"),
+                message.get("compression")
+            )
+
+            # Send authentication success message, still as JSON text
+            await connection._send({
+                "type": "authentication_result",
+                "status": "success",
+                "user_id": user["sub"],
+                "encoding": encoding,
+                "compression": compression
+            })
+
+            # Every frame after the authentication result uses the negotiated codec
+            websocket_service.set_codec(connection_id, encoding, compression)
+        except HTTPException:
+            await connection._send({
+                "type": "authentication_result",
+                "status": "error",
+                "message": "Invalid authentication token"
+            })
+        except (asyncio.TimeoutError) as e:
+            logger.debug("Authentication timeout")
+            await connection._send({
+                "type": "authentication_result",
+                "status": "error",
+                "message": "Authentication failed"
+            })
+        except Exception as e:
+            logger.error(f"Authentication error: {str(e)}")
+            await connection._send({
+                "type": "authentication_result",
+                "status": "error",
+                "message": "Authentication failed"
+            })
+
+    # Handle subscription messages
+    elif message_type == "subscribe" and "topic" in message:
+        topic = message["topic"]
+
+        try:
+            # Attempt to subscribe
+            await websocket_service.subscribe(connection_id, topic)
+
+            # Send success confirmation
+            await send_subscription_confirmation(connection, topic, "success")
+            logger.info(f"Successfully subscribed to topic {topic}")
+
+        except Exception as e:
+            logger.error(f"Failed to subscribe to topic {topic}: {str(e)}")
+            await send_subscription_confirmation(
+                connection,
+                topic,
+                "error",
+                f"Failed to subscribe: {str(e)}"
+            )
+
+    # Handle resume messages, sent by clients reconnecting with the last sequence number they received
+    elif message_type == "resume" and "topic" in message:
+        topic = message["topic"]
+        try:
+            last_seq = int(message.get("last_seq", 0))
+            await websocket_service.resume(connection_id, topic, message.get("stream"), last_seq)
+        except (TypeError, ValueError):
+            await connection._send({
+                "type": "resume_result",
+                "status": "error",
+                "topic": topic,
+                "message": "Invalid last_seq"
+            })
+
+    # Handle unsubscribe messages
+    elif message_type == "unsubscribe" and "topic" in message:
+        topic = message["topic"]
+        try:
+            await websocket_service.unsubscribe(connection_id, topic)
+            await connection._send({
+                "type": "unsubscription_result",
+                "status": "success",
+                "topic": topic
+            })
+            logger.info(f"Successfully unsubscribed from topic {topic}")
+        except Exception as e:
+            logger.error(f"Failed to unsubscribe from topic {topic}: {str(e)}")
+            await connection._send({
+                "type": "unsubscription_result",
+                "status": "error",
+                "topic": topic,
+                "message": f"Failed to unsubscribe: {str(e)}"
+            })
+
+    # Handle topic-specific messages
+    elif message_type == "message" and "topic" in message and "data" in message:
+        topic = message["topic"]
+        # Check if user is subscribed to the topic
+        if not connection.has_subscription(topic):
+            await connection._send({
+                "type": "message_result",
+                "status": "error",
+                "message": "Not subscribed to this topic"
+            })
+            return
+
+        # Handle message with registered topic handlers
+        await websocket_service.handle_topic_message(
+            connection,
+            topic,
+            message["data"]
+        )
+
 @router.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     """
@@ -35,140 +181,25 @@ async def websocket_endpoint(websocket: WebSocket):
     Supports both authenticated and unauthenticated connections
     """
     logger.info("Received WebSocket connection request")
+    websocket_service = WebSocketService()
+    # Generate unique connection ID for this connection
+    connection_id = str(uuid.uuid4())
+
     try:
-        websocket_service = WebSocketService()
-        # Generate unique connection ID for this connection
-        connection_id = str(uuid.uuid4())
-        
-        try:
-            # Connect without authentication
-            await websocket_service.connect(websocket, connection_id)
-            logger.info("New WebSocket connection accepted")
-            
-            while True:
-                # Wait for messages from the client
-                try:
-                    message = await websocket.receive_json()
-                    logger.debug(f"Received message: {message}")
-                    message_type = message.get("type", "")
-                    logger.debug(f"Received message type: {message_type}")
-
-                    # Handle PING/PONG messages immediately
-                    if message_type == "ping":
-                        logger.debug(f"Received PING from {connection_id}, sending PONG")
-                        await websocket.send_json({"type": "pong"})
-                        # Update activity and continue to next message
-                        await websocket_service.update_activity(connection_id)
-                        continue
-                    elif message_type == "pong":
-                        # Just update activity and continue
-                        await websocket_service.update_activity(connection_id)
-                        continue
-
-                    # Update last activity timestamp for any other message
-                    await websocket_service.update_activity(connection_id)
-
-                    # Handle authentication message
-                    if message_type == "authenticate":
-                        try:
-                            # Set a timeout for authentication
-                            user = await asyncio.wait_for(
-                                get_current_user(message["token"]),
-                                timeout=10.0
-                            )
-                            
-                            if user:
-                                # Associate user_id with the connection
-                                await websocket_service.authenticate(connection_id, user.id)
-                                
-                                # Send authentication success message
-                                await websocket.send_json({
-                                    "type": "authentication_result",
-                                    "status": "success",
-                                    "user_id": user.id
-                                })
-                            else:
-                                await websocket.send_json({
-                                    "type": "authentication_result",
-                                    "status": "error",
-                                    "message": "Invalid authentication token"
-                                })
-                        except (asyncio.TimeoutError) as e:
-                            logger.debug("Authentication timeout")
-                            await websocket.send_json({
-                                "type": "authentication_result",
-                                "status": "error",
-                                "message": "Authentication failed"
-                            })
-
-                    # Handle subscription messages
-                    elif message_type == "subscribe" and "topic" in message:
-                        topic = message["topic"]
-                        
-                        try:
-                            # Attempt to subscribe
-                            await websocket_service.subscribe(connection_id, topic)
-                            
-                            # Send success confirmation
-                            await send_subscription_confirmation(websocket, topic, "success")
-                            logger.info(f"Successfully subscribed to topic {topic}")
-
-                        except Exception as e:
-                            logger.error(f"Failed to subscribe to topic {topic}: {str(e)}")
-                            await send_subscription_confirmation(
-                                websocket, 
-                                topic, 
-                                "error", 
-                                f"Failed to subscribe: {str(e)}"
-                            )
-
-                    # Handle unsubscribe messages
-                    elif message_type == "unsubscribe" and "topic" in message:
-                        topic = message["topic"]
-                        try:
-                            await websocket_service.unsubscribe(connection_id, topic)
-                            await websocket.send_json({
-                                "type": "unsubscription_result",
-                                "status": "success",
-                                "topic": topic
-                            })
-                            logger.info(f"Successfully unsubscribed from topic {topic}")
-                        except Exception as e:
-                            logger.error(f"Failed to unsubscribe from topic {topic}: {str(e)}")
-                            await websocket.send_json({
-                                "type": "unsubscription_result",
-                                "status": "error",
-                                "topic": topic,
-                                "message": f"Failed to unsubscribe: {str(e)}"
-                            })
-
-                    # Handle topic-specific messages
-                    elif message_type == "message" and "topic" in message and "data" in message:
-                        topic = message["topic"]
-                        # Check if user is subscribed to the topic
-                        if topic not in websocket_service.subscriptions.get(connection_id, set()):
-                            await websocket.send_json({
-                                "type": "message_result",
-                                "status": "error",
-                                "message": "Not subscribed to this topic"
-                            })
-                            continue
-
-                        # Handle message with registered topic handlers
-                        await websocket_service.handle_topic_message(
-                            connection_id,
-                            topic,
-                            message["data"]
-                        )
-
-                except json.JSONDecodeError:
-                    logger.warning(f"Received invalid JSON from {connection_id}")
-                    continue
-
-        except WebSocketDisconnect:
-            logger.info(f"WebSocket disconnected (connection_id: {connection_id})")
-            await websocket_service.disconnect(connection_id)
+        # Connect without authentication
+        connection = await websocket_service.connect(websocket, connection_id)
+        logger.info("New WebSocket connection accepted")
+
+        # Single receive loop, messages are handled by the connection dispatcher
+        await websocket_service.listen(connection, handle_client_message)
+
+    except WebSocketDisconnect:
+        logger.info(f"WebSocket disconnected (connection_id: {connection_id})")
+        await websocket_service.disconnect(connection_id)
 
     except Exception as e:
         logger.error(f"WebSocket error: {str(e)}")
-        await websocket.close(code=1011)  # Internal error
+        if connection_id in websocket_service.connections:
+            await websocket_service.disconnect(connection_id, code=1011)  # Internal error
+        else:
+            await websocket.close(code=1011)  # Internal error
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, field_serializer
 from enum import Enum
-from typing import List, Dict, Union, Optional
+from typing import List, Dict, Tuple, Union, Optional
 from datetime import datetime
 
 
@@ -22,6 +22,12 @@ class NotificationRequest(BaseModel):
         return f"NotificationRequest(type={self.type}, recipient_type={self.recipient_type}, recipient={self.recipient}, priority={self.priority})"
 
 
+class MarkReadRequest(BaseModel):
+    notification_ids: List[int] = []
+    # Inclusive (first id, last id) ranges
+    ranges: List[Tuple[int, int]] = []
+
+
 class NotificationResponse(BaseModel):
     id: int
     recipient_type: RecipientType
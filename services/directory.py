@@ -0,0 +1,301 @@
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+from keycloak import urls_patterns
+from keycloak.exceptions import KeycloakGetError, raise_error_from_response
+from services.keycloak_admin import AsyncKeycloakAdmin, get_keycloak_admin
+from services.worker_bus import get_worker_bus
+from constants.keycloak import (
+    DIRECTORY_USERS_TTL,
+    DIRECTORY_ROLES_TTL,
+    DIRECTORY_GROUPS_TTL,
+    DIRECTORY_MEMBERS_TTL,
+    DIRECTORY_REFRESH_INTERVAL
+)
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger("coffeebreak.core")
+
+Key = Tuple[Hashable, ...]
+
+
+class DirectoryCache:
+    """
+    Read-through cache of the Keycloak users, realm roles, groups and their members
+
+    Every lookup is answered from memory until its TTL runs out, concurrent misses of the same
+    entry share one Keycloak call, and the users and groups are indexed by username and name.
+    The services invalidate what they change; the invalidations are relayed to the other
+    workers over the worker bus. With a refresh interval the entries about to expire are
+    fetched again in the background, so hot lookups never wait for Keycloak.
+
+    Lookups return copies of the cached lists, the dicts in them are shared and must not be
+    changed.
+    """
+    def __init__(self, admin: Optional[AsyncKeycloakAdmin] = None, refresh_interval: float = DIRECTORY_REFRESH_INTERVAL):
+        self._admin = admin
+        self.refresh_interval = refresh_interval
+        self.hits = 0
+        self.misses = 0
+        # key -> (time.monotonic() it expires at, value)
+        self._entries: Dict[Key, Tuple[float, Any]] = {}
+        # key -> loader, to refresh the entry in the background
+        self._loaders: Dict[Key, Callable[[], Awaitable[Any]]] = {}
+        self._loading: Dict[Key, asyncio.Future] = {}
+        # Bumped by every invalidation, a load that started before is not stored
+        self._generation = 0
+        self._user_ids: Dict[str, str] = {}
+        self._group_ids: Dict[str, str] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        get_worker_bus().register("directory_changes", self._on_change)
+
+    @property
+    def admin(self) -> AsyncKeycloakAdmin:
+        return self._admin or get_keycloak_admin()
+
+    # Users
+
+    async def users(self) -> List[dict]:
+        return list(await self._get(("users",), DIRECTORY_USERS_TTL, lambda: self.admin.get_users()))
+
+    async def user(self, user_id: str) -> dict:
+        return dict(await self._get(("user", user_id), DIRECTORY_USERS_TTL, lambda: self.admin.get_user(user_id)))
+
+    async def user_id(self, username: str) -> Optional[str]:
+        """Get the id of a user by username"""
+        if username not in self._user_ids:
+            await self.users()
+        return self._user_ids.get(username)
+
+    # Realm roles
+
+    async def roles(self) -> List[dict]:
+        return list(await self._get(("roles",), DIRECTORY_ROLES_TTL, lambda: self.admin.get_realm_roles()))
+
+    async def role_members(self, role_name: str, first: Optional[int] = None, max: Optional[int] = None) -> List[dict]:
+        """Get the members of a realm role, or one page of them with `first`/`max`"""
+        if first is None and max is None:
+            load = lambda: self.admin.get_realm_role_members(role_name)
+        else:
+            load = lambda: self.admin.run(self._role_members_page, role_name, first, max)
+        return list(await self._get(("role_members", role_name, first, max), DIRECTORY_MEMBERS_TTL, load))
+
+    # Groups
+
+    async def groups(self) -> List[dict]:
+        return list(await self._get(("groups",), DIRECTORY_GROUPS_TTL, lambda: self.admin.get_groups()))
+
+    async def group_id(self, name: str) -> Optional[str]:
+        """Get the id of a group by name"""
+        if name not in self._group_ids:
+            await self.groups()
+        return self._group_ids.get(name)
+
+    async def group_members(self, group_id: str) -> List[dict]:
+        return list(await self._get(
+            ("group_members", group_id),
+            DIRECTORY_MEMBERS_TTL,
+            lambda: self.admin.get_group_members(group_id)
+        ))
+
+    def group_id_sync(self, name: str) -> Optional[str]:
+        """group_id for code running in a thread, calls Keycloak from the calling thread on a miss"""
+        if name not in self._group_ids:
+            self._get_sync(("groups",), DIRECTORY_GROUPS_TTL, lambda: self.admin.client.get_groups())
+        return self._group_ids.get(name)
+
+    def group_members_sync(self, group_id: str) -> List[dict]:
+        """group_members for code running in a thread"""
+        return list(self._get_sync(
+            ("group_members", group_id),
+            DIRECTORY_MEMBERS_TTL,
+            lambda: self.admin.client.get_group_members(group_id)
+        ))
+
+    def _role_members_page(self, role_name: str, first: Optional[int], max: Optional[int]) -> List[dict]:
+        # get_realm_role_members pages through every member whatever the query, fetch the one page
+        client = self.admin.client
+        params = {"realm-name": client.connection.realm_name, "role-name": role_name}
+        query = {k: v for k, v in (("first", first), ("max", max)) if v is not None}
+        return raise_error_from_response(
+            client.connection.raw_get(urls_patterns.URL_ADMIN_REALM_ROLES_MEMBERS.format(**params), **query),
+            KeycloakGetError
+        )
+
+    # Invalidation
+
+    def invalidate_users(self, user_id: Optional[str] = None) -> None:
+        """Forget a user, or every user, after it was created, updated or deleted"""
+        self._publish({"kind": "users", "id": user_id})
+
+    def invalidate_roles(self, role_name: Optional[str] = None) -> None:
+        """Forget the roles, and the members of a role (or of every role) after a role assignment"""
+        self._publish({"kind": "roles", "id": role_name})
+
+    def invalidate_groups(self, group_id: Optional[str] = None) -> None:
+        """Forget the groups, and the members of a group (or of every group) after a membership change"""
+        self._publish({"kind": "groups", "id": group_id})
+
+    def invalidate(self) -> None:
+        """Forget everything"""
+        self._publish({"kind": "all", "id": None})
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    # Background refresh
+
+    async def start(self) -> None:
+        """Start refreshing the entries about to expire, if a refresh interval is set"""
+        self._loop = asyncio.get_running_loop()
+        if self.refresh_interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def refresh(self) -> int:
+        """Fetch again the entries expiring before the next refresh, returns how many were fetched"""
+        horizon = time.monotonic() + self.refresh_interval
+        due = [key for key, (expires_at, _) in self._entries.items() if expires_at <= horizon and key in self._loaders]
+        for key in due:
+            generation = self._generation
+            try:
+                value = await self._loaders[key]()
+            except Exception as e:
+                logger.warning(f"Failed to refresh directory entry {key}: {str(e)}")
+                continue
+            if generation == self._generation:
+                self._store(key, value, self._ttl(key))
+        return len(due)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Error refreshing the directory cache: {str(e)}")
+
+    # Internals
+
+    @staticmethod
+    def _ttl(key: Key) -> float:
+        return {
+            "users": DIRECTORY_USERS_TTL,
+            "user": DIRECTORY_USERS_TTL,
+            "roles": DIRECTORY_ROLES_TTL,
+            "groups": DIRECTORY_GROUPS_TTL,
+        }.get(key[0], DIRECTORY_MEMBERS_TTL)
+
+    def _cached(self, key: Key) -> Tuple[bool, Any]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return True, entry[1]
+        self.misses += 1
+        return False, None
+
+    async def _get(self, key: Key, ttl: float, load: Callable[[], Awaitable[Any]]) -> Any:
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        found, value = self._cached(key)
+        if found:
+            return value
+
+        pending = self._loading.get(key)
+        if pending is None:
+            self._loaders[key] = load
+            pending = self._loading[key] = asyncio.ensure_future(self._load(key, ttl, load))
+        # A caller giving up does not cancel the load shared with the others
+        return await asyncio.shield(pending)
+
+    async def _load(self, key: Key, ttl: float, load: Callable[[], Awaitable[Any]]) -> Any:
+        generation = self._generation
+        try:
+            value = await load()
+        finally:
+            self._loading.pop(key, None)
+        if generation == self._generation:
+            self._store(key, value, ttl)
+        return value
+
+    def _get_sync(self, key: Key, ttl: float, load: Callable[[], Any]) -> Any:
+        found, value = self._cached(key)
+        if found:
+            return value
+        generation = self._generation
+        value = load()
+        if generation == self._generation:
+            self._store(key, value, ttl)
+        return value
+
+    def _store(self, key: Key, value: Any, ttl: float) -> None:
+        self._entries[key] = (time.monotonic() + ttl, value)
+        if key == ("users",):
+            self._user_ids = {user["username"]: user["id"] for user in value if "username" in user}
+        elif key == ("groups",):
+            self._group_ids = {group["name"]: group["id"] for group in value}
+
+    def _drop(self, kind: str, id: Optional[str] = None) -> None:
+        for key in list(self._entries):
+            if key[0] == kind and (id is None or key[1] == id):
+                del self._entries[key]
+                self._loaders.pop(key, None)
+
+    def _apply(self, kind: str, id: Optional[str]) -> None:
+        self._generation += 1
+        if kind == "users":
+            self._drop("users")
+            self._drop("user", id)
+            self._user_ids = {}
+            # Users are listed in the members of their roles and groups
+            self._drop("role_members")
+            self._drop("group_members")
+        elif kind == "roles":
+            self._drop("roles")
+            self._drop("role_members", id)
+        elif kind == "groups":
+            self._drop("groups")
+            self._drop("group_members", id)
+            self._group_ids = {}
+        else:
+            self._entries.clear()
+            self._loaders.clear()
+            self._user_ids = {}
+            self._group_ids = {}
+
+    def _publish(self, change: dict) -> None:
+        """Apply a change here right away and relay it to the other workers, from any thread"""
+        self._apply(change["kind"], change["id"])
+        if self._loop is None or self._loop.is_closed():
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self._loop:
+            asyncio.create_task(get_worker_bus().publish("directory_changes", change))
+        else:
+            asyncio.run_coroutine_threadsafe(get_worker_bus().publish("directory_changes", change), self._loop)
+
+    async def _on_change(self, change: dict) -> None:
+        self._apply(change["kind"], change["id"])
+
+
+_directory: Optional[DirectoryCache] = None
+
+
+def get_directory() -> DirectoryCache:
+    """Get the directory cache of this process"""
+    global _directory
+    if _directory is None:
+        _directory = DirectoryCache()
+    return _directory
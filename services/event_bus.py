@@ -1,12 +1,62 @@
 from sqlalchemy.orm import Session
-from typing import Callable, Dict, List
+from typing import Callable, Dict, List, Optional, Set
 from datetime import datetime
 from models.event import Event  # Model Event in the database
 from schemas.event import EventRequest, EventType
 from exceptions.event import EventNotFoundError
+from services.write_batcher import WriteBatcher
+from constants.event_bus import EVENT_BUS_HANDLER_TIMEOUT, EVENT_BUS_BACKGROUND_LIMIT
+import asyncio
+import inspect
+import logging
+import time
+
+logger = logging.getLogger("coffeebreak.core")
+
+
+class HandlerStats:
+    """Calls and timing of an event handler"""
+    __slots__ = ("calls", "failures", "timeouts", "total_time", "max_time")
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def record(self, elapsed: float, failed: bool = False, timed_out: bool = False) -> None:
+        self.calls += 1
+        self.failures += failed or timed_out
+        self.timeouts += timed_out
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "mean_ms": self.total_time / self.calls * 1000 if self.calls else 0.0,
+            "max_ms": self.max_time * 1000,
+        }
+
 
 class EventBus:
+    """
+    Stores events and calls the handlers registered for their type
+
+    Handlers can be plain functions or coroutine functions. publish_event_async awaits the
+    handlers, or with wait=False hands them to a bounded group of background tasks so the
+    publisher only pays for storing the event. A failing or slow handler (async handlers are
+    cancelled after handler_timeout seconds) does not affect the others, and the calls of every
+    handler are timed (see get_handler_stats). Coroutine handlers of events published from
+    threads run on the loop of the app, bound at startup with EventBus.start(), and the events
+    published from threads are stored by the write batcher of that loop like the async ones.
+    """
     _instance = None
+    # Loop of the app, coroutine handlers of events published from threads run there
+    _loop: Optional[asyncio.AbstractEventLoop] = None
 
     def __new__(cls, db: Session):
         if cls._instance is None:
@@ -19,37 +69,189 @@ class EventBus:
             return
         self.db = db
         self.handlers: Dict[str, List[Callable]] = {}  # Handlers for different event types
+        # Events saved together from async code share a transaction
+        self.writer = WriteBatcher(lambda: Session(bind=self.db.get_bind()), label="events")
+        self.handler_timeout = EVENT_BUS_HANDLER_TIMEOUT
+        self.stats: Dict[Callable, HandlerStats] = {}
+        self._background: Set[asyncio.Task] = set()
+        self._background_slots: Optional[asyncio.Semaphore] = None
         self._initialized = True
 
+    @classmethod
+    async def start(cls) -> None:
+        """Bind the bus to the running loop, call it at startup before any event is published"""
+        cls._loop = asyncio.get_running_loop()
+
     def register_event_handler(self, event_type: EventType, callback: Callable):
         if event_type not in self.handlers:
             self.handlers[event_type] = []
         self.handlers[event_type].append(callback)
+        self.stats.setdefault(callback, HandlerStats())
+
+    def get_handler_stats(self) -> Dict[str, dict]:
+        """Get the calls and timing of every registered handler, by qualified name"""
+        return {
+            f"{callback.__module__}.{callback.__qualname__}": stats.as_dict()
+            for callback, stats in self.stats.items()
+        }
 
     def _save_event(self, event: EventRequest):
         # Create event log and persist in the DB
-        new_event = Event(
+        new_event = self._new_event(event)
+        loop = self._loop
+        if loop is not None and loop.is_running() and not self._runs_on(loop):
+            # Published from a thread (threadpool routes, plugins), the events of the concurrent
+            # publishers share the transactions of the write batcher on the app loop
+            asyncio.run_coroutine_threadsafe(self.writer.add(new_event), loop).result()
+            return new_event
+        self.db.add(new_event)
+        self.db.commit()
+        self.db.refresh(new_event)
+        return new_event
+
+    @staticmethod
+    def _runs_on(loop: asyncio.AbstractEventLoop) -> bool:
+        """Whether the calling thread runs the loop, which cannot be blocked waiting for itself"""
+        try:
+            return asyncio.get_running_loop() is loop
+        except RuntimeError:
+            return False
+
+    def _new_event(self, event: EventRequest) -> Event:
+        return Event(
             event_type=event.event_type,
             timestamp=event.timestamp,
             payload=event.payload,
             details=event.details
         )
-        self.db.add(new_event)
-        self.db.commit()
-        self.db.refresh(new_event)
+
+    async def save_event(self, event: EventRequest) -> Event:
+        """Persist an event with the next batch of events, without blocking the event loop"""
+        new_event = self._new_event(event)
+        await self.writer.add(new_event)
         return new_event
 
     def publish_event(self, event: EventRequest):
         # Persist event
         event_record = self._save_event(event)
-        
-        # Call the registered handlers
-        if event.event_type in self.handlers:
-            for callback in self.handlers[event.event_type]:
-                callback(event_record)
+
+        # Call the registered handlers, the coroutine ones run in the background
+        for callback in list(self.handlers.get(event.event_type, ())):
+            if inspect.iscoroutinefunction(callback):
+                self._schedule_from_sync(self._call_async(callback, event_record))
+            else:
+                self._call_sync(callback, event_record)
 
         return event_record
 
+    async def publish_event_async(self, event: EventRequest, wait: bool = True) -> Event:
+        """
+        Persist an event and call its handlers
+
+        Args:
+            event (EventRequest): The event to publish
+            wait (bool): Await the handlers, otherwise they run in the background and this only
+                waits if the background limit is reached
+
+        Returns:
+            Event: The stored event
+        """
+        if EventBus._loop is None or EventBus._loop.is_closed():
+            # Not started by the app, e.g. a script publishing events
+            EventBus._loop = asyncio.get_running_loop()
+        event_record = await self.save_event(event)
+        if wait:
+            await self._dispatch(event_record)
+        else:
+            await self._run_in_background(self._dispatch(event_record))
+        return event_record
+
+    async def join(self) -> None:
+        """Wait for the handlers running in the background"""
+        while self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+
+    async def stop(self, timeout: float = 5) -> None:
+        """Give the background handlers `timeout` seconds, then store the events still queued"""
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Stopping the event bus with {len(self._background)} handlers still running")
+        await self.writer.stop()
+
+    async def _dispatch(self, event_record: Event) -> None:
+        """Call every handler of the event, the async ones concurrently"""
+        pending = []
+        for callback in list(self.handlers.get(event_record.event_type, ())):
+            if inspect.iscoroutinefunction(callback):
+                pending.append(self._call_async(callback, event_record))
+            else:
+                self._call_sync(callback, event_record)
+        if pending:
+            await asyncio.gather(*pending)
+
+    def _call_sync(self, callback: Callable, event_record: Event) -> None:
+        start = time.perf_counter()
+        failed = False
+        try:
+            callback(event_record)
+        except Exception as e:
+            failed = True
+            logger.error(f"Event handler {callback.__qualname__} failed on event {event_record.id}: {str(e)}")
+        self._record(callback, time.perf_counter() - start, failed=failed)
+
+    async def _call_async(self, callback: Callable, event_record: Event) -> None:
+        start = time.perf_counter()
+        failed = timed_out = False
+        try:
+            await asyncio.wait_for(callback(event_record), self.handler_timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+            logger.error(f"Event handler {callback.__qualname__} timed out on event {event_record.id} after {self.handler_timeout}s")
+        except Exception as e:
+            failed = True
+            logger.error(f"Event handler {callback.__qualname__} failed on event {event_record.id}: {str(e)}")
+        self._record(callback, time.perf_counter() - start, failed=failed, timed_out=timed_out)
+
+    def _record(self, callback: Callable, elapsed: float, failed: bool = False, timed_out: bool = False) -> None:
+        stats = self.stats.get(callback)
+        if stats is None:
+            stats = self.stats[callback] = HandlerStats()
+        stats.record(elapsed, failed=failed, timed_out=timed_out)
+
+    async def _run_in_background(self, coroutine) -> None:
+        """Start a background task once there is a free slot"""
+        if self._background_slots is None:
+            self._background_slots = asyncio.Semaphore(EVENT_BUS_BACKGROUND_LIMIT)
+        await self._background_slots.acquire()
+        self._spawn(self._release_after(coroutine))
+
+    async def _release_after(self, coroutine) -> None:
+        try:
+            await coroutine
+        finally:
+            self._background_slots.release()
+
+    def _spawn(self, coroutine) -> None:
+        task = asyncio.create_task(coroutine)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def _schedule_from_sync(self, coroutine) -> None:
+        """Run a coroutine handler of an event published from synchronous code"""
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        if running_loop is not None:
+            self._spawn(self._run_in_background(coroutine))
+        elif self._loop is not None and self._loop.is_running():
+            asyncio.run_coroutine_threadsafe(self._run_in_background(coroutine), self._loop)
+        else:
+            # No loop to hand it to, e.g. a script publishing events
+            asyncio.run(coroutine)
+
     def get_event(self, event_id: str):
         event = self.db.query(Event).filter(Event.id == event_id).first()
         if not event:
@@ -0,0 +1,69 @@
+from typing import Any, Awaitable, Callable, Iterable, List, Optional, Tuple, TypeVar
+import asyncio
+import inspect
+import logging
+import time
+from constants.websocket import WEBSOCKET_FANOUT_CONCURRENCY
+
+logger = logging.getLogger("coffeebreak.websocket")
+
+T = TypeVar("T")
+
+
+class FanoutResult:
+    """Outcome of one fan-out pass"""
+    __slots__ = ("sent", "failed", "elapsed")
+
+    def __init__(self, sent: int, failed: List[Tuple[Any, Exception]], elapsed: float):
+        self.sent = sent
+        # (target, error) pairs, the caller decides what to do with the failed targets
+        self.failed = failed
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return f"FanoutResult(sent={self.sent}, failed={len(self.failed)}, elapsed={self.elapsed * 1000:.2f}ms)"
+
+
+async def fan_out(
+    targets: Iterable[T],
+    send: Callable[[T], Optional[Awaitable[None]]],
+    concurrency: int = WEBSOCKET_FANOUT_CONCURRENCY,
+    label: str = "fan-out"
+) -> FanoutResult:
+    """
+    Send to many targets at once and collect the failures
+
+    The targets are snapshotted first, so the caller can safely remove failed targets from
+    the collection they came from once the pass is over. `send` can be a plain function (e.g.
+    queueing a frame on a connection), which is called inline, or a coroutine function, whose
+    calls run concurrently with at most `concurrency` of them in flight.
+    """
+    targets = list(targets)
+    failed: List[Tuple[T, Exception]] = []
+    pending: List[Tuple[T, Awaitable[None]]] = []
+    start = time.perf_counter()
+
+    for target in targets:
+        try:
+            result = send(target)
+        except Exception as e:
+            failed.append((target, e))
+            continue
+        if inspect.isawaitable(result):
+            pending.append((target, result))
+
+    if pending:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def bounded(awaitable: Awaitable[None]) -> None:
+            async with semaphore:
+                await awaitable
+
+        results = await asyncio.gather(*(bounded(awaitable) for _, awaitable in pending), return_exceptions=True)
+        for (target, _), result in zip(pending, results):
+            if isinstance(result, Exception):
+                failed.append((target, result))
+
+    result = FanoutResult(len(targets) - len(failed), failed, time.perf_counter() - start)
+    logger.debug(f"{label}: {result}")
+    return result
@@ -0,0 +1,134 @@
+from typing import Awaitable, Callable, Dict, FrozenSet, List, Optional, Set
+import asyncio
+import logging
+
+logger = logging.getLogger("coffeebreak.notifications")
+
+GroupFetcher = Callable[[str], Awaitable[List[dict]]]
+
+
+class GroupMembershipIndex:
+    """
+    Group id -> online user ids, for delivering group notifications without asking Keycloak
+
+    Users are indexed when they come online and dropped when they go offline. Their groups are
+    fetched once by a background task, refreshed once `ttl` seconds have passed and as soon as
+    they are invalidated (after a group change). Looking up the members of a group never
+    does any I/O, until the refresh lands it answers with the groups known so far. The groups
+    of a user are only reported once a fetch succeeded, a failed first fetch is not mistaken
+    for a user without groups.
+    """
+    def __init__(self, fetch_groups: GroupFetcher, ttl: float = 300):
+        self.ttl = ttl
+        self._fetch_groups = fetch_groups
+        self._members: Dict[str, Set[str]] = {}
+        self._groups: Dict[str, FrozenSet[str]] = {}
+        # Users whose groups were fetched at least once
+        self._fetched: Set[str] = set()
+        # Loop time after which the groups of a user are fetched again
+        self._expires: Dict[str, float] = {}
+        # Users to refresh on the next pass, regardless of their expiry
+        self._stale: Set[str] = set()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _now() -> float:
+        return asyncio.get_running_loop().time()
+
+    def add_user(self, user_id: str) -> None:
+        """Index an online user, their groups are fetched in the background"""
+        if user_id in self._groups:
+            return
+        self._groups[user_id] = frozenset()
+        self._expires[user_id] = 0
+        self._stale.add(user_id)
+        self._schedule()
+
+    def remove_user(self, user_id: str) -> None:
+        """Drop a user that went offline"""
+        groups = self._groups.pop(user_id, None)
+        if groups is None:
+            return
+        self._index(user_id, groups, frozenset())
+        self._expires.pop(user_id, None)
+        self._stale.discard(user_id)
+        self._fetched.discard(user_id)
+
+    def members(self, group_id: str) -> Set[str]:
+        """Get the online members of a group"""
+        return self._members.get(group_id, set())
+
+    def groups(self, user_id: str) -> Optional[FrozenSet[str]]:
+        """Get the group ids of an online user, None if the user is not indexed or no fetch succeeded yet"""
+        if user_id not in self._fetched:
+            return None
+        return self._groups[user_id]
+
+    def invalidate(self, user_id: Optional[str] = None) -> None:
+        """Refresh the groups of a user, or of every online user, as soon as possible"""
+        if user_id is None:
+            self._stale.update(self._groups)
+        elif user_id in self._groups:
+            self._stale.add(user_id)
+        else:
+            return
+        self._schedule()
+
+    async def refresh(self, user_id: str) -> None:
+        """Fetch the groups of a user and update the index"""
+        try:
+            groups = frozenset(group["id"] for group in await self._fetch_groups(user_id))
+        except Exception as e:
+            logger.error(f"Failed to refresh the groups of user {user_id}: {str(e)}")
+            groups = None
+
+        # The user went offline while the groups were fetched
+        if user_id not in self._groups:
+            return
+        self._expires[user_id] = self._now() + self.ttl
+        if groups is not None:
+            self._index(user_id, self._groups[user_id], groups)
+            self._groups[user_id] = groups
+            self._fetched.add(user_id)
+
+    def stop(self) -> None:
+        """Cancel the refresh task"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def __len__(self) -> int:
+        return len(self._groups)
+
+    def _index(self, user_id: str, old: FrozenSet[str], new: FrozenSet[str]) -> None:
+        for group_id in old - new:
+            members = self._members.get(group_id)
+            if members is not None:
+                members.discard(user_id)
+                if not members:
+                    del self._members[group_id]
+        for group_id in new - old:
+            self._members.setdefault(group_id, set()).add(user_id)
+
+    def _schedule(self) -> None:
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            now = self._now()
+            due = self._stale | {user_id for user_id, expires in self._expires.items() if expires <= now}
+            self._stale.clear()
+            for user_id in due:
+                await self.refresh(user_id)
+
+            self._wakeup.clear()
+            if self._stale:
+                continue
+            timeout = min(self._expires.values()) - self._now() if self._expires else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
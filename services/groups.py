@@ -1,4 +1,6 @@
 from dependencies.auth import keycloak_admin, is_anonymous
+from services.keycloak_admin import get_keycloak_admin
+from services.directory import get_directory
 from keycloak.exceptions import KeycloakError
 from exceptions.group import (
     GroupNotFoundError,
@@ -7,16 +9,34 @@ from exceptions.group import (
     GroupAddUserError,
     GroupGetUsersError
 )
+from typing import Callable, List
 import logging
 logger = logging.getLogger("coffeebreak.core")
 
+# Called with the user id whenever the groups of a user change
+_group_change_listeners: List[Callable[[str], None]] = []
+
+
+def on_group_change(listener: Callable[[str], None]) -> Callable[[str], None]:
+    """Register a listener called with the user id after the groups of a user change"""
+    _group_change_listeners.append(listener)
+    return listener
+
+
+def _notify_group_change(user_id: str) -> None:
+    for listener in _group_change_listeners:
+        try:
+            listener(user_id)
+        except Exception as e:
+            logger.error(f"Error in group change listener: {str(e)}")
+
 
 async def get_user_groups(user_id: str):
     """Retorna uma lista de todos os grupos aos quais um usuário pertence no Keycloak"""
     if is_anonymous(user_id):
         return []
     try:
-        groups = keycloak_admin.get_user_groups(user_id)
+        groups = await get_keycloak_admin().get_user_groups(user_id)
         return groups
     except KeycloakError as e:
         logger.error(f"Failed to get user groups: {str(e)}")
@@ -27,6 +47,7 @@ def create_group(group_name: str):
     """Cria um grupo no Keycloak usando `python-keycloak` com `fastapi-client`"""
     try:
         group_id = keycloak_admin.create_group({"name": group_name})
+        get_directory().invalidate_groups()
         return {"message": f"Group '{group_name}' created successfully", "group_id": group_id}
     except KeycloakError as e:
         logger.warning(f"Failed to create group: {str(e)}")
@@ -36,15 +57,14 @@ def create_group(group_name: str):
 def add_client_to_group(client_id: str, group_name: str):
     """Adiciona um cliente a um grupo no Keycloak usando `python-keycloak`"""
     try:
-        groups = keycloak_admin.get_groups()
-        group = next((g for g in groups if g["name"] == group_name), None)
+        group_id = get_directory().group_id_sync(group_name)
 
-        if not group:
+        if not group_id:
             raise GroupNotFoundError(group_name)
 
-        group_id = group["id"]
-
         keycloak_admin.group_user_add(client_id, group_id)
+        get_directory().invalidate_groups(group_id)
+        _notify_group_change(client_id)
         return {"message": f"Client '{client_id}' added to group '{group_name}' successfully"}
 
     except KeycloakError as e:
@@ -57,16 +77,13 @@ def get_users_in_group(group_name: str):
     try:
         # Buscar o ID do grupo pelo nome
         logger.debug("Fetching group ID: %s", group_name)
-        groups = keycloak_admin.get_groups()
-        group = next((g for g in groups if g["name"] == group_name), None)
-        logger.debug("Group found: %s", group)
+        group_id = get_directory().group_id_sync(group_name)
+        logger.debug("Group found: %s", group_id)
 
-        if not group:
+        if not group_id:
             raise GroupNotFoundError(group_name)
 
-        group_id = group["id"]
-
-        users = keycloak_admin.get_group_members(group_id)
+        users = get_directory().group_members_sync(group_id)
         return users
 
     except KeycloakError as e:
@@ -0,0 +1,146 @@
+from typing import Awaitable, Callable, List, Optional, Tuple
+import asyncio
+import heapq
+import itertools
+import logging
+
+logger = logging.getLogger("coffeebreak.websocket")
+
+
+class HeartbeatState:
+    """
+    Liveness fields of a tracked connection, kept on the connection itself
+
+    Connections subclass this so the scheduler does not need per-connection dicts:
+    last_activity is None while the connection is not tracked and ping_sent is the
+    time of the pending PING, if any.
+    """
+    __slots__ = ("last_activity", "ping_sent")
+
+    def __init__(self):
+        self.last_activity: Optional[float] = None
+        self.ping_sent: Optional[float] = None
+
+    def is_awaiting_pong(self) -> bool:
+        """Check if a PING was sent and is still unanswered"""
+        return self.ping_sent is not None and self.last_activity is not None and self.last_activity <= self.ping_sent
+
+
+class HeartbeatScheduler:
+    """
+    Tracks the idle deadline of every connection with a single task
+
+    Deadlines are kept in a heap and the task only wakes up when the earliest one expires.
+    Activity just records a timestamp on the connection, the heap entry is re-evaluated lazily
+    when it is popped, so touching a connection is O(1). Expired connections are handled in
+    batches: idle ones get pinged and the ones that did not answer within pong_timeout are timed out.
+    """
+    def __init__(
+        self,
+        on_ping: Callable[[List[HeartbeatState]], None],
+        on_timeout: Callable[[List[HeartbeatState]], Awaitable[None]],
+        idle_timeout: float = 60,
+        pong_timeout: float = 15
+    ):
+        self.idle_timeout = idle_timeout
+        self.pong_timeout = pong_timeout
+        self._on_ping = on_ping
+        self._on_timeout = on_timeout
+        # (deadline, insertion order, connection), may contain stale entries of removed connections
+        self._heap: List[Tuple[float, int, HeartbeatState]] = []
+        self._order = itertools.count()
+        self._tracked = 0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _now() -> float:
+        return asyncio.get_running_loop().time()
+
+    def add(self, connection: HeartbeatState) -> None:
+        """Start tracking a connection"""
+        now = self._now()
+        if connection.last_activity is None:
+            self._tracked += 1
+        connection.last_activity = now
+        connection.ping_sent = None
+        self._push(now + self.idle_timeout, connection)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def touch(self, connection: HeartbeatState) -> None:
+        """Record activity on a connection, any pending PING counts as answered"""
+        if connection.last_activity is not None:
+            connection.last_activity = self._now()
+
+    def remove(self, connection: HeartbeatState) -> None:
+        """Stop tracking a connection"""
+        if connection.last_activity is not None:
+            self._tracked -= 1
+        connection.last_activity = None
+        connection.ping_sent = None
+
+    def __len__(self) -> int:
+        return self._tracked
+
+    def stop(self) -> None:
+        """Cancel the scheduler task"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _push(self, deadline: float, connection: HeartbeatState) -> None:
+        if not self._heap or deadline < self._heap[0][0]:
+            self._wakeup.set()
+        heapq.heappush(self._heap, (deadline, next(self._order), connection))
+
+    def _collect(self, now: float) -> Tuple[List[HeartbeatState], List[HeartbeatState]]:
+        """Pop every expired deadline and sort the connections into ping and timeout batches"""
+        to_ping: List[HeartbeatState] = []
+        timed_out: List[HeartbeatState] = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, connection = heapq.heappop(self._heap)
+            last_activity = connection.last_activity
+            if last_activity is None:
+                continue  # removed connection
+
+            if connection.is_awaiting_pong():
+                pong_deadline = connection.ping_sent + self.pong_timeout
+                if pong_deadline <= now:
+                    timed_out.append(connection)
+                    self.remove(connection)
+                else:
+                    heapq.heappush(self._heap, (pong_deadline, next(self._order), connection))
+                continue
+
+            connection.ping_sent = None
+            idle_deadline = last_activity + self.idle_timeout
+            if idle_deadline <= now:
+                connection.ping_sent = now
+                to_ping.append(connection)
+                heapq.heappush(self._heap, (now + self.pong_timeout, next(self._order), connection))
+            else:
+                heapq.heappush(self._heap, (idle_deadline, next(self._order), connection))
+        return to_ping, timed_out
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                to_ping, timed_out = self._collect(self._now())
+                if to_ping:
+                    logger.debug(f"Sending PING to {len(to_ping)} idle connections")
+                    self._on_ping(to_ping)
+                if timed_out:
+                    logger.warning(f"No PONG received from {len(timed_out)} connections within {self.pong_timeout}s")
+                    await self._on_timeout(timed_out)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in heartbeat scheduler: {str(e)}")
+
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - self._now() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
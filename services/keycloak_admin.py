@@ -0,0 +1,74 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Optional
+from keycloak import KeycloakAdmin
+from constants.keycloak import KEYCLOAK_ADMIN_THREADS
+import asyncio
+import functools
+import logging
+
+logger = logging.getLogger("coffeebreak.core")
+
+
+def _default_admin() -> KeycloakAdmin:
+    # Looked up on every call, so the client configured in dependencies.auth can be swapped
+    import dependencies.auth
+    return dependencies.auth.keycloak_admin
+
+
+class AsyncKeycloakAdmin:
+    """
+    Awaitable Keycloak admin calls
+
+    python-keycloak's admin client is synchronous, its calls run in a dedicated pool of
+    `max_workers` threads instead of on the event loop. The pool also bounds the calls in flight
+    to Keycloak, and keeps slow admin calls from taking the threads of asyncio.to_thread.
+    Any method of KeycloakAdmin can be awaited, e.g. `await admin.get_users({"max": 10})`.
+
+    Args:
+        admin: Returns the KeycloakAdmin to call, the one of dependencies.auth by default
+        max_workers: Threads of the pool
+    """
+    def __init__(self, admin: Callable[[], KeycloakAdmin] = _default_admin, max_workers: int = KEYCLOAK_ADMIN_THREADS):
+        self.max_workers = max_workers
+        self._admin = admin
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def client(self) -> KeycloakAdmin:
+        """The synchronous client, for code already running in a thread"""
+        return self._admin()
+
+    async def call(self, method: str, *args, **kwargs) -> Any:
+        """Call a KeycloakAdmin method in the pool and wait for its result"""
+        return await self.run(lambda: getattr(self._admin(), method)(*args, **kwargs))
+
+    async def run(self, function: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run a blocking function making Keycloak admin calls in the pool"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="keycloak-admin")
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor,
+            functools.partial(function, *args, **kwargs)
+        )
+
+    def __getattr__(self, method: str) -> Callable[..., Awaitable[Any]]:
+        if method.startswith("_") or not callable(getattr(KeycloakAdmin, method, None)):
+            raise AttributeError(method)
+        return functools.partial(self.call, method)
+
+    def shutdown(self) -> None:
+        """Stop the threads once their calls are done"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_keycloak_admin: Optional[AsyncKeycloakAdmin] = None
+
+
+def get_keycloak_admin() -> AsyncKeycloakAdmin:
+    """Get the awaitable Keycloak admin client of this process"""
+    global _keycloak_admin
+    if _keycloak_admin is None:
+        _keycloak_admin = AsyncKeycloakAdmin()
+    return _keycloak_admin
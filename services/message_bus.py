@@ -1,33 +1,103 @@
 from sqlalchemy.orm import Session
+from dependencies.database import SessionLocal
 from models.message import Message, RecipientType
 from schemas.notification import NotificationRequest
 from exceptions.message import MessageNotInitializedError, MessageInvalidRecipientTypeError
+from services.outbox import DeliveryOutcome, OutboxDispatcher
+from services.write_batcher import WriteBatcher
+from constants.message_bus import (
+    MESSAGE_BUS_WORKERS,
+    MESSAGE_BUS_QUEUE_SIZE,
+    MESSAGE_BUS_HANDLER_TIMEOUT,
+    MESSAGE_BUS_TYPE_CONCURRENCY
+)
+from typing import Callable, Collection, Dict, List, Optional, Set, Tuple
 import asyncio
+import heapq
+import itertools
+import logging
+
+logger = logging.getLogger("coffeebreak.core")
 
 
 class MessageBus:
+    """
+    Dispatches messages to the handlers registered for their type
+
+    send_notification stores the message and queues it, the handlers run in a pool of worker
+    tasks so producers do not wait for them. Messages with a higher priority are dispatched
+    first, async handlers are cancelled after handler_timeout seconds and the number of messages
+    of a type handled at once can be limited with set_type_concurrency. Messages of a type at its
+    limit are set aside until a message of the type is done, so they never hold a worker that
+    could handle the messages of the other types.
+
+    The messages table is an outbox: a message is marked delivered once its handlers succeed,
+    otherwise the outbox dispatcher queues it again later with only the handlers that failed
+    (see OutboxDispatcher). A message is queued once per worker at a time. Messages sent
+    together are inserted in one transaction (see WriteBatcher), along with the outcomes of the
+    messages handled meanwhile, so a message costs no commit of its own once it was handled.
+    """
     _instance = None
     _handlers = {}
 
     def __new__(cls, db: Session = None):
         if cls._instance is None:
             cls._instance = super(MessageBus, cls).__new__(cls)
+            cls._instance._scheduler_initialized = False
         return cls._instance
 
     def __init__(self, db: Session = None):
-        self.db = db
+        if db is not None or not hasattr(self, "db"):
+            self.db = db
         # handlers são compartilhados entre todas as instâncias
         self.handlers = self._handlers
+        if self._scheduler_initialized:
+            return
+
+        self.workers = MESSAGE_BUS_WORKERS
+        self.handler_timeout = MESSAGE_BUS_HANDLER_TIMEOUT
+        # (-priority, arrival order, message id, notification, handlers that already succeeded),
+        # higher priorities are popped first
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        # Ids of the messages queued or being handled, their outbox leases are renewed
+        self._held: Set[int] = set()
+        self._order = itertools.count()
+        self._worker_tasks: List[asyncio.Task] = []
+        self._type_limits: Dict[str, int] = {}
+        # Messages being handled by type, and the queue entries set aside while a type is at its limit
+        self._type_running: Dict[str, int] = {}
+        self._type_deferred: Dict[str, list] = {}
+        self.writer = WriteBatcher(self._new_session, label="messages", write=self._write_batch)
+        self.outbox = OutboxDispatcher(
+            self.enqueue,
+            lambda: [type for type, callbacks in self.handlers.items() if callbacks],
+            held=lambda: self._held,
+            session_factory=self._new_session,
+            recorder=self.writer
+        )
+        self._scheduler_initialized = True
 
     async def register_message_handler(self, type: str, callback):
         if type not in self.handlers:
             self.handlers[type] = []
         self.handlers[type].append(callback)
+        # Deliver the messages of the type stored before it had a handler
+        self.outbox.wakeup()
 
     async def unregister_message_handler(self, type: str, callback):
         if type in self.handlers:
             self.handlers[type].remove(callback)
 
+    def set_type_concurrency(self, type: str, limit: int) -> None:
+        """
+        Limit the number of messages of a type handled at once
+
+        Args:
+            type (str): The message type
+            limit (int): Maximum number of messages in flight, 0 for no limit
+        """
+        self._type_limits[type] = limit
+
     async def send_notification(self, notification: NotificationRequest):
         if self.db is None:
             raise MessageNotInitializedError()
@@ -44,19 +114,188 @@ class MessageBus:
             payload=notification.payload,
             priority=notification.priority
         )
-        self.db.add(new_message)
-        self.db.commit()
-        self.db.refresh(new_message)
+        handled = bool(self.handlers.get(notification.type))
+        if handled:
+            # Claimed right away, the outbox dispatcher only picks it up if this delivery fails
+            new_message.claimed_by, new_message.claimed_until = self.outbox.new_claim()
+        await self.writer.add(new_message)
 
-        if notification.type in self.handlers:
-            for callback in self.handlers[notification.type]:
-                if asyncio.iscoroutinefunction(callback):
-                    await callback(notification)
-                else:
-                    callback(notification)
+        if handled:
+            await self.enqueue(new_message.id, notification)
 
         return new_message
 
+    async def enqueue(self, message_id: Optional[int], notification: NotificationRequest, handled: Collection[str] = ()) -> None:
+        """Queue a message for the workers unless it is already queued, waits only if the queue is full"""
+        if message_id is not None:
+            if message_id in self._held:
+                return
+            self._held.add(message_id)
+        self._start_workers()
+        await self._queue.put((-notification.priority, next(self._order), message_id, notification, frozenset(handled)))
+
+    async def join(self) -> None:
+        """Wait until every queued message was handled and its outcome recorded"""
+        if self._queue is not None:
+            await self._queue.join()
+        await self.outbox.flush()
+
+    async def start(self) -> None:
+        """Start delivering the messages left undelivered"""
+        await self.outbox.start()
+
+    async def stop(self, timeout: float = 5) -> None:
+        """Give the queued messages `timeout` seconds to be handled, then stop the workers"""
+        await self.outbox.stop()
+        await self.writer.stop()
+        if self._queue is not None and self._worker_tasks:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Stopping the message bus with {self._queue.qsize()} messages still queued")
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        self._queue = None
+        self._held.clear()
+        # Outcomes of the messages handled while stopping
+        await self.writer.stop()
+        self._type_running.clear()
+        self._type_deferred.clear()
+
+    def _new_session(self) -> Session:
+        """A session on the database of the bus, for the work done outside of a request"""
+        if self.db is None:
+            return SessionLocal()
+        return Session(bind=self.db.get_bind())
+
+    def _write_batch(self, items: list) -> list:
+        """Insert the new messages and record the outcomes of the handled ones in one transaction"""
+        outcomes = [item for item in items if isinstance(item, DeliveryOutcome)]
+        if not outcomes:
+            return self.writer._write(items)
+        messages = [item for item in items if not isinstance(item, DeliveryOutcome)]
+        with self._new_session() as db:
+            # The messages are handed back to their senders, keep them loaded
+            db.expire_on_commit = False
+            try:
+                db.add_all(messages)
+                self.outbox.apply_outcomes(db, outcomes)
+                db.commit()
+                return [None if isinstance(item, DeliveryOutcome) else item.id for item in items]
+            except Exception as e:
+                db.rollback()
+                logger.warning(f"Writing a batch of {len(items)} messages and outcomes failed, writing them apart: {str(e)}")
+
+        # The outcomes in a transaction of their own, the messages one by one if they fail together
+        try:
+            recorded = self.outbox.record_batch(outcomes)
+        except Exception as e:
+            recorded = [e] * len(outcomes)
+        inserted = iter(self.writer._write(messages) if messages else ())
+        recorded = iter(recorded)
+        return [next(recorded) if isinstance(item, DeliveryOutcome) else next(inserted) for item in items]
+
+    def _start_workers(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue(maxsize=MESSAGE_BUS_QUEUE_SIZE)
+        self._worker_tasks = [task for task in self._worker_tasks if not task.done()]
+        while len(self._worker_tasks) < self.workers:
+            self._worker_tasks.append(asyncio.create_task(self._work()))
+
+    def _admit(self, entry: tuple) -> bool:
+        """Count a queue entry as handled, or set it aside if its type is at its limit"""
+        type = entry[3].type
+        limit = self._type_limits.get(type, MESSAGE_BUS_TYPE_CONCURRENCY)
+        deferred = self._type_deferred.get(type)
+        # Entries already set aside go first, in priority order
+        if deferred or (limit > 0 and self._type_running.get(type, 0) >= limit):
+            heapq.heappush(self._type_deferred.setdefault(type, []), entry)
+            return False
+        self._type_running[type] = self._type_running.get(type, 0) + 1
+        return True
+
+    def _release(self, type: str) -> Optional[tuple]:
+        """Free the slot of a handled message, handing it to the next entry set aside for the type"""
+        deferred = self._type_deferred.get(type)
+        if deferred:
+            entry = heapq.heappop(deferred)
+            if not deferred:
+                del self._type_deferred[type]
+            return entry
+        self._type_running[type] -= 1
+        if not self._type_running[type]:
+            del self._type_running[type]
+        return None
+
+    async def _work(self) -> None:
+        while True:
+            entry = await self._queue.get()
+            if not self._admit(entry):
+                # Handled by the worker that frees a slot of its type, task_done is called then
+                continue
+            while entry is not None:
+                try:
+                    await self._handle(entry)
+                finally:
+                    entry = self._release(entry[3].type)
+
+    async def _handle(self, entry: tuple) -> None:
+        _, _, message_id, notification, handled = entry
+        try:
+            error, handled = await self._dispatch(message_id, notification, handled)
+            if message_id is not None:
+                # Written with the outcomes of the other messages handled meanwhile
+                self.outbox.record_later(message_id, error, handled)
+        except Exception as e:
+            logger.error(f"Error dispatching message {message_id}: {str(e)}")
+        finally:
+            self._held.discard(message_id)
+            self._queue.task_done()
+
+    async def _dispatch(
+        self,
+        message_id: Optional[int],
+        notification: NotificationRequest,
+        handled: Collection[str] = ()
+    ) -> Tuple[Optional[str], Set[str]]:
+        """
+        Call the handlers of the message type that did not succeed yet, a failing or slow handler
+        does not affect the others
+
+        Returns:
+            Tuple[Optional[str], Set[str]]: The error of the last handler that failed, None if they
+                all succeeded, and the names of the handlers that succeeded so far
+        """
+        error = None
+        handled = set(handled)
+        for callback in list(self.handlers.get(notification.type, ())):
+            name = self._handler_name(callback)
+            if name in handled:
+                continue
+            try:
+                await self._call_handler(callback, notification)
+                handled.add(name)
+            except asyncio.TimeoutError:
+                error = f"Handler {callback.__name__} timed out after {self.handler_timeout}s"
+                logger.error(f"{error} on message {message_id}")
+            except Exception as e:
+                error = f"Handler {callback.__name__} failed: {str(e)}"
+                logger.error(f"{error} on message {message_id}")
+        return error, handled
+
+    @staticmethod
+    def _handler_name(callback: Callable) -> str:
+        """Name of a handler recorded on the messages, stable across restarts"""
+        return f"{callback.__module__}.{callback.__qualname__}"
+
+    async def _call_handler(self, callback: Callable, notification: NotificationRequest) -> None:
+        if asyncio.iscoroutinefunction(callback):
+            await asyncio.wait_for(callback(notification), self.handler_timeout)
+        else:
+            callback(notification)
+
     async def receive(self, message: Message):
         if self.db is None:
             raise MessageNotInitializedError()
@@ -1,13 +1,24 @@
+from sqlalchemy import DateTime, String, exists, func, insert, literal, or_, select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
-from models.notification import Notification, NotificationRead
+from models.notification import Notification, NotificationCounter, NotificationRead, NotificationReadWatermark
+from dependencies.database import SessionLocal
 from models.message import RecipientType
 from schemas.notification import NotificationRequest, NotificationResponse
-from services.groups import get_user_groups
+from services.groups import get_user_groups, on_group_change
+from services.group_index import GroupMembershipIndex
 from services.websocket_service import WebSocketService, WebSocketConnection
 from services.message_bus import MessageBus
-from typing import List, Dict, Set
+from services.worker_bus import get_worker_bus
+from services.fanout import fan_out, FanoutResult
+from utils.codec import FrameCache
+from constants.notifications import GROUP_MEMBERSHIP_TTL, NOTIFICATIONS_PAGE_SIZE_MAX
+from typing import Iterable, List, Dict, Optional, Set, Tuple
+from datetime import UTC, datetime
 import logging
 import asyncio
+import json
 from exceptions.notifications import (
     NotificationNotInitializedError
 )
@@ -26,7 +37,6 @@ class NotificationService:
 
     def __init__(self, db: Session = None):
         if not self._initialized:
-            self.db = db
             # Store connections by user_id for authenticated users
             self.user_connections: Dict[str, Set[WebSocketConnection]] = {}
             # Store anonymous connections for broadcast messages
@@ -34,9 +44,18 @@ class NotificationService:
             # Register handler for in-app notifications
             message_bus = MessageBus(db)
             asyncio.create_task(message_bus.register_message_handler("in-app", self.handle_in_app_message))
+            # Notifications are relayed to every worker, each one delivers to its own connections
+            get_worker_bus().register("notifications", self._deliver_notification)
+            # Online members of each group, so group notifications do not query Keycloak per user
+            self.group_index = GroupMembershipIndex(get_user_groups, ttl=GROUP_MEMBERSHIP_TTL)
+            # Group changes can happen in any worker and in threadpool routes
+            self._loop = asyncio.get_running_loop()
+            get_worker_bus().register("group_changes", self._invalidate_user_groups)
+            on_group_change(self._on_group_change)
+            # Unread count of the users online in this worker, pushed to them whenever it changes
+            self.unread_counts: Dict[str, int] = {}
+            get_worker_bus().register("notification_counts", self._deliver_unread_count)
             self._initialized = True
-        elif db is not None:
-            self.db = db
 
     def add_connection(self, connection: WebSocketConnection) -> None:
         """Add a WebSocket connection to the appropriate collection"""
@@ -44,6 +63,7 @@ class NotificationService:
             if connection.user_id not in self.user_connections:
                 self.user_connections[connection.user_id] = set()
             self.user_connections[connection.user_id].add(connection)
+            self.group_index.add_user(connection.user_id)
             logger.debug(f"Added authenticated connection for user {connection.user_id}")
         else:
             self.anonymous_connections.add(connection)
@@ -56,137 +76,435 @@ class NotificationService:
                 self.user_connections[connection.user_id].discard(connection)
                 if not self.user_connections[connection.user_id]:
                     del self.user_connections[connection.user_id]
+                    self.group_index.remove_user(connection.user_id)
+                    self.unread_counts.pop(connection.user_id, None)
                 logger.debug(f"Removed authenticated connection for user {connection.user_id}")
         else:
             self.anonymous_connections.discard(connection)
             logger.debug("Removed anonymous connection")
 
-    async def mark_notifications_read(self, user_id: str, notification_ids: List[int]):
-        """Mark specified notifications as read"""
-        if self.db is None:
+    async def mark_notifications_read(
+        self,
+        db: Session,
+        user_id: str,
+        notification_ids: Iterable[int] = (),
+        ranges: Iterable[Tuple[int, int]] = ()
+    ) -> int:
+        """
+        Mark notifications as read with a single INSERT ... SELECT
+
+        Args:
+            db (Session): The session of the request
+            user_id (str): The user id
+            notification_ids (list): Ids of the notifications to mark
+            ranges (list): Inclusive (first id, last id) ranges of notifications to mark
+
+        Only existing notifications after the user's read watermark are marked and the ones
+        already marked are skipped, so marking the same notifications again is a no-op.
+
+        Returns:
+            int: The number of notifications newly marked as read
+        """
+        if db is None:
             raise NotificationNotInitializedError()
 
-        for notification_id in notification_ids:
-            notification_read = NotificationRead(
-                notification_id=notification_id,
-                user_id=user_id
-            )
-            self.db.add(notification_read)
-        
-        self.db.commit()
+        selected = []
+        notification_ids = list(notification_ids)
+        if notification_ids:
+            selected.append(Notification.id.in_(notification_ids))
+        selected.extend(Notification.id.between(first, last) for first, last in ranges)
+        if not selected:
+            return 0
 
-    async def _send_to_connection(self, connection: WebSocketConnection, notification_response: dict, user_id: str = None):
-        """Send notification to a single connection"""
-        try:
-            await connection.send("notifications", {
-                "action": "new_notification",
-                "notification": notification_response
-            })
-        except Exception as e:
-            error_context = f"user {user_id}" if user_id else "anonymous connection"
-            logger.error(f"Error sending notification to {error_context}: {str(e)}")
+        group_ids = await self._user_group_ids(user_id)
+        # Counted up to the latest notification, so every newly marked one is part of the count
+        counter = self._sync_counter(db, user_id, group_ids)
+
+        already_read = exists().where(
+            NotificationRead.user_id == user_id,
+            NotificationRead.notification_id == Notification.id
+        )
+        unread = select(
+            Notification.id,
+            literal(user_id, String),
+            literal(datetime.now(UTC), DateTime)
+        ).where(
+            Notification.id > self._read_watermark(db, user_id),
+            Notification.id <= counter.counted_up_to,
+            self._recipient_filter(user_id, group_ids),
+            or_(*selected),
+            ~already_read
+        )
+        statement = self._insert(db, NotificationRead).from_select(
+            ["notification_id", "user_id", "read_at"],
+            unread
+        )
+        if hasattr(statement, "on_conflict_do_nothing"):
+            # Another request marking the same notifications concurrently is not an error
+            statement = statement.on_conflict_do_nothing()
+
+        marked = max(db.execute(statement).rowcount, 0)
+        counter.unread = max(counter.unread - marked, 0)
+        db.commit()
+        if marked:
+            await self._publish_unread_count(user_id, counter.unread)
+        return marked
+
+    @staticmethod
+    def _insert(db: Session, table):
+        """Get an INSERT of the session's dialect, which supports ON CONFLICT on SQLite and PostgreSQL"""
+        dialect = db.get_bind().dialect.name
+        if dialect == "postgresql":
+            return postgresql_insert(table)
+        if dialect == "sqlite":
+            return sqlite_insert(table)
+        return insert(table)
+
+    async def _send_to_connections(self, connections, frame: FrameCache, label: str) -> FanoutResult:
+        """
+        Queue an encoded notification frame on many connections in one pass
+
+        Connections that fail are removed once the pass is over, not while iterating.
+        """
+        result = await fan_out(connections, lambda connection: connection.send_frame("notifications", frame), label=label)
+        for connection, error in result.failed:
+            error_context = f"user {connection.user_id}" if connection.is_authenticated() else "anonymous connection"
+            logger.error(f"Error sending notification to {error_context}: {str(error)}")
             self.remove_connection(connection)
+        return result
 
-    async def _send_to_user_connections(self, user_id: str, notification_response: dict):
+    async def _send_to_user_connections(self, user_id: str, frame: FrameCache) -> FanoutResult:
         """Send notification to all connections of a specific user"""
-        if user_id in self.user_connections:
-            for connection in self.user_connections[user_id]:
-                await self._send_to_connection(connection, notification_response, user_id)
+        connections = self.user_connections.get(user_id, ())
+        return await self._send_to_connections(connections, frame, f"notification to user {user_id}")
 
-    async def _send_to_group_members(self, group_id: str, notification_response: dict):
-        """Send notification to all members of a group"""
-        for user_id, connections in self.user_connections.items():
-            user_groups = await get_user_groups(user_id)
-            if any(group["id"] == group_id for group in user_groups):
-                await self._send_to_user_connections(user_id, notification_response)
+    async def _send_to_group_members(self, group_id: str, frame: FrameCache) -> FanoutResult:
+        """Send notification to all online members of a group"""
+        connections = [
+            connection
+            for user_id in self.group_index.members(group_id)
+            for connection in self.user_connections.get(user_id, ())
+        ]
+        return await self._send_to_connections(connections, frame, f"notification to group {group_id}")
 
-    async def _send_broadcast(self, notification_response: dict):
+    async def _send_broadcast(self, frame: FrameCache) -> FanoutResult:
         """Send notification to all connected users and anonymous connections"""
-        for connections in self.user_connections.values():
-            for connection in connections:
-                await self._send_to_connection(connection, notification_response)
+        connections = [connection for connections in self.user_connections.values() for connection in connections]
+        connections.extend(self.anonymous_connections)
+        return await self._send_to_connections(connections, frame, "notification broadcast")
 
-        for connection in self.anonymous_connections:
-            await self._send_to_connection(connection, notification_response)
+    def _on_group_change(self, user_id: str) -> None:
+        """Relay a group change to every worker, can be called from any thread"""
+        # The unread count follows on its own, it is made again once it is read with the new groups
+        payload = {"user_id": user_id}
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self._loop:
+            asyncio.create_task(get_worker_bus().publish("group_changes", payload))
+        else:
+            asyncio.run_coroutine_threadsafe(get_worker_bus().publish("group_changes", payload), self._loop)
+
+    async def _invalidate_user_groups(self, payload: dict) -> None:
+        """Refresh the indexed groups of a user after a group change"""
+        self.group_index.invalidate(payload["user_id"])
 
     async def handle_in_app_message(self, notification: NotificationRequest):
         """Handler for in-app messages registered with the message bus"""
-        if self.db is None:
-            logger.error("NotificationService not properly initialized")
-            return
-
-        new_notification = Notification(
-            recipient_type=notification.recipient_type,
-            recipient=notification.recipient,
-            payload=notification.payload
-        )
-        
-        self.db.add(new_notification)
-        self.db.commit()
-        self.db.refresh(new_notification)  # Refresh to get the id and created_at
-        
+        # The message bus workers run after the request that sent the message, use a session of their own
+        with SessionLocal() as db:
+            new_notification = Notification(
+                recipient_type=notification.recipient_type,
+                recipient=notification.recipient,
+                payload=notification.payload
+            )
+            db.add(new_notification)
+            db.commit()
+            db.refresh(new_notification)  # Refresh to get the id and created_at
+            db.expunge(new_notification)
+
         # Use the created notification for real-time updates
         await self.handle_real_time_notification(new_notification)
 
     async def handle_real_time_notification(self, notification: Notification):
-        """Handle real-time notifications and send them directly to connected clients"""
+        """Handle real-time notifications and send them to the clients connected to any worker"""
         try:
-            # Convert notification to response format
             notification_response = NotificationResponse.model_validate(notification).model_dump()
-            
-            if notification.recipient_type == RecipientType.UNICAST:
-                await self._send_to_user_connections(notification.recipient, notification_response)
+            await get_worker_bus().publish("notifications", notification_response)
+            logger.info(f"Real-time notification sent: {notification}")
+        except Exception as e:
+            logger.error(f"Error handling real-time notification: {str(e)}")
 
-            elif notification.recipient_type == RecipientType.MULTICAST:
-                await self._send_to_group_members(notification.recipient, notification_response)
+    async def _deliver_notification(self, notification_response: dict):
+        """Send a notification to the matching clients connected to this worker"""
+        try:
+            # Encode the frame once for every recipient (and once per negotiated codec)
+            websocket_service = WebSocketService()
+            frame = FrameCache(websocket_service.encode_message("notifications", {
+                "action": "new_notification",
+                "notification": notification_response
+            }), websocket_service.serializer)
 
-            elif notification.recipient_type == RecipientType.BROADCAST:
-                await self._send_broadcast(notification_response)
+            recipient_type = notification_response["recipient_type"]
+            recipient = notification_response["recipient"]
 
-            logger.info(f"Real-time notification sent: {notification}")
-            logger.debug(f"Anonymous connections: {str(self.anonymous_connections)}")
+            result = None
+            if recipient_type == RecipientType.UNICAST:
+                result = await self._send_to_user_connections(recipient, frame)
+
+            elif recipient_type == RecipientType.MULTICAST:
+                result = await self._send_to_group_members(recipient, frame)
+
+            elif recipient_type == RecipientType.BROADCAST:
+                result = await self._send_broadcast(frame)
+
+            if result is not None:
+                logger.info(
+                    f"Notification {notification_response.get('id')} queued on {result.sent} connections "
+                    f"in {result.elapsed * 1000:.2f}ms ({len(result.failed)} failed)"
+                )
+                await self._increment_unread_counts(recipient_type, recipient)
         except Exception as e:
-            logger.error(f"Error handling real-time notification: {str(e)}")
+            logger.error(f"Error delivering real-time notification: {str(e)}")
+
+    async def _increment_unread_counts(self, recipient_type: RecipientType, recipient: Optional[str]) -> None:
+        """Count a new notification for its recipients online in this worker and push their counts"""
+        if recipient_type == RecipientType.UNICAST:
+            user_ids = [recipient]
+        elif recipient_type == RecipientType.MULTICAST:
+            user_ids = list(self.group_index.members(recipient))
+        else:
+            user_ids = list(self.unread_counts)
+
+        counts = {}
+        for user_id in user_ids:
+            if user_id in self.unread_counts:
+                self.unread_counts[user_id] += 1
+                counts[user_id] = self.unread_counts[user_id]
+        if counts:
+            await self._send_unread_counts(counts)
+
+    @staticmethod
+    def _read_watermark(db: Session, user_id: str) -> int:
+        """Get the id up to which every notification was read by a user"""
+        read_up_to = db.query(NotificationReadWatermark.read_up_to).filter(
+            NotificationReadWatermark.user_id == user_id
+        ).scalar()
+        return read_up_to or 0
+
+    def _unread_query(self, db: Session, user_id: str, group_ids: List[str]):
+        """
+        Query the notifications a user has not read yet
+
+        Notifications up to the read watermark are skipped by the id range, the ones after it
+        are checked against the individual read marks of the user.
+        """
+        read = exists().where(
+            NotificationRead.user_id == user_id,
+            NotificationRead.notification_id == Notification.id
+        )
+        return db.query(Notification).filter(
+            Notification.id > self._read_watermark(db, user_id),
+            self._recipient_filter(user_id, group_ids),
+            ~read
+        )
+
+    @staticmethod
+    def _recipient_filter(user_id: str, group_ids: List[str]):
+        """Match the notifications sent to a user, to any of their groups, or broadcast"""
+        recipients = [
+            (Notification.recipient_type == RecipientType.UNICAST) & (Notification.recipient == user_id),
+            Notification.recipient_type == RecipientType.BROADCAST
+        ]
+        if group_ids:
+            recipients.append(
+                (Notification.recipient_type == RecipientType.MULTICAST) & (Notification.recipient.in_(group_ids))
+            )
+        return or_(*recipients)
+
+    async def _user_group_ids(self, user_id: str) -> List[str]:
+        """Get the group ids of a user, from the membership index when the user is online"""
+        groups = self.group_index.groups(user_id)
+        if groups is None:
+            groups = [group["id"] for group in await get_user_groups(user_id)]
+        return list(groups)
+
+    def _sync_counter(self, db: Session, user_id: str, group_ids: Optional[List[str]]) -> NotificationCounter:
+        """
+        Add the notifications created since the last count to the unread counter of a user
+
+        A counter made against other groups is counted again from scratch, so joining or leaving
+        a group, in Keycloak or through the API, is reflected on the next read. When the groups
+        of the user are unknown (None) the counter is left as it is. The counter is left in the
+        session, the caller commits it.
+        """
+        latest = db.query(func.max(Notification.id)).scalar() or 0
+        counter = db.get(NotificationCounter, user_id)
+        if counter is None:
+            statement = self._insert(db, NotificationCounter).values(user_id=user_id, unread=0, counted_up_to=0)
+            if hasattr(statement, "on_conflict_do_nothing"):
+                # Another request reading the count for the first time may have created it already
+                statement = statement.on_conflict_do_nothing()
+            db.execute(statement)
+            counter = db.get(NotificationCounter, user_id)
+        if group_ids is None:
+            return counter
+
+        groups = json.dumps(sorted(group_ids))
+        if counter.groups != groups:
+            counter.unread = self._unread_query(db, user_id, group_ids).filter(Notification.id <= latest).count()
+            counter.counted_up_to = latest
+            counter.groups = groups
+        elif counter.counted_up_to < latest:
+            counter.unread += self._unread_query(db, user_id, group_ids).filter(
+                Notification.id > counter.counted_up_to,
+                Notification.id <= latest
+            ).count()
+            counter.counted_up_to = latest
+        return counter
+
+    async def get_unread_count(self, db: Session, user_id: str) -> int:
+        """Get the number of unread notifications of a user"""
+        if db is None:
+            raise NotificationNotInitializedError()
 
-    async def get_user_notifications(self, user_id: str) -> List[Notification]:
+        try:
+            group_ids = await self._user_group_ids(user_id)
+        except Exception as e:
+            # Counting without the groups would skip their notifications for good
+            logger.error(f"Failed to get the groups of user {user_id}, unread count not updated: {str(e)}")
+            group_ids = None
+        counter = self._sync_counter(db, user_id, group_ids)
+        db.commit()
+        return counter.unread
+
+    async def track_unread_count(self, db: Session, user_id: str) -> None:
+        """Send the unread count to a user that came online, it is pushed again on every change"""
+        count = await self.get_unread_count(db, user_id)
+        if user_id in self.user_connections:
+            self.unread_counts[user_id] = count
+            await self._send_unread_counts({user_id: count})
+
+    async def _publish_unread_count(self, user_id: str, count: int) -> None:
+        """Send a new unread count to the connections of the user in every worker"""
+        await get_worker_bus().publish("notification_counts", {"user_id": user_id, "count": count})
+
+    async def _deliver_unread_count(self, payload: dict) -> None:
+        """Push an unread count to the connections of the user in this worker"""
+        user_id = payload["user_id"]
+        if user_id in self.unread_counts:
+            self.unread_counts[user_id] = payload["count"]
+            await self._send_unread_counts({user_id: payload["count"]})
+
+    async def _send_unread_counts(self, counts: Dict[str, int]) -> None:
+        """Push unread counts to their users, users with the same count share the encoded frame"""
+        websocket_service = WebSocketService()
+        by_count: Dict[int, List[WebSocketConnection]] = {}
+        for user_id, count in counts.items():
+            by_count.setdefault(count, []).extend(self.user_connections.get(user_id, ()))
+        for count, connections in by_count.items():
+            frame = FrameCache(websocket_service.encode_message("notifications", {
+                "action": "unread_count",
+                "count": count
+            }), websocket_service.serializer)
+            await self._send_to_connections(connections, frame, f"unread count {count}")
+
+    async def get_user_notifications(
+        self,
+        db: Session,
+        user_id: str,
+        before_id: Optional[int] = None,
+        limit: Optional[int] = None,
+        since: Optional[datetime] = None
+    ) -> List[Notification]:
         """
-        Get all unread notifications for a user, including individual notifications,
-        notifications sent to their groups, and broadcast notifications.
+        Get the unread notifications of a user, including individual notifications,
+        notifications sent to their groups, and broadcast notifications, newest first.
+
+        Args:
+            db (Session): The session of the request
+            user_id (str): The user id
+            before_id (int, optional): Only return notifications older than this id, for the next page
+            limit (int, optional): Maximum number of notifications to return
+            since (datetime, optional): Only return notifications created at or after this time
         """
-        if self.db is None:
+        if db is None:
             raise NotificationNotInitializedError()
 
         # Get user's groups
-        user_groups = await get_user_groups(user_id)
-        group_ids = [group["id"] for group in user_groups]
-
-        # Query notifications that haven't been read by the user
-        notifications = self.db.query(Notification).filter(
-            ~Notification.id.in_(
-                self.db.query(NotificationRead.notification_id).filter(
-                    NotificationRead.user_id == user_id
-                )
-            ),
-            # Get notifications sent directly to the user, to any of their groups, or broadcasts
-            (
-                (Notification.recipient_type == RecipientType.UNICAST) & (Notification.recipient == user_id) |
-                (Notification.recipient_type == RecipientType.MULTICAST) & (Notification.recipient.in_(group_ids)) |
-                (Notification.recipient_type == RecipientType.BROADCAST)
-            )
-        ).order_by(Notification.created_at.desc()).all()
+        group_ids = await self._user_group_ids(user_id)
+
+        query = self._unread_query(db, user_id, group_ids)
+        if before_id is not None:
+            query = query.filter(Notification.id < before_id)
+        if since is not None:
+            query = query.filter(Notification.created_at >= since)
+        query = query.order_by(Notification.id.desc())
+        if limit is not None:
+            query = query.limit(limit)
+        return query.all()
+
+    async def mark_all_notifications_read(self, db: Session, user_id: str) -> int:
+        """
+        Mark every notification sent so far as read by moving the user's read watermark
+
+        Returns:
+            int: The number of notifications that were unread
+        """
+        if db is None:
+            raise NotificationNotInitializedError()
+
+        group_ids = await self._user_group_ids(user_id)
+        latest = db.query(func.max(Notification.id)).scalar() or 0
+        count = self._unread_query(db, user_id, group_ids).filter(Notification.id <= latest).count()
 
-        return notifications
+        watermark = db.get(NotificationReadWatermark, user_id)
+        if watermark is None:
+            db.add(NotificationReadWatermark(user_id=user_id, read_up_to=latest))
+        elif watermark.read_up_to < latest:
+            watermark.read_up_to = latest
+        # Individual read marks under the watermark are redundant now
+        db.query(NotificationRead).filter(
+            NotificationRead.user_id == user_id,
+            NotificationRead.notification_id <= latest
+        ).delete(synchronize_session=False)
+        counter = self._sync_counter(db, user_id, group_ids)
+        counter.unread = 0
+        db.commit()
+        await self._publish_unread_count(user_id, 0)
+        return count
 
-    async def get_broadcast_notifications(self) -> List[Notification]:
+    async def get_broadcast_notifications(
+        self,
+        db: Session,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        before_id: Optional[int] = None,
+        limit: int = NOTIFICATIONS_PAGE_SIZE_MAX
+    ) -> List[Notification]:
         """
-        Get all broadcast notifications.
+        Get the broadcast notifications sent in a time window, newest first
+
+        Args:
+            db (Session): The session of the request
+            since (datetime, optional): Only notifications created at or after this time
+            until (datetime, optional): Only notifications created before this time
+            before_id (int, optional): Only notifications older than this id, for the next page
+            limit (int): Maximum number of notifications to return
         """
-        if self.db is None:
+        if db is None:
             raise NotificationNotInitializedError()
 
         # Query broadcast notifications
-        notifications = self.db.query(Notification).filter(
+        query = db.query(Notification).filter(
             Notification.recipient_type == RecipientType.BROADCAST
-        ).order_by(Notification.created_at.desc()).all()
+        )
+        if since is not None:
+            query = query.filter(Notification.created_at >= since)
+        if until is not None:
+            query = query.filter(Notification.created_at < until)
+        if before_id is not None:
+            query = query.filter(Notification.id < before_id)
 
-        return notifications
+        return query.order_by(Notification.id.desc()).limit(limit).all()
@@ -0,0 +1,263 @@
+from typing import Awaitable, Callable, Collection, Iterable, List, NamedTuple, Optional, Tuple
+from datetime import UTC, datetime, timedelta
+from sqlalchemy import or_, select, update
+from sqlalchemy.orm import Session
+from dependencies.database import SessionLocal
+from models.message import Message
+from schemas.notification import NotificationRequest
+from services.write_batcher import WriteBatcher
+from constants.message_bus import (
+    MESSAGE_OUTBOX_BATCH_SIZE,
+    MESSAGE_OUTBOX_POLL_INTERVAL,
+    MESSAGE_OUTBOX_LEASE,
+    MESSAGE_OUTBOX_MAX_ATTEMPTS,
+    MESSAGE_OUTBOX_BACKOFF_BASE,
+    MESSAGE_OUTBOX_BACKOFF_MAX
+)
+import asyncio
+import itertools
+import json
+import logging
+import os
+import socket
+import uuid
+
+logger = logging.getLogger("coffeebreak.core")
+
+# Longest error message kept on a message
+LAST_ERROR_LENGTH = 1000
+# Message ids per UPDATE ... WHERE id IN
+UPDATE_BATCH_SIZE = 500
+
+
+class DeliveryOutcome(NamedTuple):
+    """Outcome of a message, queued on the recorder of the outbox"""
+    message_id: int
+    error: Optional[str]
+    handled: Tuple[str, ...]
+
+
+class OutboxDispatcher:
+    """
+    Delivers the messages of the messages table at least once
+
+    A message is claimed by the worker that sends it and by nobody else until its lease runs out.
+    The handlers mark it delivered, or push its next attempt back exponentially and record the
+    error, along with the handlers that succeeded so a retry does not run them again. The
+    dispatcher polls the table for the undelivered messages that are due (left over by a failure,
+    a crash or a restart) and claims them in batches; the claim is a single conditional UPDATE, so
+    every worker can poll and each message still goes to one of them. Every poll also renews the
+    leases of the messages this worker still holds, queued or being handled, so a backlog does
+    not let them be claimed a second time. The outcomes of the messages handled at about the same
+    time are recorded in one transaction (see WriteBatcher), the delivered ones with one UPDATE.
+
+    Args:
+        enqueue: Called with the message id, the request and the handlers that already succeeded
+            of every claimed message
+        types: Returns the message types to deliver, the ones with handlers
+        held: Returns the ids of the messages this worker claimed and did not record yet
+        session_factory: Creates the sessions of the dispatcher, its calls run in threads
+        recorder: Batcher the outcomes are queued on as DeliveryOutcome items, its write must pass
+            them to apply_outcomes; by default the dispatcher has a batcher of its own
+    """
+    def __init__(
+        self,
+        enqueue: Callable[[int, NotificationRequest, Collection[str]], Awaitable[None]],
+        types: Callable[[], Iterable[str]],
+        held: Callable[[], Iterable[int]] = lambda: (),
+        batch_size: int = MESSAGE_OUTBOX_BATCH_SIZE,
+        poll_interval: float = MESSAGE_OUTBOX_POLL_INTERVAL,
+        lease: float = MESSAGE_OUTBOX_LEASE,
+        max_attempts: int = MESSAGE_OUTBOX_MAX_ATTEMPTS,
+        backoff_base: float = MESSAGE_OUTBOX_BACKOFF_BASE,
+        backoff_max: float = MESSAGE_OUTBOX_BACKOFF_MAX,
+        session_factory: Callable[[], Session] = SessionLocal,
+        recorder: Optional[WriteBatcher] = None
+    ):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.session_factory = session_factory
+        self._enqueue = enqueue
+        self._types = types
+        self._held = held
+        # Unique per process, a restarted worker does not inherit the claims of its predecessor
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._claims = itertools.count()
+        self.recorder = recorder or WriteBatcher(session_factory, write=self.record_batch, label="delivery outcomes")
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def new_claim(self) -> Tuple[str, datetime]:
+        """Get a claim token and the end of its lease, for a message claimed as it is created"""
+        return f"{self.owner}:{next(self._claims)}", datetime.now(UTC) + timedelta(seconds=self.lease)
+
+    def backoff(self, attempts: int) -> float:
+        """Seconds to wait before the next attempt of a message that failed `attempts` times"""
+        return min(self.backoff_base * 2 ** (attempts - 1), self.backoff_max)
+
+    async def start(self) -> None:
+        """Start polling the outbox"""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop polling and write the recorded outcomes, the messages still claimed are delivered again once their lease runs out"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.recorder.stop()
+
+    async def flush(self) -> None:
+        """Wait until every recorded outcome was written"""
+        await self.recorder.flush()
+
+    def wakeup(self) -> None:
+        """Poll the outbox now instead of waiting for the next interval"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def run_once(self) -> int:
+        """
+        Claim and queue the due messages
+
+        Returns:
+            int: Number of messages claimed
+        """
+        held = list(self._held())
+        if held:
+            await asyncio.to_thread(self._renew, held)
+        types = list(self._types())
+        if not types:
+            return 0
+        claimed = 0
+        while True:
+            messages = await asyncio.to_thread(self._claim, types)
+            for message_id, notification, handled in messages:
+                await self._enqueue(message_id, notification, handled)
+            claimed += len(messages)
+            if len(messages) < self.batch_size:
+                break
+        if claimed:
+            logger.info(f"Outbox claimed {claimed} undelivered messages")
+        return claimed
+
+    async def record(self, message_id: int, error: Optional[str] = None, handled: Collection[str] = ()) -> None:
+        """Mark a message delivered, or schedule its next attempt if a handler failed
+
+        Args:
+            handled: The handlers that succeeded, they are skipped by the next attempts
+        """
+        try:
+            await self.recorder.add(DeliveryOutcome(message_id, error, tuple(handled)))
+        except Exception as e:
+            # The lease runs out and the message is delivered again
+            logger.error(f"Failed to record the delivery of message {message_id}: {str(e)}")
+
+    def record_later(self, message_id: int, error: Optional[str] = None, handled: Collection[str] = ()) -> None:
+        """Record the outcome of a message with the next batch without waiting for it, see record"""
+        def log_failure(future: asyncio.Future) -> None:
+            if not future.cancelled() and future.exception() is not None:
+                # The lease runs out and the message is delivered again
+                logger.error(f"Failed to record the delivery of message {message_id}: {str(future.exception())}")
+
+        self.recorder.submit(DeliveryOutcome(message_id, error, tuple(handled))).add_done_callback(log_failure)
+
+    def _renew(self, message_ids: List[int]) -> None:
+        claimed_until = datetime.now(UTC) + timedelta(seconds=self.lease)
+        with self.session_factory() as db:
+            for start in range(0, len(message_ids), UPDATE_BATCH_SIZE):
+                db.execute(
+                    update(Message)
+                    .where(Message.id.in_(message_ids[start:start + UPDATE_BATCH_SIZE]), Message.delivered.is_(False))
+                    .values(claimed_until=claimed_until)
+                    .execution_options(synchronize_session=False)
+                )
+            db.commit()
+
+    def _claim(self, types: List[str]) -> List[Tuple[int, NotificationRequest, List[str]]]:
+        now = datetime.now(UTC)
+        claim, claimed_until = self.new_claim()
+        due = (
+            Message.delivered.is_(False),
+            Message.type.in_(types),
+            Message.attempts < self.max_attempts,
+            Message.next_attempt_at <= now,
+            or_(Message.claimed_until.is_(None), Message.claimed_until < now)
+        )
+        with self.session_factory() as db:
+            candidates = select(Message.id).where(*due).order_by(Message.priority.desc(), Message.id).limit(self.batch_size)
+            if db.get_bind().dialect.name == "postgresql":
+                candidates = candidates.with_for_update(skip_locked=True)
+            # The conditions are checked again by the UPDATE, a message claimed in between is skipped
+            db.execute(
+                update(Message)
+                .where(Message.id.in_(candidates.scalar_subquery()), *due)
+                .values(claimed_by=claim, claimed_until=claimed_until)
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+            messages = db.query(Message).filter(Message.claimed_by == claim).order_by(Message.priority.desc(), Message.id).all()
+            return [
+                (message.id, NotificationRequest(
+                    type=message.type,
+                    recipient_type=message.recipient_type,
+                    recipient=message.recipient,
+                    payload=message.payload,
+                    priority=message.priority
+                ), json.loads(message.handled_by or "[]"))
+                for message in messages
+            ]
+
+    def record_batch(self, outcomes: List[DeliveryOutcome]) -> list:
+        """Record outcomes in one transaction of their own"""
+        with self.session_factory() as db:
+            self.apply_outcomes(db, outcomes)
+            db.commit()
+        return [None] * len(outcomes)
+
+    def apply_outcomes(self, db: Session, outcomes: List[DeliveryOutcome]) -> None:
+        """Update the messages of outcomes in a session, the caller commits it"""
+        delivered = [outcome.message_id for outcome in outcomes if outcome.error is None]
+        failed = {outcome.message_id: outcome for outcome in outcomes if outcome.error is not None}
+        for start in range(0, len(delivered), UPDATE_BATCH_SIZE):
+            db.execute(
+                update(Message)
+                .where(Message.id.in_(delivered[start:start + UPDATE_BATCH_SIZE]), Message.delivered.is_(False))
+                .values(delivered=True, last_error=None, claimed_by=None, claimed_until=None)
+                .execution_options(synchronize_session=False)
+            )
+        if failed:
+            # Each failure gets its own backoff, the rows are updated one by one in the same transaction
+            for message in db.query(Message).filter(Message.id.in_(list(failed)), Message.delivered.is_(False)):
+                outcome = failed[message.id]
+                message.handled_by = json.dumps(sorted(outcome.handled)) if outcome.handled else None
+                message.attempts = (message.attempts or 0) + 1
+                message.last_error = outcome.error[:LAST_ERROR_LENGTH]
+                message.next_attempt_at = datetime.now(UTC) + timedelta(seconds=self.backoff(message.attempts))
+                message.claimed_by = None
+                message.claimed_until = None
+                if message.attempts >= self.max_attempts:
+                    logger.error(f"Message {message.id} failed {message.attempts} times, giving up: {outcome.error}")
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in outbox dispatcher: {str(e)}")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,217 @@
+from typing import Callable, List, Optional
+from datetime import UTC, datetime, timedelta
+from enum import Enum
+from sqlalchemy.orm import Session
+from dependencies.database import SessionLocal
+from models.archive import ArchivedRecord
+from models.event import Event
+from models.message import Message
+from models.notification import Notification, NotificationCounter, NotificationRead
+from constants.retention import (
+    RetentionMode,
+    RETENTION_ENABLED,
+    RETENTION_MODE,
+    RETENTION_INTERVAL,
+    RETENTION_BATCH_SIZE,
+    NOTIFICATION_RETENTION_DAYS,
+    MESSAGE_RETENTION_DAYS,
+    EVENT_RETENTION_DAYS
+)
+import asyncio
+import fcntl
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger("coffeebreak.core")
+
+
+class RetentionPolicy:
+    """
+    How long the rows of a table are kept
+
+    Args:
+        model: The model of the table, it must have an integer `id` primary key
+        timestamp: The column compared with the retention period
+        days: Retention period, 0 keeps the rows forever
+        condition: Extra filter, only matching rows are removed
+        dependents: (model, foreign key column name) pairs of the rows deleted together with
+            the rows they reference
+        on_removed: Called with the session after a batch was removed, in the same transaction
+    """
+    def __init__(self, model, timestamp, days: int, condition=None, dependents=(), on_removed: Callable[[Session], None] = None):
+        self.model = model
+        self.timestamp = timestamp
+        self.days = days
+        self.condition = condition
+        self.dependents = list(dependents)
+        self.on_removed = on_removed
+
+    @property
+    def name(self) -> str:
+        return self.model.__tablename__
+
+
+def _reset_unread_counters(db: Session) -> None:
+    # Removed notifications can no longer be marked read, the counts are redone on their next read
+    db.query(NotificationCounter).delete(synchronize_session=False)
+
+
+def default_policies() -> List[RetentionPolicy]:
+    """Retention policies of the core tables, from the environment"""
+    return [
+        RetentionPolicy(
+            Notification,
+            Notification.created_at,
+            NOTIFICATION_RETENTION_DAYS,
+            dependents=[(NotificationRead, "notification_id")],
+            on_removed=_reset_unread_counters
+        ),
+        # Undelivered messages are kept until they are delivered
+        RetentionPolicy(Message, Message.created_at, MESSAGE_RETENTION_DAYS, condition=Message.delivered.is_(True)),
+        RetentionPolicy(Event, Event.timestamp, EVENT_RETENTION_DAYS),
+    ]
+
+
+class RetentionService:
+    """
+    Background job keeping the hot tables small
+
+    Every `interval` seconds the rows older than their retention period are archived (or just
+    deleted) in batches, one transaction per batch, so the tables stay available during a pass.
+    Only one worker runs the job, the others wait for its lock in case it goes away.
+    """
+    def __init__(
+        self,
+        policies: Optional[List[RetentionPolicy]] = None,
+        mode: RetentionMode = RETENTION_MODE,
+        interval: float = RETENTION_INTERVAL,
+        batch_size: int = RETENTION_BATCH_SIZE,
+        session_factory: Callable[[], Session] = SessionLocal
+    ):
+        self.policies = policies if policies is not None else default_policies()
+        self.mode = mode
+        self.interval = interval
+        self.batch_size = batch_size
+        self._session_factory = session_factory
+        self._lock_fd = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Start running the job periodically"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the job and release its lock"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._lock_fd is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+            self._lock_fd.close()
+            self._lock_fd = None
+
+    async def run_once(self) -> dict:
+        """
+        Remove the expired rows of every table
+
+        Returns:
+            dict: Number of rows removed per table
+        """
+        removed = {}
+        for policy in self.policies:
+            if policy.days <= 0:
+                continue
+            cutoff = datetime.now(UTC) - timedelta(days=policy.days)
+            removed[policy.name] = 0
+            while True:
+                # The database calls block, each batch runs in a thread
+                count = await asyncio.to_thread(self._remove_batch, policy, cutoff)
+                removed[policy.name] += count
+                if count < self.batch_size:
+                    break
+            if removed[policy.name]:
+                logger.info(f"Retention removed {removed[policy.name]} rows from {policy.name} ({self.mode})")
+        return removed
+
+    def _remove_batch(self, policy: RetentionPolicy, cutoff: datetime) -> int:
+        """Archive and delete the oldest batch of expired rows of a table"""
+        model = policy.model
+        with self._session_factory() as db:
+            query = db.query(model).filter(policy.timestamp < cutoff)
+            if policy.condition is not None:
+                query = query.filter(policy.condition)
+            rows = query.order_by(model.id).limit(self.batch_size).all()
+            if not rows:
+                return 0
+
+            ids = [row.id for row in rows]
+            if self.mode == RetentionMode.ARCHIVE:
+                db.add_all(
+                    ArchivedRecord(
+                        source=policy.name,
+                        record_id=row.id,
+                        created_at=getattr(row, policy.timestamp.key),
+                        data=self._serialize(row)
+                    )
+                    for row in rows
+                )
+            for dependent, column in policy.dependents:
+                db.query(dependent).filter(getattr(dependent, column).in_(ids)).delete(synchronize_session=False)
+            db.query(model).filter(model.id.in_(ids)).delete(synchronize_session=False)
+            if policy.on_removed is not None:
+                policy.on_removed(db)
+            db.commit()
+            return len(ids)
+
+    @staticmethod
+    def _serialize(row) -> dict:
+        data = {}
+        for column in row.__table__.columns:
+            value = getattr(row, column.key)
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            elif isinstance(value, Enum):
+                value = value.value
+            data[column.key] = value
+        return data
+
+    def _acquire_lock(self) -> bool:
+        """Take the job lock without waiting, True if this worker runs the job"""
+        if self._lock_fd is not None:
+            return True
+        lock_fd = open(os.path.join(tempfile.gettempdir(), "coffeebreak_retention.lock"), "w")
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            lock_fd.close()
+            return False
+        self._lock_fd = lock_fd
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if self._acquire_lock():
+                    await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in retention job: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+
+_retention_service: Optional[RetentionService] = None
+
+
+def get_retention_service() -> Optional[RetentionService]:
+    """Get the retention job of this process, None when RETENTION_ENABLED is false"""
+    global _retention_service
+    if _retention_service is None and RETENTION_ENABLED:
+        _retention_service = RetentionService()
+    return _retention_service
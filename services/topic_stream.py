@@ -0,0 +1,43 @@
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+
+class TopicStream:
+    """
+    Bounded history of the frames broadcast on a topic
+
+    Every frame gets a sequence number, monotonically increasing per topic. Only the most
+    recent `size` frames are kept so a reconnecting client can be sent the frames it missed,
+    as long as they have not been evicted yet.
+    """
+    def __init__(self, size: int):
+        self._frames: Deque[Tuple[int, str]] = deque(maxlen=size)
+        self.last_seq = 0
+
+    def next_seq(self) -> int:
+        """Reserve the sequence number of the next frame"""
+        self.last_seq += 1
+        return self.last_seq
+
+    def append(self, seq: int, frame: str) -> None:
+        """Store an encoded frame under its sequence number"""
+        if self._frames.maxlen:
+            self._frames.append((seq, frame))
+
+    def since(self, last_seq: int) -> Optional[List[str]]:
+        """
+        Get the frames sent after last_seq, oldest first
+
+        Returns None when some of those frames were already evicted (or last_seq is from the
+        future), meaning the client has to do a full resync.
+        """
+        if last_seq > self.last_seq or last_seq < 0:
+            return None
+        if last_seq == self.last_seq:
+            return []
+        if not self._frames or self._frames[0][0] > last_seq + 1:
+            return None
+        return [frame for seq, frame in self._frames if seq > last_seq]
+
+    def __len__(self) -> int:
+        return len(self._frames)
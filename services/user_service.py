@@ -1,5 +1,8 @@
-from typing import List
-from dependencies.auth import keycloak_admin, assign_role
+from typing import AsyncIterator, List, Optional, Tuple
+from dependencies.auth import assign_role
+from constants.keycloak import ROLE_MEMBERS_CONCURRENCY
+from services.keycloak_admin import get_keycloak_admin
+from services.directory import get_directory
 from exceptions.user import (
     UserNotFoundError,
     UserListError,
@@ -12,7 +15,7 @@ import asyncio
 
 async def list_users() -> List[dict]:
     try:
-        users = keycloak_admin.get_users()
+        users = await get_directory().users()
         return users
     except Exception as e:
         raise UserListError(str(e))
@@ -21,7 +24,7 @@ async def list_users() -> List[dict]:
 async def list_roles() -> List:
     try:
         # Fetch all roles
-        roles = keycloak_admin.get_realm_roles()
+        roles = await get_directory().roles()
 
         # Filter roles with "cb-" prefix
         filtered_roles = [
@@ -32,24 +35,45 @@ async def list_roles() -> List:
         raise UserListError(str(e))
 
 
-async def list_role_users() -> dict:
+async def iter_role_users(
+    first: Optional[int] = None,
+    max: Optional[int] = None,
+    concurrency: int = ROLE_MEMBERS_CONCURRENCY
+) -> AsyncIterator[Tuple[str, List[dict]]]:
+    """
+    Yield (role name, members) for every "cb-" role, as soon as the members of a role arrive
+
+    The members of up to `concurrency` roles are fetched at once, `first`/`max` select one page
+    of the members of each role.
+    """
     roles = await list_roles()
-    role_users = {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def members(role_name: str) -> Tuple[str, List[dict]]:
+        async with semaphore:
+            return role_name, await get_directory().role_members(role_name, first=first, max=max)
+
+    tasks = [asyncio.ensure_future(members(r["name"])) for r in roles]
     try:
-        for r in roles:
-            role_name = r["name"]
-            users = keycloak_admin.get_realm_role_members(role_name)
-            role_users[role_name] = users
+        for completed in asyncio.as_completed(tasks):
+            try:
+                yield await completed
+            except Exception as e:
+                raise UserListError(str(e))
+    finally:
+        for task in tasks:
+            task.cancel()
 
-        return role_users
 
-    except Exception as e:
-        raise UserListError(str(e))
+async def list_role_users(first: Optional[int] = None, max: Optional[int] = None) -> dict:
+    role_users = {role_name: users async for role_name, users in iter_role_users(first, max)}
+    # In the order of the roles rather than the order they arrived in
+    return {r["name"]: role_users[r["name"]] for r in await list_roles() if r["name"] in role_users}
 
 
 async def get_user(user_id: str) -> dict:
     try:
-        user = keycloak_admin.get_user(user_id)
+        user = await get_directory().user(user_id)
         return user
     except Exception as _:
         raise UserNotFoundError(user_id)
@@ -57,24 +81,27 @@ async def get_user(user_id: str) -> dict:
 
 async def create_user(user_data: dict) -> dict:
     try:
-        user_id = keycloak_admin.create_user(user_data)
-        return keycloak_admin.get_user(user_id)
+        user_id = await get_keycloak_admin().create_user(user_data)
+        get_directory().invalidate_users()
+        return await get_directory().user(user_id)
     except Exception as e:
         raise UserCreateError(str(e))
 
 
 async def update_user(user_id: str, user_data: dict) -> dict:
     try:
-        keycloak_admin.update_user(user_id, user_data)
-        return keycloak_admin.get_user(user_id)
+        await get_keycloak_admin().update_user(user_id, user_data)
+        get_directory().invalidate_users(user_id)
+        return await get_directory().user(user_id)
     except Exception as e:
         raise UserUpdateError(str(e))
 
 
 async def delete_user(user_id: str) -> dict:
     try:
-        user = keycloak_admin.get_user(user_id)
-        keycloak_admin.delete_user(user_id)
+        user = await get_directory().user(user_id)
+        await get_keycloak_admin().delete_user(user_id)
+        get_directory().invalidate_users(user_id)
         return user
     except Exception as e:
         raise UserDeleteError(str(e))
@@ -82,6 +109,7 @@ async def delete_user(user_id: str) -> dict:
 
 async def assign_role_to_user(user_id: str, role_name: str):
     try:
-        await asyncio.to_thread(assign_role, user_id=user_id, role_name=role_name)
+        await get_keycloak_admin().run(assign_role, user_id=user_id, role_name=role_name)
+        get_directory().invalidate_roles(role_name)
     except ValueError as ve:
         raise UserRoleError(str(ve))
\ No newline at end of file
@@ -1,9 +1,29 @@
-from typing import Dict, Literal, Set, Optional, Any, Callable, Generic, TypeVar
+from typing import Awaitable, Deque, Dict, List, Literal, Set, Optional, Any, Callable, Generic, Tuple, TypeVar
 from fastapi import WebSocket, WebSocketDisconnect
 from datetime import datetime, UTC
 from pydantic import BaseModel, Field
+from collections import deque
+from constants.websocket import (
+    OverflowPolicy,
+    WEBSOCKET_SEND_QUEUE_SIZE,
+    WEBSOCKET_OVERFLOW_POLICY,
+    WEBSOCKET_OVERFLOW_CLOSE_CODE,
+    WEBSOCKET_SERIALIZER,
+    WEBSOCKET_IDLE_TIMEOUT,
+    WEBSOCKET_PONG_TIMEOUT,
+    WEBSOCKET_HEARTBEAT_CLOSE_CODE,
+    WEBSOCKET_RECEIVE_QUEUE_SIZE,
+    WEBSOCKET_REPLAY_BUFFER_SIZE
+)
+from services.heartbeat import HeartbeatScheduler, HeartbeatState
+from services.worker_bus import get_worker_bus
+from services.topic_stream import TopicStream
+from utils.serializer import get_serializer
+from utils.codec import FrameCache, FrameCodec, available_compressions, available_encodings, get_codec
 import logging
 import asyncio
+import sys
+import uuid
 
 logger = logging.getLogger("coffeebreak.websocket")
 
@@ -19,6 +39,7 @@ logger = logging.getLogger("coffeebreak.websocket")
 # - pong: A pong message to respond to a ping
 # - subscription: A subscription message to subscribe to a topic
 # - unsubscribe: A unsubscribe message to unsubscribe from a topic
+# - resume: Resubscribe to a topic and receive the messages sent after a given sequence number
 
 T = TypeVar('T')
 
@@ -26,7 +47,7 @@ class WebSocketMessage(BaseModel, Generic[T]):
     """Base model for all WebSocket messages"""
     type: str = Field(..., description="Message type")
     data: T = Field(..., description="Message payload")
-    timestamp: str = Field(default_factory=lambda: datetime.now().timestamp())
+    timestamp: float = Field(default_factory=lambda: datetime.now().timestamp())
 
 class TopicMessage(WebSocketMessage[T]):
     """Model for topic messages"""
@@ -51,16 +72,63 @@ class SubscriptionResultMessage(BaseModel):
     topic: str
     message: Optional[str] = None
 
-class WebSocketConnection:
+class WebSocketConnection(HeartbeatState):
     """
     Abstraction of a WebSocket connection with additional functionality
+
+    Outbound frames are never written to the socket by the caller. They are appended to a
+    bounded queue that is drained by a writer task owned by the connection, so a slow client
+    only delays its own frames.
+
+    The connection is the only per-connection record of the service: the subscriptions, the
+    heartbeat deadline and the tasks live here, in slots, so tens of thousands of them stay cheap.
     """
-    def __init__(self, websocket: WebSocket, connection_id: str, service: 'WebSocketService' = None):
+    __slots__ = (
+        "_websocket",
+        "connection_id",
+        "_service",
+        "user_id",
+        "_subscribed_topics",
+        "_queue",
+        "_queue_size",
+        "_overflow_policy",
+        "_writer_waiter",
+        "_writer_task",
+        "dropped_frames",
+        "codec",
+        "inbound",
+        "_dispatcher_task",
+    )
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        connection_id: str,
+        service: 'WebSocketService' = None,
+        queue_size: int = WEBSOCKET_SEND_QUEUE_SIZE,
+        overflow_policy: OverflowPolicy = WEBSOCKET_OVERFLOW_POLICY
+    ):
+        super().__init__()
         self._websocket = websocket
         self.connection_id = connection_id
         self._service = service
         self.user_id = None
-        self._subscribed_topics = set()
+        # Topic strings are interned by the service, every subscriber shares the same objects
+        self._subscribed_topics: Set[str] = set()
+        # Outbound queue of (topic, encoded frame) pairs, topic is None for control frames
+        self._queue: Deque[Tuple[Optional[str], str | bytes]] = deque()
+        self._queue_size = queue_size
+        self._overflow_policy = overflow_policy
+        # Future the idle writer waits on, only exists while the queue is empty
+        self._writer_waiter: Optional[asyncio.Future] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        # Number of frames discarded by the overflow policy
+        self.dropped_frames = 0
+        # Negotiated frame codec, None for the default JSON text frames
+        self.codec: Optional[FrameCodec] = None
+        # Inbound frames read by the receive loop, waiting for the dispatcher task
+        self.inbound: asyncio.Queue = asyncio.Queue(maxsize=WEBSOCKET_RECEIVE_QUEUE_SIZE)
+        self._dispatcher_task: Optional[asyncio.Task] = None
     
     async def send(self, topic: str, message: Any) -> None:
         """Send a message through the WebSocket Service"""
@@ -99,9 +167,121 @@ class WebSocketConnection:
         """Get the subscribed topics"""
         return self._subscribed_topics
     
+    def enqueue(self, frame: str | bytes, topic: Optional[str] = None) -> bool:
+        """
+        Queue an encoded frame for delivery without waiting for the socket
+
+        Returns False when the queue is full and the overflow policy is DISCONNECT,
+        in which case the caller is responsible for closing the connection.
+        """
+        if len(self._queue) >= self._queue_size:
+            if self._overflow_policy == OverflowPolicy.DISCONNECT:
+                return False
+            if self._overflow_policy == OverflowPolicy.COALESCE and topic is not None:
+                self._drop_queued(topic)
+            else:
+                self._queue.popleft()
+            self.dropped_frames += 1
+
+        self._queue.append((topic, frame))
+        waiter = self._writer_waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+        return True
+
+    def _drop_queued(self, topic: str) -> None:
+        """Drop the oldest queued frame of a topic, or the oldest frame if none matches"""
+        for index, (queued_topic, _) in enumerate(self._queue):
+            if queued_topic == topic:
+                del self._queue[index]
+                return
+        self._queue.popleft()
+
+    @property
+    def queued_frames(self) -> int:
+        """Get the number of frames waiting to be written"""
+        return len(self._queue)
+
+    def start_writer(self) -> None:
+        """Start the task that drains the outbound queue"""
+        if self._writer_task is None:
+            self._writer_task = asyncio.create_task(self._drain())
+
+    def stop_writer(self) -> None:
+        """Stop the writer task and discard any frames still queued"""
+        if self._writer_task is not None:
+            if self._writer_task is not asyncio.current_task():
+                self._writer_task.cancel()
+            self._writer_task = None
+        self._queue.clear()
+
+    def start_dispatcher(self, dispatch: Callable[['WebSocketConnection', dict], Awaitable[None]]) -> None:
+        """Start the task handing inbound frames to `dispatch`, one at a time and in order"""
+        if self._dispatcher_task is None:
+            self._dispatcher_task = asyncio.create_task(self._dispatch(dispatch))
+
+    def stop_dispatcher(self) -> None:
+        """Stop the dispatcher task"""
+        if self._dispatcher_task is not None:
+            if self._dispatcher_task is not asyncio.current_task():
+                self._dispatcher_task.cancel()
+            self._dispatcher_task = None
+
+    async def _dispatch(self, dispatch: Callable[['WebSocketConnection', dict], Awaitable[None]]) -> None:
+        """Hand inbound frames to the dispatch callback"""
+        while True:
+            message = await self.inbound.get()
+            try:
+                await dispatch(self, message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error dispatching message from {self.connection_id}: {str(e)}")
+
+    async def _drain(self) -> None:
+        """Write queued frames to the socket in order"""
+        try:
+            while True:
+                while self._queue:
+                    _, frame = self._queue.popleft()
+                    if isinstance(frame, bytes):
+                        await self._websocket.send_bytes(frame)
+                    else:
+                        await self._websocket.send_text(frame)
+                self._writer_waiter = asyncio.get_running_loop().create_future()
+                try:
+                    await self._writer_waiter
+                finally:
+                    self._writer_waiter = None
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Error writing to connection {self.connection_id}: {str(e)}")
+            if self._service:
+                asyncio.create_task(self._service.disconnect(self.connection_id))
+
+    @property
+    def is_open(self) -> bool:
+        """Check if the connection is still registered with the service"""
+        return self._service is not None and self._service.connections.get(self.connection_id) is self
+
+    def send_frame(self, topic: str, frame: str | FrameCache) -> None:
+        """
+        Queue a frame already encoded with WebSocketService.encode_message
+
+        Raises ConnectionError if the connection was already disconnected.
+        """
+        if not self.is_open:
+            raise ConnectionError(f"Connection {self.connection_id} is closed")
+        self._service.unsequenced_topics.add(topic)
+        self._service._enqueue(self, frame, topic)
+
     async def _send(self, message: Any) -> None:
-        """Send a message through the WebSocket"""
-        await self._websocket.send_json(message)
+        """Queue a control message (not bound to a topic) for the WebSocket"""
+        if self._service:
+            self._service._enqueue(self, message)
+        else:
+            await self._websocket.send_json(message)
 
     def __str__(self):
         return f"WebSocketConnection(connection_id={self.connection_id}, user_id={self.user_id})"
@@ -127,16 +307,49 @@ class WebSocketService:
         self.connections: Dict[str, WebSocketConnection] = {}
         # Topic handlers mapped by topic
         self.topic_handlers: Dict[str, Dict[str, Set[Callable]]] = {}
-        # Last activity timestamp for each connection
-        self.last_activity: Dict[str, float] = {}
-        # Ping tasks for each connection
-        self.ping_tasks: Dict[str, asyncio.Task] = {}
-        # Idle timeout in seconds (60 seconds to match client)
-        self.idle_timeout = 60
-        # Pong timeout in seconds (15 seconds)
-        self.pong_timeout = 15
+        # Connection ids subscribed to each topic
+        self.topic_subscribers: Dict[str, Set[str]] = {}
+        # Connection ids of each authenticated user
+        self.user_connections: Dict[str, Set[str]] = {}
+        # Serializer used to encode outbound frames, can be replaced at runtime
+        self.serializer = get_serializer(WEBSOCKET_SERIALIZER)
+        # Single scheduler pinging idle connections and expiring the ones that do not answer
+        self.heartbeat = HeartbeatScheduler(
+            on_ping=self._send_pings,
+            on_timeout=self._expire_connections,
+            idle_timeout=WEBSOCKET_IDLE_TIMEOUT,
+            pong_timeout=WEBSOCKET_PONG_TIMEOUT
+        )
+        # Recent frames of each topic, for clients resuming after a reconnect
+        self.streams: Dict[str, TopicStream] = {}
+        # Topics that carried frames sent to specific connections, these are not numbered and
+        # cannot be replayed, so resuming them always needs a resync
+        self.unsequenced_topics: Set[str] = set()
+        # Identifies the sequence numbers of this worker, a client resuming with another one must resync
+        self.stream_id = uuid.uuid4().hex
+        # Broadcasts are relayed to the other workers, each one delivers to its own sockets
+        self.worker_bus = get_worker_bus()
+        self.worker_bus.register("websocket", self._deliver)
         self._initialized = True
 
+    @property
+    def idle_timeout(self) -> float:
+        """Idle time in seconds before a connection is pinged"""
+        return self.heartbeat.idle_timeout
+
+    @idle_timeout.setter
+    def idle_timeout(self, value: float) -> None:
+        self.heartbeat.idle_timeout = value
+
+    @property
+    def pong_timeout(self) -> float:
+        """Time in seconds a pinged connection has to answer before it is closed"""
+        return self.heartbeat.pong_timeout
+
+    @pong_timeout.setter
+    def pong_timeout(self, value: float) -> None:
+        self.heartbeat.pong_timeout = value
+
     def on_receive(self, topic: str):
         """
         Decorator to register a message handler for a specific topic
@@ -214,7 +427,7 @@ class WebSocketService:
         else:
             logger.warning(f"No handlers registered for topic: {topic}")
 
-    async def connect(self, websocket: WebSocket, connection_id: str):
+    async def connect(self, websocket: WebSocket, connection_id: str) -> WebSocketConnection:
         """
         Establish a WebSocket connection
         """
@@ -223,123 +436,162 @@ class WebSocketService:
         # Create new connection
         connection = WebSocketConnection(websocket, connection_id, self)
         self.connections[connection_id] = connection
-        self.last_activity[connection_id] = datetime.now().timestamp()
-
-        # Start ping monitor for this connection
-        self.ping_tasks[connection_id] = asyncio.create_task(
-            self._monitor_connection(connection_id)
-        )
+        connection.start_writer()
+        self.heartbeat.add(connection)
 
         logger.info(f"New WebSocket connection established (connection_id: {connection_id})")
+        return connection
+
+    async def listen(
+        self,
+        connection: WebSocketConnection,
+        dispatch: Callable[[WebSocketConnection, dict], Awaitable[None]]
+    ) -> None:
+        """
+        Run the receive loop of a connection until the client disconnects
+
+        This is the only reader of the socket. Heartbeat frames are answered inline so liveness
+        never waits behind a slow handler, every other frame goes through the inbound queue to
+        the dispatcher task of the connection. Raises WebSocketDisconnect when the client leaves.
+        """
+        connection.start_dispatcher(dispatch)
+        while True:
+            frame = await connection._websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000), frame.get("reason"))
+
+            try:
+                message = self._decode(connection, frame)
+            except Exception:
+                logger.warning(f"Received an invalid frame from {connection.connection_id}")
+                continue
+
+            self.heartbeat.touch(connection)
+            if not isinstance(message, dict):
+                logger.warning(f"Received a non-object frame from {connection.connection_id}")
+                continue
+
+            message_type = message.get("type", "")
+            if message_type == "ping":
+                logger.debug(f"Received PING from {connection.connection_id}, sending PONG")
+                self._enqueue(connection, {"type": "pong"})
+            elif message_type == "pong":
+                logger.debug(f"Received PONG from {connection.connection_id}")
+            else:
+                await connection.inbound.put(message)
+
+    def _decode(self, connection: WebSocketConnection, frame: dict) -> Any:
+        """
+        Decode a received frame, text frames are always JSON and binary frames use the negotiated codec
+        """
+        if frame.get("text") is not None:
+            return self.serializer.loads(frame["text"])
+        codec = connection.codec or get_codec()
+        return codec.decode(frame["bytes"])
+
+    @staticmethod
+    def negotiate_codec(encoding: Optional[str] = None, compression: Optional[str] = None) -> Tuple[str, Optional[str]]:
+        """
+        Pick the frame codec closest to what a client asked for
+
+        Unsupported encodings fall back to JSON and unsupported compressions to none.
+        WebSocket permessage-deflate is negotiated by the server during the HTTP upgrade
+        and does not need to be requested here.
+
+        Returns:
+            tuple: The (encoding, compression) pair that will be used
+        """
+        if encoding not in available_encodings():
+            encoding = "json"
+        if compression not in available_compressions():
+            compression = None
+        return encoding, compression
+
+    def set_codec(self, connection_id: str, encoding: str = "json", compression: Optional[str] = None) -> None:
+        """
+        Switch a connection to another frame codec, frames queued from now on use it
+        """
+        if connection_id in self.connections:
+            codec = None if encoding == "json" and compression is None else get_codec(encoding, compression)
+            self.connections[connection_id].codec = codec
+            logger.debug(f"Connection {connection_id} switched to codec {codec}")
 
     async def authenticate(self, connection_id: str, user_id: str):
         """
         Associate a user_id with a connection
         """
         if connection_id in self.connections:
-            self.connections[connection_id].authenticate(user_id)
+            connection = self.connections[connection_id]
+            self._remove_from_index(self.user_connections, connection.user_id, connection_id)
+            connection.authenticate(user_id)
+            self.user_connections.setdefault(user_id, set()).add(connection_id)
             logger.info(f"Connection {connection_id} authenticated as user {user_id}")
 
-    async def disconnect(self, connection_id: str) -> None:
+    @staticmethod
+    def _remove_from_index(index: Dict[str, Set[str]], key: Optional[str], connection_id: str) -> None:
+        """
+        Remove a connection id from an inverted index, dropping the key once it is empty
+        """
+        if key is None or key not in index:
+            return
+        index[key].discard(connection_id)
+        if not index[key]:
+            del index[key]
+
+    async def disconnect(self, connection_id: str, code: Optional[int] = None) -> None:
         """
         Handle WebSocket disconnection
+
+        If a close code is given the socket is closed from the server side as well.
         """
-        if connection_id in self.connections:
-            connection = self.connections[connection_id]
-            
-            # Create a copy of subscribed topics before iteration
-            topics_to_unsubscribe = connection.subscribed_topics.copy()
-            
+        # Taken out of the registry first, a concurrent disconnect of the same connection is a no-op
+        connection = self.connections.pop(connection_id, None)
+        if connection is not None:
+            # Stop tracking and reading before the unsubscribe handlers get a chance to run
+            self.heartbeat.remove(connection)
+            connection.stop_dispatcher()
+            self._remove_from_index(self.user_connections, connection.user_id, connection_id)
+
             # Call unsubscribe handlers for all topics
-            for topic in topics_to_unsubscribe:
-                await self.unsubscribe(connection_id, topic)
+            for topic in list(connection.subscribed_topics):
+                await self._unsubscribe(connection, topic)
 
-            # Cancel ping task if exists
-            if connection_id in self.ping_tasks:
-                self.ping_tasks[connection_id].cancel()
-                del self.ping_tasks[connection_id]
+            # Stop the writer, pending frames are discarded
+            connection.stop_writer()
 
-            # Remove connection
-            del self.connections[connection_id]
-            self.last_activity.pop(connection_id, None)
+            if code is not None:
+                try:
+                    await connection._websocket.close(code=code)
+                except Exception as e:
+                    logger.debug(f"Error closing connection {connection_id}: {str(e)}")
 
             logger.info(f"WebSocket connection closed (connection_id: {connection_id})")
 
-    async def _monitor_connection(self, connection_id: str):
+    def _send_pings(self, connections: List[WebSocketConnection]) -> None:
         """
-        Monitor connection activity and send pings when idle
+        Send a PING to a batch of idle connections, the frame is encoded once for the batch
         """
-        logger.info(f"Starting connection monitor for {connection_id}")
-        try:
-            while True:
-                # Check if connection still exists
-                if connection_id not in self.connections:
-                    break
-
-                current_time = datetime.now().timestamp()
-                last_activity = self.last_activity.get(connection_id, 0)
-                idle_time = current_time - last_activity
-
-                if idle_time >= self.idle_timeout:
-                    connection = self.connections[connection_id]
-                    logger.debug(f"Connection idle for {idle_time}s, sending PING to {connection_id}")
-                    
-                    try:
-                        # Send PING with Pydantic validation
-                        ping_message = WebSocketMessage(
-                            type="ping",
-                            data=PingMessage().model_dump()
-                        )
-                        await connection._send(ping_message.model_dump())
-                        
-                        # Wait for PONG with timeout
-                        try:
-                            pong_received = False
-                            async with asyncio.timeout(self.pong_timeout):
-                                while not pong_received:
-                                    message = await connection._websocket.receive_json()
-                                    if message.get("type") == "pong":
-                                        # Validate PONG message
-                                        WebSocketMessage(
-                                            type="pong",
-                                            data=PongMessage().model_dump()
-                                        )
-                                        # Update last activity timestamp
-                                        self.last_activity[connection_id] = datetime.now().timestamp()
-                                        logger.debug(f"Received PONG from {connection_id}")
-                                        pong_received = True
-                                        break
-                                    
-                        except asyncio.TimeoutError:
-                            logger.warning(f"No PONG received from {connection_id} within {self.pong_timeout}s")
-                            await self.disconnect(connection_id)
-                            break
-
-                    except WebSocketDisconnect:
-                        logger.debug(f"WebSocket disconnected for {connection_id}")
-                        await self.disconnect(connection_id)
-                        break
-                            
-                    except Exception as e:
-                        logger.error(f"Error sending PING to {connection_id}: {str(e)}")
-                        await self.disconnect(connection_id)
-                        break
+        ping_message = WebSocketMessage(
+            type="ping",
+            data=PingMessage().model_dump()
+        )
+        frame = FrameCache(self.serializer.dumps(ping_message.model_dump()), self.serializer)
+        for connection in connections:
+            self._enqueue(connection, frame)
 
-                await asyncio.sleep(1)  # Check every second
-                
-        except asyncio.CancelledError:
-            logger.debug(f"Connection monitor cancelled for {connection_id}")
-        except Exception as e:
-            logger.error(f"Error in connection monitor for {connection_id}: {str(e)}")
-            await self.disconnect(connection_id)
+    async def _expire_connections(self, connections: List[WebSocketConnection]) -> None:
+        """
+        Disconnect a batch of connections that did not answer a PING in time
+        """
+        for connection in connections:
+            await self.disconnect(connection.connection_id, code=WEBSOCKET_HEARTBEAT_CLOSE_CODE)
 
     async def update_activity(self, connection_id: str):
         """
         Update last activity timestamp for a connection
         """
-        if connection_id in self.last_activity:
-            self.last_activity[connection_id] = datetime.now().timestamp()
-            logger.debug(f"Updated activity timestamp for {connection_id}")
+        if connection_id in self.connections:
+            self.heartbeat.touch(self.connections[connection_id])
 
     async def subscribe(self, connection_id: str, topic: str) -> None:
         """
@@ -347,7 +599,10 @@ class WebSocketService:
         """
         if connection_id in self.connections:
             connection = self.connections[connection_id]
+            # Shared by every subscription and the topic index instead of one copy per connection
+            topic = sys.intern(topic)
             connection.add_subscription(topic)
+            self.topic_subscribers.setdefault(topic, set()).add(connection_id)
             logger.debug(f"Connection {connection_id} subscribed to topic {topic}")
 
             # Call subscription handlers
@@ -363,18 +618,23 @@ class WebSocketService:
         Unsubscribe a connection from a topic
         """
         if connection_id in self.connections:
-            connection = self.connections[connection_id]
-            
-            # Call unsubscribe handlers before removing the subscription
-            if topic in self.topic_handlers:
-                for handler in self.topic_handlers[topic]["unsubscribe"]:
-                    try:
-                        await handler(connection)
-                    except Exception as e:
-                        logger.error(f"Error in unsubscribe handler for {topic}: {str(e)}")
-            
-            connection.remove_subscription(topic)
-            logger.debug(f"Connection {connection_id} unsubscribed from topic {topic}")
+            await self._unsubscribe(self.connections[connection_id], topic)
+
+    async def _unsubscribe(self, connection: WebSocketConnection, topic: str) -> None:
+        """
+        Call the unsubscribe handlers of a topic and remove the subscription
+        """
+        # Call unsubscribe handlers before removing the subscription
+        if topic in self.topic_handlers:
+            for handler in self.topic_handlers[topic]["unsubscribe"]:
+                try:
+                    await handler(connection)
+                except Exception as e:
+                    logger.error(f"Error in unsubscribe handler for {topic}: {str(e)}")
+
+        connection.remove_subscription(topic)
+        self._remove_from_index(self.topic_subscribers, topic, connection.connection_id)
+        logger.debug(f"Connection {connection.connection_id} unsubscribed from topic {topic}")
 
     def _prepare_message(self, topic: str, message: Any, message_type: str = "message") -> dict:
         """
@@ -390,48 +650,154 @@ class WebSocketService:
         )
         return ws_message.model_dump()
     
+    def encode_message(self, topic: str, message: Any, message_type: str = "message") -> str:
+        """
+        Validate and encode a topic message once so the same frame can be sent to many connections
+        """
+        return self.serializer.dumps(self._prepare_message(topic, message, message_type))
+
+    def _enqueue(self, connection: WebSocketConnection, frame: Any, topic: Optional[str] = None) -> None:
+        """
+        Queue a frame on a connection, closing it if it cannot keep up
+
+        The frame can be a message to encode, JSON text from encode_message or a FrameCache
+        shared by the recipients of a broadcast. It is encoded with the connection codec.
+        """
+        if isinstance(frame, str):
+            frame = FrameCache(frame, self.serializer)
+        if isinstance(frame, FrameCache):
+            frame = frame.for_codec(connection.codec)
+        elif connection.codec is not None:
+            frame = connection.codec.encode(frame)
+        else:
+            frame = self.serializer.dumps(frame)
+
+        if not connection.enqueue(frame, topic):
+            logger.warning(f"Outbound queue full for {connection.connection_id}, disconnecting")
+            asyncio.create_task(self.disconnect(connection.connection_id, code=WEBSOCKET_OVERFLOW_CLOSE_CODE))
+
     async def send_to_connection(self, connection_id: str, topic: str, message: Any) -> None:
         """
         Send a message to a specific connection
         """
-        message_data = self._prepare_message(topic, message)
-        await self.connections[connection_id]._send(message_data)
+        frame = self.encode_message(topic, message)
+        self.unsequenced_topics.add(topic)
+        self._enqueue(self.connections[connection_id], frame, topic)
 
     async def broadcast_to_user(self, target_user_id: str, topic: str, message: Any) -> None:
         """
         Broadcast a message to all connections of a specific user (send_to_connection is preferred)
         """
-        message_data = self._prepare_message(topic, message)
-
-        for connection in self.connections.values():
-            if connection.user_id == target_user_id:
-                try:
-                    await connection._send(message_data)
-                except Exception as e:
-                    logger.error(f"Error sending message to user {target_user_id}: {str(e)}")
+        await self.worker_bus.publish("websocket", {
+            "target": "user",
+            "user_id": target_user_id,
+            "topic": topic,
+            "frame": self.encode_message(topic, message)
+        })
 
     async def broadcast_to_topic(self, topic: str, message: Any) -> None:
         """
         Broadcast a message to all connections subscribed to a topic (send_to_connection is preferred)
         """
-        message_data = self._prepare_message(topic, message)
-
-        for connection in self.connections.values():
-            if connection.has_subscription(topic):
-                try:
-                    await connection._send(message_data)
-                except Exception as e:
-                    logger.error(f"Error broadcasting to topic {topic}: {str(e)}")
+        await self.worker_bus.publish("websocket", {
+            "target": "topic",
+            "topic": topic,
+            "message": self._prepare_message(topic, message)
+        })
 
     async def broadcast_to_all(self, topic: str, message: Any) -> None:
         """
         Broadcast a message to all connected clients (send_to_connection is preferred)
         """
-        message_data = self._prepare_message(topic, message)
-
-        for connection in self.connections.values():
-            try:
-                await connection._send(message_data)
-            except Exception as e:
-                logger.error(f"Error broadcasting to all: {str(e)}")
+        await self.worker_bus.publish("websocket", {
+            "target": "all",
+            "topic": topic,
+            "message": self._prepare_message(topic, message)
+        })
 
+    async def _deliver(self, payload: dict) -> None:
+        """
+        Queue a broadcast frame on the matching connections of this worker
+        """
+        target = payload["target"]
+        topic = payload["topic"]
+        if "message" in payload:
+            frame = self._sequence(topic, payload["message"])
+        else:
+            frame = payload["frame"]
+            self.unsequenced_topics.add(topic)
+        frame = FrameCache(frame, self.serializer)
+
+        if target == "user":
+            connection_ids = self.user_connections.get(payload["user_id"], ())
+        elif target == "topic":
+            connection_ids = self.topic_subscribers.get(topic, ())
+        else:
+            connection_ids = self.connections.keys()
+
+        for connection_id in list(connection_ids):
+            # Skips connections still in a topic index while their unsubscribe handlers run
+            connection = self.connections.get(connection_id)
+            if connection is not None:
+                self._enqueue(connection, frame, topic)
+
+    def _sequence(self, topic: str, message: dict) -> str:
+        """
+        Number a topic broadcast, encode it and keep it in the topic stream for replays
+        """
+        stream = self.streams.get(topic)
+        if stream is None:
+            stream = self.streams[topic] = TopicStream(WEBSOCKET_REPLAY_BUFFER_SIZE)
+        seq = stream.next_seq()
+        frame = self.serializer.dumps({**message, "seq": seq})
+        stream.append(seq, frame)
+        return frame
+
+    def last_seq(self, topic: str) -> int:
+        """
+        Get the sequence number of the last frame broadcast on a topic by this worker
+        """
+        stream = self.streams.get(topic)
+        return stream.last_seq if stream else 0
+
+    async def resume(self, connection_id: str, topic: str, stream_id: Optional[str], last_seq: int) -> bool:
+        """
+        Subscribe a reconnecting client to a topic and queue the frames it missed
+
+        A resume_result is queued first, followed by every buffered frame with a sequence number
+        greater than last_seq. The result status is "resync" when the gap is no longer buffered,
+        the sequence numbers come from another worker or the topic carries frames sent to single
+        users (notifications), which are not numbered. The client must then fetch the full state
+        again.
+
+        Returns:
+            bool: False if the client has to resync
+        """
+        connection = self.connections.get(connection_id)
+        if connection is None:
+            return False
+
+        frames = None
+        if stream_id == self.stream_id and topic not in self.unsequenced_topics:
+            stream = self.streams.get(topic)
+            if stream is not None:
+                frames = stream.since(last_seq)
+            elif last_seq == 0:
+                frames = []
+
+        self._enqueue(connection, {
+            "type": "resume_result",
+            "status": "success" if frames is not None else "resync",
+            "topic": topic,
+            "stream": self.stream_id,
+            "seq": self.last_seq(topic)
+        })
+        for frame in frames or ():
+            self._enqueue(connection, frame, topic)
+
+        # Joins the topic index before any await, live frames can only follow the replayed ones
+        if not connection.has_subscription(topic):
+            await self.subscribe(connection_id, topic)
+
+        logger.debug(f"Connection {connection_id} resumed topic {topic} from {last_seq} ({len(frames or ())} frames)")
+        return frames is not None
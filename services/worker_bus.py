@@ -0,0 +1,308 @@
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+from utils.serializer import get_serializer
+from constants.worker_bus import (
+    WorkerBusBackend,
+    WORKER_BUS_BACKEND,
+    WORKER_BUS_CHUNK_SIZE,
+    WORKER_BUS_PEER_QUEUE_SIZE,
+    WORKER_BUS_SOCKET_DIR,
+)
+import asyncio
+import logging
+import os
+import socket
+import struct
+import tempfile
+
+logger = logging.getLogger("coffeebreak.websocket")
+
+Handler = Callable[[dict], Awaitable[None]]
+
+# Prefix of every datagram: payload id, chunk index and chunk count
+_CHUNK_HEADER = struct.Struct("!16sII")
+# Payloads being reassembled at once, the oldest ones are dropped beyond it
+_MAX_PARTIAL_PAYLOADS = 64
+
+
+class WorkerBus:
+    """
+    Relays payloads to every worker of the deployment so each one can deliver to its own sockets
+
+    Handlers are registered per channel. publish() delivers the payload to the local handler
+    and relays it to the other workers, which deliver it to their handler for the same channel.
+    This base implementation has no peers and is used for single-process deployments.
+    """
+    def __init__(self):
+        self._handlers: Dict[str, Handler] = {}
+        self._serializer = get_serializer()
+
+    def register(self, channel: str, handler: Handler) -> None:
+        """
+        Register the handler delivering payloads of a channel in this worker
+
+        Args:
+            channel (str): The channel name
+            handler (Callable): Coroutine function receiving the payload dict
+        """
+        self._handlers[channel] = handler
+        logger.debug(f"Registered worker bus handler for channel: {channel}")
+
+    async def publish(self, channel: str, payload: dict) -> None:
+        """Deliver a payload in this worker and relay it to every other worker"""
+        self._relay(channel, payload)
+        await self._deliver(channel, payload)
+
+    async def start(self) -> None:
+        """Start receiving payloads from other workers"""
+        pass
+
+    async def stop(self) -> None:
+        """Stop receiving payloads from other workers"""
+        pass
+
+    def _relay(self, channel: str, payload: dict) -> None:
+        """Send a payload to the other workers"""
+        pass
+
+    async def _deliver(self, channel: str, payload: dict) -> None:
+        handler = self._handlers.get(channel)
+        if handler is None:
+            logger.debug(f"No worker bus handler for channel: {channel}")
+            return
+        try:
+            await handler(payload)
+        except Exception as e:
+            logger.error(f"Error delivering worker bus payload on {channel}: {str(e)}")
+
+
+def default_socket_dir() -> str:
+    """Socket directory of the current deployment, shared by the workers forked by the same gunicorn master"""
+    return os.path.join(tempfile.gettempdir(), f"coffeebreak_workers_{os.getppid()}")
+
+
+class _Peer:
+    """Socket connected to another worker and the datagrams waiting for it to read its own"""
+    __slots__ = ("socket", "pending")
+
+    def __init__(self, sock: socket.socket):
+        self.socket = sock
+        self.pending: Deque[bytes] = deque()
+
+
+class UnixSocketWorkerBus(WorkerBus):
+    """
+    Worker bus over Unix domain datagram sockets
+
+    Every worker binds a socket named after its pid in a directory shared by the workers of the
+    deployment. Relaying sends the payload to each other socket of the directory through a socket
+    connected to it, sockets of dead workers are removed on the first failed send. Payloads larger
+    than a datagram are split in chunks, and datagrams a busy peer has no room for wait until its
+    socket is writable again instead of being dropped.
+    """
+    def __init__(
+        self,
+        directory: Optional[str] = WORKER_BUS_SOCKET_DIR,
+        name: Optional[str] = None,
+        chunk_size: int = WORKER_BUS_CHUNK_SIZE,
+        queue_size: int = WORKER_BUS_PEER_QUEUE_SIZE,
+    ):
+        super().__init__()
+        self._directory = directory
+        self._name = name
+        self._chunk_size = chunk_size
+        self._queue_size = queue_size
+        self._path: Optional[str] = None
+        self._socket: Optional[socket.socket] = None
+        self._connections: Dict[str, _Peer] = {}
+        # Chunks received so far of the payloads being reassembled, by payload id
+        self._partial: OrderedDict[bytes, List[bytes]] = OrderedDict()
+
+    async def start(self) -> None:
+        if self._socket is not None:
+            return
+        # Resolved here and not in __init__ so forked workers never share a path
+        self._directory = self._directory or default_socket_dir()
+        os.makedirs(self._directory, exist_ok=True)
+        self._path = os.path.join(self._directory, f"{self._name or os.getpid()}.sock")
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+        self._socket.bind(self._path)
+        asyncio.get_running_loop().add_reader(self._socket.fileno(), self._on_readable)
+        logger.info(f"Worker bus listening on {self._path}")
+
+    async def stop(self) -> None:
+        if self._socket is None:
+            return
+        for path in list(self._connections):
+            self._disconnect(path)
+        asyncio.get_running_loop().remove_reader(self._socket.fileno())
+        self._socket.close()
+        self._socket = None
+        self._partial.clear()
+        try:
+            os.unlink(self._path)
+        except FileNotFoundError:
+            pass
+
+    def _peers(self):
+        try:
+            names = os.listdir(self._directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            path = os.path.join(self._directory, name)
+            if name.endswith(".sock") and path != self._path:
+                yield path
+
+    def _relay(self, channel: str, payload: dict) -> None:
+        if self._socket is None:
+            return
+        datagrams = self._split(self._serializer.dumps({"channel": channel, "payload": payload}).encode())
+        peers = set(self._peers())
+        for path in set(self._connections) - peers:
+            self._disconnect(path)
+        for path in peers:
+            self._send(path, datagrams, channel)
+
+    def _split(self, data: bytes) -> List[bytes]:
+        """Split an encoded payload in datagrams prefixed with its id and their position"""
+        size = self._chunk_size - _CHUNK_HEADER.size
+        count = max(1, -(-len(data) // size))
+        payload_id = os.urandom(16)
+        return [
+            _CHUNK_HEADER.pack(payload_id, index, count) + data[index * size:(index + 1) * size]
+            for index in range(count)
+        ]
+
+    def _connect(self, path: str) -> Optional[_Peer]:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        try:
+            sock.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            sock.close()
+            logger.info(f"Removing stale worker bus socket {path}")
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            return None
+        except OSError as e:
+            sock.close()
+            logger.error(f"Error connecting to worker bus peer {path}: {str(e)}")
+            return None
+        peer = self._connections[path] = _Peer(sock)
+        return peer
+
+    def _disconnect(self, path: str) -> None:
+        peer = self._connections.pop(path, None)
+        if peer is None:
+            return
+        asyncio.get_running_loop().remove_writer(peer.socket.fileno())
+        peer.socket.close()
+
+    def _send(self, path: str, datagrams: List[bytes], channel: str, reconnect: bool = True) -> None:
+        peer = self._connections.get(path) or self._connect(path)
+        if peer is None:
+            return
+        if peer.pending:
+            if len(peer.pending) + len(datagrams) > self._queue_size:
+                logger.warning(f"Worker bus peer {path} is not keeping up, payload on {channel} dropped")
+                return
+            peer.pending.extend(datagrams)
+            return
+
+        for index, datagram in enumerate(datagrams):
+            try:
+                peer.socket.send(datagram)
+            except BlockingIOError:
+                # The peer has no room left, the rest is sent once it read its socket
+                peer.pending.extend(datagrams[index:])
+                asyncio.get_running_loop().add_writer(peer.socket.fileno(), self._flush, path)
+                return
+            except ConnectionRefusedError:
+                # The worker is gone, its socket file is removed unless a new worker bound it
+                self._disconnect(path)
+                if reconnect:
+                    self._send(path, datagrams, channel, reconnect=False)
+                return
+            except OSError as e:
+                logger.error(f"Error relaying to worker bus peer {path}: {str(e)}")
+                self._disconnect(path)
+                return
+
+    def _flush(self, path: str) -> None:
+        peer = self._connections.get(path)
+        if peer is None:
+            return
+        while peer.pending:
+            try:
+                peer.socket.send(peer.pending[0])
+            except BlockingIOError:
+                return
+            except OSError as e:
+                logger.error(f"Error relaying to worker bus peer {path}, {len(peer.pending)} datagrams dropped: {str(e)}")
+                self._disconnect(path)
+                return
+            peer.pending.popleft()
+        asyncio.get_running_loop().remove_writer(peer.socket.fileno())
+
+    def _reassemble(self, datagram: bytes) -> Optional[bytes]:
+        """Collect a chunk, returns the encoded payload once its last chunk arrived"""
+        if len(datagram) < _CHUNK_HEADER.size:
+            logger.warning("Received invalid worker bus datagram")
+            return None
+        payload_id, index, count = _CHUNK_HEADER.unpack_from(datagram)
+        chunk = datagram[_CHUNK_HEADER.size:]
+        if count == 1:
+            return chunk
+
+        # A peer sends the chunks of a payload in order over its own connection
+        chunks = self._partial.pop(payload_id, []) if index else []
+        if index != len(chunks) or index >= count:
+            logger.warning("Dropped incomplete worker bus payload")
+            return None
+        chunks.append(chunk)
+        if index + 1 < count:
+            self._partial[payload_id] = chunks
+            while len(self._partial) > _MAX_PARTIAL_PAYLOADS:
+                self._partial.popitem(last=False)
+            return None
+        return b"".join(chunks)
+
+    def _on_readable(self) -> None:
+        while self._socket is not None:
+            try:
+                datagram = self._socket.recv(1 << 20)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                logger.error(f"Error reading from worker bus: {str(e)}")
+                return
+            data = self._reassemble(datagram)
+            if data is None:
+                continue
+            try:
+                message = self._serializer.loads(data)
+            except ValueError:
+                logger.warning("Received invalid worker bus datagram")
+                continue
+            asyncio.create_task(self._deliver(message["channel"], message["payload"]))
+
+
+_worker_bus: Optional[WorkerBus] = None
+
+
+def get_worker_bus() -> WorkerBus:
+    """Get the worker bus of this process, created from WORKER_BUS_BACKEND on first use"""
+    global _worker_bus
+    if _worker_bus is None:
+        if WORKER_BUS_BACKEND == WorkerBusBackend.UNIX:
+            _worker_bus = UnixSocketWorkerBus()
+        else:
+            _worker_bus = WorkerBus()
+    return _worker_bus
@@ -0,0 +1,132 @@
+from typing import Callable, List, Optional, Set, Tuple
+from sqlalchemy.orm import Session
+from constants.write_batcher import WRITE_BATCH_MAX_SIZE, WRITE_BATCH_MAX_DELAY
+import asyncio
+import logging
+
+logger = logging.getLogger("coffeebreak.core")
+
+
+class WriteBatcher:
+    """
+    Write-behind inserts, the rows added within `max_delay` seconds share one transaction
+
+    Each add returns once the transaction of its row committed, with the id assigned to the row.
+    While a batch is being written the next one fills up, so under load the batches grow up to
+    `max_size` rows and a commit (one fsync) is paid per batch instead of per row. If a batch
+    fails its rows are written one by one, so a bad row only fails its own add.
+
+    Args:
+        session_factory: Creates the sessions of the batches
+        max_size: Most rows written in one transaction
+        max_delay: Seconds a batch waits for more rows once its first row arrived
+        label: Name of the batcher in the logs
+        write: Writes a batch of items instead of inserting them as rows, called in a thread with
+            the items and returning the result of each one (an exception fails its add)
+    """
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        max_size: int = WRITE_BATCH_MAX_SIZE,
+        max_delay: float = WRITE_BATCH_MAX_DELAY,
+        label: str = "rows",
+        write: Optional[Callable[[list], list]] = None
+    ):
+        self.session_factory = session_factory
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.label = label
+        self.write = write or self._write
+        self._pending: List[Tuple[object, asyncio.Future]] = []
+        # Futures of the rows queued or being written
+        self._unresolved: Set[asyncio.Future] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def submit(self, record) -> asyncio.Future:
+        """
+        Queue a new row
+
+        Returns:
+            asyncio.Future: Resolves with the id of the row once it was committed
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((record, future))
+        self._unresolved.add(future)
+        future.add_done_callback(self._unresolved.discard)
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+        return future
+
+    async def add(self, record) -> int:
+        """Insert a row with the next batch and get its id"""
+        return await self.submit(record)
+
+    async def flush(self) -> None:
+        """Wait until every queued row was written"""
+        if self._unresolved:
+            await asyncio.wait(list(self._unresolved))
+
+    async def stop(self) -> None:
+        """Write the queued rows, then stop the batching task"""
+        await self.flush()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            # Give the rows of the same burst a chance to join the batch
+            if len(self._pending) < self.max_size and self.max_delay > 0:
+                await asyncio.sleep(self.max_delay)
+            batch = self._pending[:self.max_size]
+            del self._pending[:self.max_size]
+            if not self._pending:
+                self._wakeup.clear()
+            if batch:
+                # The database calls block, the batch is written in a thread
+                try:
+                    results = await asyncio.to_thread(self.write, [record for record, _ in batch])
+                except Exception as e:
+                    logger.error(f"Error writing a batch of {len(batch)} {self.label}: {str(e)}")
+                    results = [e] * len(batch)
+                for (_, future), result in zip(batch, results):
+                    if future.done():
+                        continue
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+
+    def _write(self, records: list) -> list:
+        """Insert the rows in one transaction, or one by one if it fails"""
+        with self.session_factory() as db:
+            # The rows are handed back to their callers, keep them loaded
+            db.expire_on_commit = False
+            try:
+                db.add_all(records)
+                db.commit()
+                return [record.id for record in records]
+            except Exception as e:
+                db.rollback()
+                logger.warning(f"Writing a batch of {len(records)} {self.label} failed, writing them one by one: {str(e)}")
+
+        results = []
+        for record in records:
+            with self.session_factory() as db:
+                db.expire_on_commit = False
+                try:
+                    db.add(record)
+                    db.commit()
+                    results.append(record.id)
+                except Exception as e:
+                    db.rollback()
+                    results.append(e)
+        return results
@@ -0,0 +1,51 @@
+import sys
+import os
+import pytest
+
+# Add the parent directory to the sys.path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.codec import FrameCache, available_compressions, available_encodings, get_codec
+
+FRAME = {"type": "message", "topic": "notifications", "data": {"notifications": ["Coffee is served"] * 50}}
+
+CODECS = [
+    (encoding, compression)
+    for encoding in available_encodings()
+    for compression in [None] + available_compressions()
+]
+
+
+@pytest.mark.parametrize("encoding,compression", CODECS)
+def test_round_trip(encoding, compression):
+    codec = get_codec(encoding, compression)
+    encoded = codec.encode(FRAME)
+    assert isinstance(encoded, bytes) == codec.binary
+    assert codec.decode(encoded) == FRAME
+
+
+def test_compression_reduces_size():
+    plain = get_codec().encode(FRAME)
+    compressed = get_codec("json", "deflate").encode(FRAME)
+    assert len(compressed) < len(plain.encode())
+
+
+def test_frame_cache_encodes_once_per_codec():
+    codec = get_codec("json", "deflate")
+    cache = FrameCache(get_codec().encode(FRAME))
+    assert cache.for_codec(None) is cache.frame
+    assert cache.for_codec(codec) is cache.for_codec(codec)
+
+
+@pytest.mark.parametrize("compression", available_compressions())
+def test_compression_bombs_are_rejected(compression):
+    codec = get_codec("json", compression)
+    bomb = codec.encode({"data": "0" * (codec.max_size * 4)})
+    assert len(bomb) < codec.max_size / 100
+    with pytest.raises(ValueError):
+        codec.decode(bomb)
+
+
+def test_unsupported_codec():
+    with pytest.raises(ValueError):
+        get_codec("xml")
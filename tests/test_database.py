@@ -0,0 +1,46 @@
+import sys
+import os
+
+# Add the parent directory to the sys.path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from dependencies.database import Base, upgrade_schema
+from models.message import Message
+from services.outbox import OutboxDispatcher
+
+
+def test_upgrade_adds_the_new_columns_to_existing_tables():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    with engine.begin() as connection:
+        # The messages table as the first release created it
+        connection.execute(text(
+            "CREATE TABLE messages (id INTEGER PRIMARY KEY, type VARCHAR NOT NULL, recipient_type VARCHAR(9) NOT NULL, "
+            "recipient VARCHAR, payload VARCHAR NOT NULL, priority INTEGER NOT NULL, delivered BOOLEAN, created_at DATETIME)"
+        ))
+        connection.execute(text(
+            "INSERT INTO messages (type, recipient_type, recipient, payload, priority, delivered) "
+            "VALUES ('in-app', 'BROADCAST', NULL, '{}', 1, 0)"
+        ))
+    Base.metadata.create_all(bind=engine, checkfirst=True)
+
+    added = upgrade_schema(engine)
+    assert "messages.attempts" in added and "messages.handled_by" in added
+    assert "messages.ix_messages_outbox" in added
+    assert upgrade_schema(engine) == [], "Upgrading again should be a no-op"
+
+    session_factory = sessionmaker(bind=engine)
+    with session_factory() as db:
+        assert db.query(Message).one().attempts == 0
+        db.add(Message(type="in-app", recipient_type="BROADCAST", payload="{}", priority=1))
+        db.commit()
+
+    async def enqueue(message_id, notification, handled):
+        pass
+
+    # The message left over by the old version has no next attempt and is not delivered again
+    outbox = OutboxDispatcher(enqueue, lambda: ["in-app"], session_factory=session_factory)
+    assert [message_id for message_id, _, _ in outbox._claim(["in-app"])] == [2]
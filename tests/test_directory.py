@@ -0,0 +1,97 @@
+import asyncio
+import sys
+import os
+
+# Add the parent directory to the sys.path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from benchmarks.fake_keycloak import FakeKeycloak
+from services.directory import DirectoryCache
+from services.keycloak_admin import AsyncKeycloakAdmin
+
+
+@pytest.fixture
+def realm():
+    realm = FakeKeycloak(latency=0.02)
+    realm.seed(users=3, roles=["cb-organizer", "cb-speaker"], groups=["speakers"])
+    realm.start()
+    yield realm
+    realm.stop()
+
+
+@pytest.fixture
+def directory(realm):
+    admin = realm.admin_client()
+    client = AsyncKeycloakAdmin(lambda: admin, max_workers=4)
+    yield DirectoryCache(client)
+    client.shutdown()
+
+
+def test_lookups_are_served_from_memory(realm, directory):
+    async def scenario():
+        first = await directory.users()
+        before = realm.requests
+        second = await directory.users()
+        user_id = await directory.user_id("user-1")
+        return first, second, user_id, realm.requests - before
+
+    first, second, user_id, requests = asyncio.run(scenario())
+    assert first == second and len(first) == 3
+    assert realm.users[user_id]["username"] == "user-1"
+    assert requests == 0
+    assert directory.stats()["hits"] == 1
+
+
+def test_concurrent_misses_share_one_fetch(realm, directory):
+    async def scenario():
+        await directory.users()
+        before = realm.requests
+        results = await asyncio.gather(*(directory.role_members("cb-organizer") for _ in range(10)))
+        return results, realm.requests - before
+
+    results, requests = asyncio.run(scenario())
+    assert all(len(members) == 3 for members in results)
+    assert requests == 1
+
+
+def test_invalidation_fetches_again(realm, directory):
+    async def scenario():
+        users = await directory.users()
+        realm.add_user({"username": "late", "enabled": True})
+        cached = await directory.users()
+        directory.invalidate_users()
+        return users, cached, await directory.users(), await directory.user_id("late")
+
+    users, cached, fresh, late_id = asyncio.run(scenario())
+    assert len(users) == len(cached) == 3
+    assert len(fresh) == 4
+    assert late_id is not None
+
+
+def test_sync_group_lookups(realm, directory):
+    group_id = directory.group_id_sync("speakers")
+    assert group_id in realm.groups
+    assert directory.group_id_sync("missing") is None
+    assert directory.group_members_sync(group_id) == []
+
+    user_id = next(iter(realm.users))
+    directory.admin.client.group_user_add(user_id, group_id)
+    assert directory.group_members_sync(group_id) == []
+    directory.invalidate_groups(group_id)
+    assert [user["id"] for user in directory.group_members_sync(group_id)] == [user_id]
+
+
+def test_background_refresh(realm, directory):
+    directory.refresh_interval = 1000
+
+    async def scenario():
+        await directory.roles()
+        realm.add_role("cb-staff")
+        refreshed = await directory.refresh()
+        return refreshed, await directory.roles()
+
+    refreshed, roles = asyncio.run(scenario())
+    assert refreshed == 1
+    assert "cb-staff" in [role["name"] for role in roles]
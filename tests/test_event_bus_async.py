@@ -0,0 +1,128 @@
+import asyncio
+import sys
+import os
+from datetime import UTC, datetime
+
+# Add the parent directory to the sys.path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from schemas.event import EventRequest, EventType
+from services.event_bus import EventBus
+
+
+def make_bus(session_factory) -> EventBus:
+    session = session_factory()
+    bus = EventBus(session)
+    # The bus is a singleton, start from a clean state
+    bus.db = session
+    bus.handlers = {}
+    bus.stats = {}
+    return bus
+
+
+def login(payload: str = "alice") -> EventRequest:
+    return EventRequest(event_type=EventType.USER_LOGIN, timestamp=datetime.now(UTC), payload=payload, details={})
+
+
+def test_async_handlers_are_awaited_and_timed(session_factory):
+    async def scenario():
+        bus = make_bus(session_factory)
+        bus.handler_timeout = 0.05
+        seen = []
+
+        async def on_login(event):
+            await asyncio.sleep(0)
+            seen.append(event.payload)
+
+        async def stuck(event):
+            await asyncio.sleep(1)
+
+        def failing(event):
+            raise ValueError("boom")
+
+        for handler in (on_login, stuck, failing):
+            bus.register_event_handler(EventType.USER_LOGIN, handler)
+        event = await bus.publish_event_async(login())
+        await bus.stop()
+        bus.handler_timeout = 10
+        return event, seen, bus.get_handler_stats()
+
+    event, seen, stats = asyncio.run(scenario())
+    assert event.id is not None
+    assert seen == ["alice"]
+    by_name = {name.rsplit(".", 1)[-1]: value for name, value in stats.items()}
+    assert by_name["on_login"]["calls"] == 1 and by_name["on_login"]["failures"] == 0
+    assert by_name["stuck"]["timeouts"] == 1
+    assert by_name["failing"]["failures"] == 1
+
+
+def test_fire_and_forget_returns_before_the_handlers(session_factory):
+    async def scenario():
+        bus = make_bus(session_factory)
+        release = asyncio.Event()
+        seen = []
+
+        async def slow(event):
+            await release.wait()
+            seen.append(event.payload)
+
+        bus.register_event_handler(EventType.USER_LOGIN, slow)
+        await bus.publish_event_async(login("bob"), wait=False)
+        before = list(seen)
+        release.set()
+        await bus.join()
+        await bus.stop()
+        return before, seen
+
+    before, seen = asyncio.run(scenario())
+    assert before == []
+    assert seen == ["bob"]
+
+
+def test_handlers_of_events_published_from_threads_run_on_the_app_loop(session_factory):
+    async def scenario():
+        bus = make_bus(session_factory)
+        await EventBus.start()
+        loops = []
+
+        async def on_login(event):
+            loops.append(asyncio.get_running_loop())
+
+        bus.register_event_handler(EventType.USER_LOGIN, on_login)
+        # As a sync route running in the threadpool would
+        await asyncio.to_thread(bus.publish_event, login())
+        for _ in range(100):
+            if loops:
+                break
+            await asyncio.sleep(0.01)
+        await bus.stop()
+        return loops, asyncio.get_running_loop()
+
+    loops, app_loop = asyncio.run(scenario())
+    assert loops == [app_loop]
+
+
+def test_events_published_from_threads_share_transactions(session_factory):
+    from concurrent.futures import ThreadPoolExecutor
+    from sqlalchemy import event as sqlalchemy_event
+
+    commits = []
+    sqlalchemy_event.listen(session_factory.kw["bind"], "commit", lambda connection: commits.append(1))
+
+    async def scenario():
+        bus = make_bus(session_factory)
+        await EventBus.start()
+        bus.writer.max_delay = 0.05
+        # As concurrent sync routes running in the threadpool would
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            events = await asyncio.gather(*(
+                asyncio.get_running_loop().run_in_executor(pool, bus.publish_event, login(str(i)))
+                for i in range(8)
+            ))
+        await bus.stop()
+        bus.writer.max_delay = 0.005
+        return events
+
+    events = asyncio.run(scenario())
+    assert sorted(event.id for event in events) == list(range(1, 9))
+    assert len(commits) < 8
@@ -0,0 +1,49 @@
+import asyncio
+import sys
+import os
+
+# Add the parent directory to the sys.path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.fanout import fan_out
+
+
+def test_async_sends_run_concurrently_within_limit():
+    in_flight = 0
+    peak = 0
+
+    async def send(target):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.02)
+        in_flight -= 1
+
+    result = asyncio.run(fan_out(range(50), send, concurrency=10))
+    assert result.sent == 50
+    assert peak == 10, f"Expected 10 sends in flight, got {peak}"
+    assert result.elapsed < 0.5, "Sends were not concurrent"
+
+
+def test_failures_are_collected_after_the_pass():
+    targets = {"ok-1", "broken", "ok-2"}
+    sent = []
+
+    def send(target):
+        if target == "broken":
+            raise ConnectionError("closed")
+        sent.append(target)
+
+    async def run():
+        result = await fan_out(targets, send)
+        # The snapshot lets the caller prune the source collection afterwards
+        for target, _ in result.failed:
+            targets.discard(target)
+        return result
+
+    result = asyncio.run(run())
+    assert sorted(sent) == ["ok-1", "ok-2"]
+    assert result.sent == 2
+    assert [target for target, _ in result.failed] == ["broken"]
+    assert isinstance(result.failed[0][1], ConnectionError)
+    assert targets == {"ok-1", "ok-2"}
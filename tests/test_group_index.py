@@ -0,0 +1,110 @@
+import asyncio
+import sys
+import os
+
+# Add the parent directory to the sys.path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.group_index import GroupMembershipIndex
+
+
+class FakeDirectory:
+    """Stands in for Keycloak, counts the group lookups"""
+    def __init__(self, groups):
+        self.groups = groups
+        self.calls = 0
+
+    async def get_user_groups(self, user_id):
+        self.calls += 1
+        return [{"id": group_id} for group_id in self.groups.get(user_id, [])]
+
+
+def run_index(directory, scenario, ttl=300):
+    async def run():
+        index = GroupMembershipIndex(directory.get_user_groups, ttl=ttl)
+        try:
+            await scenario(index)
+        finally:
+            index.stop()
+
+    asyncio.run(run())
+
+
+def test_members_are_looked_up_without_fetching():
+    directory = FakeDirectory({"alice": ["speakers"], "bob": ["speakers", "staff"], "carol": []})
+
+    async def scenario(index):
+        for user_id in ("alice", "bob", "carol"):
+            index.add_user(user_id)
+        await asyncio.sleep(0.01)
+        calls = directory.calls
+        for _ in range(100):
+            assert index.members("speakers") == {"alice", "bob"}
+            assert index.members("staff") == {"bob"}
+        assert directory.calls == calls == 3, "Looking up members fetched groups"
+
+        index.remove_user("bob")
+        assert index.members("speakers") == {"alice"}
+        assert index.members("staff") == set()
+
+    run_index(directory, scenario)
+
+
+def test_invalidate_refreshes_a_user():
+    directory = FakeDirectory({"alice": ["speakers"]})
+
+    async def scenario(index):
+        index.add_user("alice")
+        await asyncio.sleep(0.01)
+        directory.groups["alice"] = ["staff"]
+        index.invalidate("alice")
+        await asyncio.sleep(0.01)
+        assert index.members("staff") == {"alice"}
+        assert index.members("speakers") == set()
+
+    run_index(directory, scenario)
+
+
+def test_groups_expire_after_ttl():
+    directory = FakeDirectory({"alice": ["speakers"]})
+
+    async def scenario(index):
+        index.add_user("alice")
+        await asyncio.sleep(0.01)
+        directory.groups["alice"] = ["staff"]
+        await asyncio.sleep(0.08)
+        assert index.members("staff") == {"alice"}
+
+    run_index(directory, scenario, ttl=0.05)
+
+
+def test_groups_are_unknown_until_a_fetch_succeeds():
+    directory = FakeDirectory({"alice": ["speakers"]})
+    get_user_groups = directory.get_user_groups
+    failing = True
+
+    async def flaky_user_groups(user_id):
+        if failing:
+            raise RuntimeError("Keycloak is down")
+        return await get_user_groups(user_id)
+
+    directory.get_user_groups = flaky_user_groups
+
+    async def scenario(index):
+        nonlocal failing
+        index.add_user("alice")
+        await asyncio.sleep(0.01)
+        assert index.groups("alice") is None, "A failed fetch was reported as a user without groups"
+
+        failing = False
+        index.invalidate("alice")
+        await asyncio.sleep(0.01)
+        assert index.groups("alice") == {"speakers"}
+
+        # Once known, the groups are kept through a failed refresh
+        failing = True
+        index.invalidate("alice")
+        await asyncio.sleep(0.01)
+        assert index.groups("alice") == {"speakers"}
+
+    run_index(directory, scenario)
@@ -0,0 +1,85 @@
+import asyncio
+import sys
+import os
+
+# Add the parent directory to the sys.path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.heartbeat import HeartbeatScheduler, HeartbeatState
+
+
+def run_scheduler(scenario):
+    pinged = []
+    timed_out = []
+
+    async def on_timeout(connections):
+        timed_out.extend(connections)
+
+    async def run():
+        scheduler = HeartbeatScheduler(pinged.extend, on_timeout, idle_timeout=0.05, pong_timeout=0.05)
+        try:
+            await scenario(scheduler)
+        finally:
+            scheduler.stop()
+
+    asyncio.run(run())
+    return pinged, timed_out
+
+
+def test_idle_connection_is_pinged_then_timed_out():
+    idle = HeartbeatState()
+
+    async def scenario(scheduler):
+        scheduler.add(idle)
+        await asyncio.sleep(0.07)
+        assert idle.is_awaiting_pong()
+        await asyncio.sleep(0.07)
+
+    pinged, timed_out = run_scheduler(scenario)
+    assert pinged == [idle]
+    assert timed_out == [idle]
+    assert idle.last_activity is None, "Timed out connection is still tracked"
+
+
+def test_active_connection_is_not_pinged():
+    active = HeartbeatState()
+
+    async def scenario(scheduler):
+        scheduler.add(active)
+        for _ in range(8):
+            await asyncio.sleep(0.02)
+            scheduler.touch(active)
+
+    pinged, timed_out = run_scheduler(scenario)
+    assert pinged == []
+    assert timed_out == []
+
+
+def test_pong_keeps_connection_alive():
+    client = HeartbeatState()
+
+    async def scenario(scheduler):
+        scheduler.add(client)
+        await asyncio.sleep(0.07)
+        assert client.is_awaiting_pong()
+        scheduler.touch(client)  # PONG
+        await asyncio.sleep(0.03)
+        assert not client.is_awaiting_pong()
+
+    pinged, timed_out = run_scheduler(scenario)
+    assert pinged == [client]
+    assert timed_out == []
+
+
+def test_removed_connection_is_ignored():
+    gone = HeartbeatState()
+
+    async def scenario(scheduler):
+        scheduler.add(gone)
+        scheduler.remove(gone)
+        await asyncio.sleep(0.12)
+        assert len(scheduler) == 0
+
+    pinged, timed_out = run_scheduler(scenario)
+    assert pinged == []
+    assert timed_out == []
@@ -0,0 +1,130 @@
+import sys
+import os
+import time
+
+# Add the parent directory to the sys.path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from jwcrypto import jwk, jwt
+from jwcrypto.common import JWException
+
+from dependencies.jwks import RealmKeyCache, UnknownSigningKeyError, UnsignedTokenError
+from dependencies.token_cache import TokenCache
+
+
+def make_key(kid: str) -> jwk.JWK:
+    return jwk.JWK.generate(kty="RSA", size=2048, kid=kid)
+
+
+def sign(key: jwk.JWK, expires_in: int = 300, **claims) -> str:
+    now = int(time.time())
+    token = jwt.JWT(
+        header={"alg": "RS256", "kid": key.key_id},
+        claims={"sub": "alice", "iat": now, "exp": now + expires_in, "typ": "Bearer", **claims}
+    )
+    token.make_signed_token(key)
+    return token.serialize()
+
+
+class Realm:
+    """Serves the public keys of the realm and counts the fetches"""
+    def __init__(self, *keys: jwk.JWK):
+        self.keys = list(keys)
+        self.fetches = 0
+
+    def certs(self) -> dict:
+        self.fetches += 1
+        return {"keys": [key.export_public(as_dict=True) | {"use": "sig"} for key in self.keys]}
+
+
+def test_tokens_are_verified_with_the_cached_keys():
+    key = make_key("k1")
+    realm = Realm(key)
+    cache = RealmKeyCache(realm.certs)
+
+    for _ in range(3):
+        assert cache.verify(sign(key))["sub"] == "alice"
+    assert realm.fetches == 1
+
+    with pytest.raises(JWException):
+        cache.verify(sign(key, expires_in=-3600))
+    with pytest.raises(JWException):
+        cache.verify(sign(make_key("k1")))
+
+
+def test_rotated_keys_are_fetched_on_unknown_kid():
+    old, new = make_key("old"), make_key("new")
+    realm = Realm(old)
+    cache = RealmKeyCache(realm.certs, min_refresh_interval=0)
+    cache.verify(sign(old))
+
+    realm.keys = [old, new]
+    assert cache.verify(sign(new))["sub"] == "alice"
+    assert realm.fetches == 2
+
+
+def test_unknown_kid_refreshes_are_throttled():
+    realm = Realm(make_key("k1"))
+    cache = RealmKeyCache(realm.certs, min_refresh_interval=60)
+
+    for _ in range(3):
+        with pytest.raises(UnknownSigningKeyError):
+            cache.verify(sign(make_key("made-up")))
+    assert realm.fetches == 1
+
+    with pytest.raises(UnsignedTokenError):
+        cache.verify("not-a-jwt")
+
+
+def test_only_access_tokens_for_this_service_are_accepted():
+    key = make_key("k1")
+    cache = RealmKeyCache(
+        Realm(key).certs,
+        issuer="https://sso/realms/coffeebreak",
+        audiences=["coffeebreak"],
+        authorized_parties=["coffeebreak-web"]
+    )
+    valid = {"iss": "https://sso/realms/coffeebreak", "aud": ["account", "coffeebreak"], "azp": "coffeebreak-web"}
+    assert cache.verify(sign(key, **valid))["sub"] == "alice"
+
+    for invalid in (
+        {"iss": "https://sso/realms/other"},
+        {"typ": "ID"},
+        {"aud": "account"},
+        {"azp": "other-client"},
+    ):
+        with pytest.raises(JWException):
+            cache.verify(sign(key, **(valid | invalid)))
+
+
+def test_the_issuer_is_only_checked_when_configured(monkeypatch):
+    import dependencies.auth as auth
+
+    key = make_key("k1")
+    monkeypatch.setattr(auth.realm_keys, "_fetch_certs", Realm(key).certs)
+    monkeypatch.setattr(auth.realm_keys, "_keys", None)
+    monkeypatch.setattr(auth.realm_keys, "_fetched_at", 0.0)
+
+    # Containers reach Keycloak on an internal URL (KEYCLOAK_URL), tokens name the public one
+    assert auth.JWT_ISSUER is None
+    assert auth.realm_keys.verify(sign(key, iss="https://sso.example.com/realms/coffeebreak"))["sub"] == "alice"
+
+
+def test_tokens_signed_with_unknown_keys_are_not_introspected(monkeypatch):
+    from fastapi import HTTPException
+    import dependencies.auth as auth
+
+    introspected = []
+    monkeypatch.setattr(auth, "realm_keys", RealmKeyCache(Realm(make_key("k1")).certs))
+    monkeypatch.setattr(auth, "token_cache", TokenCache())
+    monkeypatch.setattr(auth.keycloak_openid, "introspect", lambda token: introspected.append(token) or {"active": True})
+
+    with pytest.raises(HTTPException) as error:
+        auth.verify_token(sign(make_key("made-up")))
+    assert error.value.status_code == 401
+    assert introspected == []
+
+    # Opaque tokens can only be validated by Keycloak
+    assert auth.verify_token("opaque-token")["type"] == "authenticated"
+    assert introspected == ["opaque-token"]
@@ -0,0 +1,67 @@
+import asyncio
+import sys
+import os
+
+# Add the parent directory to the sys.path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from benchmarks.fake_keycloak import FakeKeycloak
+import services.directory as directory
+import services.keycloak_admin as keycloak_admin
+from services.keycloak_admin import AsyncKeycloakAdmin
+
+
+@pytest.fixture
+def realm():
+    realm = FakeKeycloak(latency=0.05)
+    realm.seed(users=5, roles=["cb-organizer", "cb-speaker", "offline_access"])
+    realm.start()
+    yield realm
+    realm.stop()
+
+
+def test_admin_calls_do_not_block_the_loop(realm):
+    admin = realm.admin_client()
+    client = AsyncKeycloakAdmin(lambda: admin, max_workers=4)
+
+    async def scenario():
+        # Logs the client in
+        await client.get_users()
+        realm.peak_in_flight = 0
+        calls = asyncio.gather(*(client.get_users() for _ in range(8)))
+        # The loop keeps running while Keycloak answers, blocking calls would only let it
+        # run again once they all returned
+        ran_during_calls = False
+        for _ in range(200):
+            await asyncio.sleep(0.005)
+            if realm.in_flight:
+                ran_during_calls = True
+                break
+        return await calls, ran_during_calls
+
+    results, ran_during_calls = asyncio.run(scenario())
+    client.shutdown()
+    assert [len(users) for users in results] == [5] * 8
+    assert ran_during_calls
+    # As many requests at once as threads in the pool
+    assert realm.peak_in_flight == 4
+
+
+def test_user_service_goes_through_the_adapter(realm, monkeypatch):
+    from services.user_service import list_roles, list_users
+
+    admin = realm.admin_client()
+    monkeypatch.setattr(keycloak_admin, "_keycloak_admin", AsyncKeycloakAdmin(lambda: admin))
+    monkeypatch.setattr(directory, "_directory", None)
+
+    async def scenario():
+        return await list_users(), await list_roles()
+
+    users, roles = asyncio.run(scenario())
+    assert len(users) == 5
+    assert sorted(role["name"] for role in roles) == ["cb-organizer", "cb-speaker"]
+
+    with pytest.raises(AttributeError):
+        AsyncKeycloakAdmin().not_an_admin_method
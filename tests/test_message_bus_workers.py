@@ -0,0 +1,203 @@
+import asyncio
+import sys
+import os
+
+# Add the parent directory to the sys.path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.message import Message
+from schemas.notification import NotificationRequest
+from services.message_bus import MessageBus
+
+
+def make_bus(session_factory):
+    return MessageBus(session_factory())
+
+
+def request(type: str, priority: int = 1, payload: str = "{}") -> NotificationRequest:
+    return NotificationRequest(type=type, recipient_type="BROADCAST", payload=payload, priority=priority)
+
+
+def test_higher_priority_messages_are_handled_first(session_factory):
+    async def scenario():
+        bus = make_bus(session_factory)
+        bus.workers = 1
+        handled = []
+        release = asyncio.Event()
+
+        async def handler(notification):
+            await release.wait()
+            handled.append(notification.payload)
+
+        await bus.register_message_handler("test-priority", handler)
+        try:
+            # The first message keeps the only worker busy while the others are queued
+            await bus.send_notification(request("test-priority", 1, "first"))
+            await asyncio.sleep(0)
+            await bus.send_notification(request("test-priority", 1, "low"))
+            await bus.send_notification(request("test-priority", 5, "high"))
+            release.set()
+            await bus.join()
+        finally:
+            await bus.unregister_message_handler("test-priority", handler)
+            await bus.stop()
+            bus.workers = 4
+        return handled
+
+    assert asyncio.run(scenario()) == ["first", "high", "low"]
+
+
+def test_type_concurrency_and_handler_timeout(session_factory):
+    async def scenario():
+        bus = make_bus(session_factory)
+        bus.handler_timeout = 0.05
+        bus.set_type_concurrency("test-limited", 2)
+        running = 0
+        peak = 0
+        handled = []
+
+        async def limited(notification):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        async def stuck(notification):
+            await asyncio.sleep(1)
+
+        def after_stuck(notification):
+            handled.append(notification.payload)
+
+        await bus.register_message_handler("test-limited", limited)
+        await bus.register_message_handler("test-stuck", stuck)
+        await bus.register_message_handler("test-stuck", after_stuck)
+        try:
+            for _ in range(6):
+                await bus.send_notification(request("test-limited"))
+            await bus.send_notification(request("test-stuck", payload="stuck"))
+            await bus.join()
+        finally:
+            await bus.unregister_message_handler("test-limited", limited)
+            await bus.unregister_message_handler("test-stuck", stuck)
+            await bus.unregister_message_handler("test-stuck", after_stuck)
+            await bus.stop()
+            bus.handler_timeout = 10
+            bus.set_type_concurrency("test-limited", 0)
+        return peak, handled
+
+    peak, handled = asyncio.run(scenario())
+    assert peak == 2
+    # The handler after the one that timed out still runs
+    assert handled == ["stuck"]
+
+
+def test_failed_messages_are_retried_once_per_failed_handler(session_factory):
+    async def scenario():
+        bus = make_bus(session_factory)
+        calls = {"stable": 0, "flaky": 0}
+
+        def stable(notification):
+            calls["stable"] += 1
+
+        def flaky(notification):
+            calls["flaky"] += 1
+            if calls["flaky"] == 1:
+                raise RuntimeError("boom")
+
+        await bus.register_message_handler("test-retried", stable)
+        await bus.register_message_handler("test-retried", flaky)
+        bus.outbox.backoff_base = 0
+        try:
+            message = await bus.send_notification(request("test-retried"))
+            # Queued again while it is still held, as a poll after its lease ran out would
+            await bus.enqueue(message.id, request("test-retried"))
+            await bus.join()
+            await bus.outbox.run_once()
+            await bus.join()
+        finally:
+            await bus.unregister_message_handler("test-retried", stable)
+            await bus.unregister_message_handler("test-retried", flaky)
+            await bus.stop()
+            bus.outbox.backoff_base = 1
+        with bus._new_session() as db:
+            delivered = db.get(Message, message.id).delivered
+        return calls, delivered
+
+    calls, delivered = asyncio.run(scenario())
+    assert calls == {"stable": 1, "flaky": 2}
+    assert delivered
+
+
+def test_saturated_types_do_not_hold_the_workers(session_factory):
+    async def scenario():
+        bus = make_bus(session_factory)
+        bus.set_type_concurrency("test-slow", 1)
+        release = asyncio.Event()
+        slow_running = 0
+        slow_peak = 0
+        slow_handled = 0
+        fast_handled = asyncio.Event()
+
+        async def slow(notification):
+            nonlocal slow_running, slow_peak, slow_handled
+            slow_running += 1
+            slow_peak = max(slow_peak, slow_running)
+            await release.wait()
+            slow_running -= 1
+            slow_handled += 1
+
+        def fast(notification):
+            fast_handled.set()
+
+        await bus.register_message_handler("test-slow", slow)
+        await bus.register_message_handler("test-fast", fast)
+        try:
+            # One more slow message than there are workers
+            for _ in range(bus.workers + 1):
+                await bus.send_notification(request("test-slow"))
+            await asyncio.sleep(0.01)
+            await bus.send_notification(request("test-fast", priority=9))
+            # Handled while every slow message is still waiting on the first one
+            await asyncio.wait_for(fast_handled.wait(), 1)
+            assert slow_handled == 0
+            release.set()
+            await bus.join()
+        finally:
+            await bus.unregister_message_handler("test-slow", slow)
+            await bus.unregister_message_handler("test-fast", fast)
+            await bus.stop()
+            bus.set_type_concurrency("test-slow", 0)
+        return slow_peak, slow_handled
+
+    assert asyncio.run(scenario()) == (1, 5)
+
+
+def test_sends_and_deliveries_share_transactions(session_factory):
+    from sqlalchemy import event
+
+    commits = []
+    event.listen(session_factory.kw["bind"], "commit", lambda connection: commits.append(1))
+
+    async def scenario():
+        bus = make_bus(session_factory)
+
+        def handler(notification):
+            pass
+
+        await bus.register_message_handler("test-batched", handler)
+        try:
+            # Sent one after the other, as a request sending a message at a time would
+            for i in range(10):
+                await bus.send_notification(request("test-batched", payload=str(i)))
+            await bus.join()
+        finally:
+            await bus.unregister_message_handler("test-batched", handler)
+            await bus.stop()
+        with bus._new_session() as db:
+            return [message.delivered for message in db.query(Message).filter(Message.type == "test-batched")]
+
+    delivered = asyncio.run(scenario())
+    assert delivered == [True] * 10
+    # One commit per send, the deliveries are recorded with the next send
+    assert len(commits) <= 11
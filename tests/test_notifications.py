@@ -0,0 +1,171 @@
+import asyncio
+import sys
+import os
+
+# Add the parent directory to the sys.path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from models.notification import Notification, NotificationCounter
+from schemas.notification import RecipientType
+import services.notifications as notifications
+from services.notifications import NotificationService
+
+
+@pytest.fixture
+def db(session_factory, monkeypatch):
+    session = session_factory()
+
+    async def get_user_groups(user_id):
+        return [{"id": "speakers"}] if user_id == "alice" else []
+
+    monkeypatch.setattr(notifications, "get_user_groups", get_user_groups)
+    yield session
+    session.close()
+
+
+def notify(db, recipient_type, recipient=None):
+    notification = Notification(recipient_type=recipient_type, recipient=recipient, payload="{}")
+    db.add(notification)
+    db.commit()
+    return notification.id
+
+
+def unread_ids(service, db, user_id, **kwargs):
+    return [n.id for n in asyncio.run(service.get_user_notifications(db, user_id, **kwargs))]
+
+
+def make_service():
+    async def create():
+        return NotificationService()
+    return asyncio.run(create())
+
+
+def test_unread_notifications_are_paginated_newest_first(db):
+    service = make_service()
+    to_alice = notify(db, RecipientType.UNICAST, "alice")
+    notify(db, RecipientType.UNICAST, "bob")
+    to_speakers = notify(db, RecipientType.MULTICAST, "speakers")
+    notify(db, RecipientType.MULTICAST, "staff")
+    broadcast = notify(db, RecipientType.BROADCAST)
+
+    assert unread_ids(service, db, "alice") == [broadcast, to_speakers, to_alice]
+    assert unread_ids(service, db, "alice", limit=2) == [broadcast, to_speakers]
+    assert unread_ids(service, db, "alice", before_id=to_speakers, limit=2) == [to_alice]
+
+    asyncio.run(service.mark_notifications_read(db, "alice", [to_speakers]))
+    assert unread_ids(service, db, "alice") == [broadcast, to_alice]
+
+
+def test_read_all_moves_the_watermark(db):
+    service = make_service()
+    notify(db, RecipientType.UNICAST, "alice")
+    first_broadcast = notify(db, RecipientType.BROADCAST)
+    asyncio.run(service.mark_notifications_read(db, "alice", [first_broadcast]))
+
+    assert asyncio.run(service.mark_all_notifications_read(db, "alice")) == 1
+    assert unread_ids(service, db, "alice") == []
+    assert asyncio.run(service.mark_all_notifications_read(db, "alice")) == 0
+
+    later = notify(db, RecipientType.BROADCAST)
+    assert unread_ids(service, db, "alice") == [later]
+    assert unread_ids(service, db, "bob") == [later, first_broadcast]
+
+
+def test_bulk_mark_read_is_idempotent(db):
+    service = make_service()
+    ids = [notify(db, RecipientType.BROADCAST) for _ in range(5)]
+
+    assert asyncio.run(service.mark_notifications_read(db, "alice", [ids[0]], [(ids[2], ids[3])])) == 3
+    # Marking again, overlapping ranges and unknown ids are skipped instead of failing
+    assert asyncio.run(service.mark_notifications_read(db, "alice", [ids[0], 9999], [(ids[0], ids[3])])) == 1
+    assert unread_ids(service, db, "alice") == [ids[4]]
+
+
+def test_unread_count_follows_new_and_read_notifications(db):
+    service = make_service()
+    first = notify(db, RecipientType.UNICAST, "alice")
+    notify(db, RecipientType.MULTICAST, "speakers")
+    notify(db, RecipientType.MULTICAST, "staff")
+    assert asyncio.run(service.get_unread_count(db, "alice")) == 2
+
+    notify(db, RecipientType.BROADCAST)
+    assert asyncio.run(service.get_unread_count(db, "alice")) == 3
+
+    asyncio.run(service.mark_notifications_read(db, "alice", [first]))
+    asyncio.run(service.mark_notifications_read(db, "alice", [first]))
+    assert asyncio.run(service.get_unread_count(db, "alice")) == 2
+
+    asyncio.run(service.mark_all_notifications_read(db, "alice"))
+    notify(db, RecipientType.UNICAST, "alice")
+    assert asyncio.run(service.get_unread_count(db, "alice")) == 1
+
+
+def test_concurrent_first_counts_share_the_counter(db):
+    service = make_service()
+    notify(db, RecipientType.BROADCAST)
+    other = sessionmaker(bind=db.get_bind())()
+    get = db.get
+
+    def get_after_a_concurrent_count(entity, key, **kwargs):
+        # The other request counts first, between this request's lookup and its insert
+        found = get(entity, key, **kwargs)
+        if entity is NotificationCounter and found is None and other.get(NotificationCounter, key) is None:
+            other.add(NotificationCounter(user_id=key, unread=0, counted_up_to=0))
+            other.commit()
+        return found
+
+    db.get = get_after_a_concurrent_count
+    assert asyncio.run(service.get_unread_count(db, "alice")) == 1
+    other.close()
+
+
+def test_concurrent_requests_keep_their_own_session(db, session_factory, monkeypatch):
+    service = make_service()
+    notify(db, RecipientType.MULTICAST, "speakers")
+    notify(db, RecipientType.BROADCAST)
+
+    async def slow_user_groups(user_id):
+        # Another request runs while this one waits for Keycloak
+        await asyncio.sleep(0.01)
+        return [{"id": "speakers"}] if user_id == "alice" else []
+
+    monkeypatch.setattr(notifications, "get_user_groups", slow_user_groups)
+
+    async def count(user_id):
+        with session_factory() as session:
+            return await service.get_unread_count(session, user_id)
+
+    async def run():
+        return await asyncio.gather(count("alice"), count("bob"))
+
+    assert asyncio.run(run()) == [2, 1]
+
+
+def test_unread_count_catches_up_with_unknown_and_changed_groups(db, monkeypatch):
+    service = make_service()
+    groups = {"alice": ["speakers"]}
+    failing = True
+
+    async def get_user_groups(user_id):
+        if failing:
+            raise RuntimeError("Keycloak is down")
+        return [{"id": group_id} for group_id in groups.get(user_id, [])]
+
+    monkeypatch.setattr(notifications, "get_user_groups", get_user_groups)
+    notify(db, RecipientType.MULTICAST, "speakers")
+    # The groups are unknown, the count is not moved past the group notification
+    assert asyncio.run(service.get_unread_count(db, "alice")) == 0
+
+    failing = False
+    assert asyncio.run(service.get_unread_count(db, "alice")) == 1
+
+    # Membership changed in Keycloak itself, without going through the API
+    groups["alice"] = ["staff"]
+    notify(db, RecipientType.MULTICAST, "staff")
+    notify(db, RecipientType.MULTICAST, "staff")
+    assert asyncio.run(service.get_unread_count(db, "alice")) == 2
+    groups["alice"] = []
+    assert asyncio.run(service.get_unread_count(db, "alice")) == 0
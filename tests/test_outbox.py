@@ -0,0 +1,134 @@
+import asyncio
+import sys
+import os
+from datetime import UTC, datetime, timedelta
+
+# Add the parent directory to the sys.path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.message import Message
+from schemas.notification import RecipientType
+from services.outbox import OutboxDispatcher
+
+
+def add_messages(session_factory, count: int, **values):
+    with session_factory() as db:
+        for i in range(count):
+            db.add(Message(type="in-app", recipient_type=RecipientType.BROADCAST, payload=str(i), priority=1, **values))
+        db.commit()
+
+
+def make_dispatcher(session_factory, queued: list, **options) -> OutboxDispatcher:
+    async def enqueue(message_id, notification, handled):
+        queued.append(message_id)
+
+    return OutboxDispatcher(enqueue, lambda: ["in-app"], session_factory=session_factory, **options)
+
+
+def test_messages_are_claimed_by_one_dispatcher(session_factory):
+    add_messages(session_factory, 5)
+    # Claimed by a worker whose lease has not run out yet
+    add_messages(session_factory, 1, claimed_by="other", claimed_until=datetime.now(UTC) + timedelta(minutes=1))
+    # Claimed by a worker that went away
+    add_messages(session_factory, 1, claimed_by="gone", claimed_until=datetime.now(UTC) - timedelta(minutes=1))
+
+    first, second = [], []
+
+    async def scenario():
+        await make_dispatcher(session_factory, first, batch_size=2).run_once()
+        await make_dispatcher(session_factory, second, batch_size=2).run_once()
+
+    asyncio.run(scenario())
+    assert first == [1, 2, 3, 4, 5, 7]
+    assert second == []
+
+
+def test_failed_messages_are_retried_with_backoff(session_factory):
+    add_messages(session_factory, 1)
+    queued = []
+    dispatcher = make_dispatcher(session_factory, queued, backoff_base=60, max_attempts=2)
+
+    async def scenario():
+        await dispatcher.run_once()
+        await dispatcher.record(1, "boom")
+        # Not due before its backoff
+        await dispatcher.run_once()
+
+    asyncio.run(scenario())
+    assert queued == [1]
+    with session_factory() as db:
+        message = db.get(Message, 1)
+        assert (message.attempts, message.last_error, message.claimed_by) == (1, "boom", None)
+        assert message.next_attempt_at > datetime.now(UTC).replace(tzinfo=None) + timedelta(seconds=50)
+        message.next_attempt_at = datetime.now(UTC)
+        db.commit()
+
+    async def retry():
+        await dispatcher.run_once()
+        await dispatcher.record(1)
+
+    asyncio.run(retry())
+    assert queued == [1, 1]
+    with session_factory() as db:
+        message = db.get(Message, 1)
+        assert message.delivered and message.last_error is None
+
+
+def test_backoff_is_capped(session_factory):
+    dispatcher = make_dispatcher(session_factory, [], backoff_base=1, backoff_max=10)
+    assert [dispatcher.backoff(attempts) for attempts in (1, 2, 3, 4, 5)] == [1, 2, 4, 8, 10]
+
+
+def test_held_messages_keep_their_lease(session_factory):
+    # Still queued on this worker, its lease ran out while it waited
+    add_messages(session_factory, 1, claimed_by="me", claimed_until=datetime.now(UTC) - timedelta(seconds=1))
+    queued = []
+
+    async def scenario():
+        await make_dispatcher(session_factory, queued, held=lambda: [1]).run_once()
+        await make_dispatcher(session_factory, queued).run_once()
+
+    asyncio.run(scenario())
+    assert queued == []
+    with session_factory() as db:
+        assert db.get(Message, 1).claimed_until > datetime.now(UTC).replace(tzinfo=None) + timedelta(seconds=50)
+
+
+def test_retries_skip_the_handlers_that_succeeded(session_factory):
+    add_messages(session_factory, 1)
+    retried = []
+
+    async def enqueue(message_id, notification, handled):
+        retried.append(handled)
+
+    dispatcher = OutboxDispatcher(enqueue, lambda: ["in-app"], backoff_base=0, session_factory=session_factory)
+
+    async def scenario():
+        await dispatcher.run_once()
+        await dispatcher.record(1, "boom", {"handlers.first"})
+        await dispatcher.run_once()
+
+    asyncio.run(scenario())
+    assert retried == [[], ["handlers.first"]]
+
+
+def test_outcomes_are_recorded_in_one_transaction(session_factory):
+    from sqlalchemy import event
+
+    add_messages(session_factory, 5)
+    commits = []
+    event.listen(session_factory.kw["bind"], "commit", lambda connection: commits.append(1))
+
+    async def scenario():
+        dispatcher = make_dispatcher(session_factory, [])
+        for message_id in (1, 2, 3, 4):
+            dispatcher.record_later(message_id)
+        dispatcher.record_later(5, "boom", {"handlers.first"})
+        await dispatcher.stop()
+
+    asyncio.run(scenario())
+    assert len(commits) == 1
+    with session_factory() as db:
+        messages = db.query(Message).order_by(Message.id).all()
+        assert [m.delivered for m in messages] == [True, True, True, True, False]
+        assert messages[4].attempts == 1 and messages[4].handled_by == '["handlers.first"]'
@@ -0,0 +1,56 @@
+import asyncio
+import sys
+import os
+from datetime import UTC, datetime, timedelta
+
+# Add the parent directory to the sys.path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants.retention import RetentionMode
+from models.archive import ArchivedRecord
+from models.message import Message
+from models.notification import Notification, NotificationRead
+from schemas.notification import RecipientType
+from services.retention import RetentionPolicy, RetentionService
+
+
+def test_expired_notifications_are_archived_in_batches(session_factory):
+    old = datetime.now(UTC) - timedelta(days=40)
+    with session_factory() as db:
+        for i in range(5):
+            created_at = old if i < 3 else datetime.now(UTC)
+            db.add(Notification(recipient_type=RecipientType.BROADCAST, payload=str(i), created_at=created_at))
+        db.commit()
+        db.add(NotificationRead(notification_id=1, user_id="alice"))
+        db.add(NotificationRead(notification_id=4, user_id="alice"))
+        db.commit()
+
+    policy = RetentionPolicy(Notification, Notification.created_at, 30, dependents=[(NotificationRead, "notification_id")])
+    service = RetentionService([policy], RetentionMode.ARCHIVE, batch_size=2, session_factory=session_factory)
+    assert asyncio.run(service.run_once()) == {"notifications": 3}
+
+    with session_factory() as db:
+        assert [n.payload for n in db.query(Notification).order_by(Notification.id)] == ["3", "4"]
+        assert [r.notification_id for r in db.query(NotificationRead)] == [4]
+        archived = db.query(ArchivedRecord).order_by(ArchivedRecord.record_id).all()
+        assert [record.record_id for record in archived] == [1, 2, 3]
+        assert archived[0].source == "notifications"
+        assert archived[0].data["payload"] == "0"
+        assert archived[0].data["recipient_type"] == "BROADCAST"
+
+
+def test_condition_keeps_matching_rows(session_factory):
+    old = datetime.now(UTC) - timedelta(days=10)
+    with session_factory() as db:
+        for delivered in (True, False):
+            db.add(Message(type="in-app", recipient_type=RecipientType.BROADCAST, payload="{}",
+                           priority=1, delivered=delivered, created_at=old))
+        db.commit()
+
+    policy = RetentionPolicy(Message, Message.created_at, 7, condition=Message.delivered.is_(True))
+    service = RetentionService([policy], RetentionMode.DELETE, session_factory=session_factory)
+    assert asyncio.run(service.run_once()) == {"messages": 1}
+
+    with session_factory() as db:
+        assert [m.delivered for m in db.query(Message)] == [False]
+        assert db.query(ArchivedRecord).count() == 0
@@ -0,0 +1,62 @@
+import asyncio
+import sys
+import os
+
+# Add the parent directory to the sys.path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from benchmarks.fake_keycloak import FakeKeycloak
+import services.directory as directory
+import services.keycloak_admin as keycloak_admin
+from services.keycloak_admin import AsyncKeycloakAdmin
+from services.user_service import iter_role_users, list_role_users
+
+ROLES = [f"cb-role-{i}" for i in range(6)]
+
+
+@pytest.fixture
+def realm(monkeypatch):
+    realm = FakeKeycloak(latency=0.05)
+    realm.seed(users=5, roles=[*ROLES, "offline_access"])
+    realm.start()
+    admin = realm.admin_client()
+    client = AsyncKeycloakAdmin(lambda: admin, max_workers=8)
+    monkeypatch.setattr(keycloak_admin, "_keycloak_admin", client)
+    monkeypatch.setattr(directory, "_directory", directory.DirectoryCache(client))
+    yield realm
+    client.shutdown()
+    realm.stop()
+
+
+def test_role_members_are_fetched_concurrently(realm):
+    async def scenario():
+        # Logs the client in and caches the roles
+        await directory.get_directory().roles()
+        realm.requests = realm.peak_in_flight = 0
+        role_users = await list_role_users()
+        requests = realm.requests
+        await list_role_users()
+        return role_users, requests, realm.requests - requests
+
+    role_users, requests, cached_requests = asyncio.run(scenario())
+    assert list(role_users) == ROLES
+    assert all(len(users) == 5 for users in role_users.values())
+    # One request per role, all of them at once
+    assert requests == len(ROLES)
+    assert realm.peak_in_flight == len(ROLES)
+    assert cached_requests == 0
+
+
+def test_role_members_are_paginated_and_streamed(realm):
+    async def scenario():
+        await directory.get_directory().roles()
+        realm.peak_in_flight = 0
+        return [item async for item in iter_role_users(first=1, max=2, concurrency=2)]
+
+    streamed = asyncio.run(scenario())
+    assert sorted(role_name for role_name, _ in streamed) == ROLES
+    for _, users in streamed:
+        assert [user["username"] for user in users] == ["user-1", "user-2"]
+    assert realm.peak_in_flight == 2
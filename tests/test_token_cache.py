@@ -0,0 +1,37 @@
+import sys
+import os
+import time
+
+# Add the parent directory to the sys.path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dependencies.token_cache import TokenCache
+
+
+def test_claims_are_cached_until_the_token_expires():
+    cache = TokenCache(ttl=300)
+    cache.put("valid", {"sub": "alice", "exp": time.time() + 60})
+    cache.put("expired", {"sub": "bob", "exp": time.time() - 1})
+
+    claims = cache.get("valid")
+    claims["type"] = "changed"
+    assert cache.get("valid") == {"sub": "alice", "exp": claims["exp"]}
+    assert cache.get("expired") is None
+    assert cache.get("unknown") is None
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 2
+
+
+def test_least_recently_used_tokens_are_evicted():
+    cache = TokenCache(max_size=2)
+    cache.put("a", {"sub": "a"})
+    cache.put("b", {"sub": "b"})
+    cache.get("a")
+    cache.put("c", {"sub": "c"})
+
+    assert cache.get("b") is None
+    assert cache.get("a") == {"sub": "a"}
+    assert cache.get("c") == {"sub": "c"}
+
+    cache.invalidate("a")
+    assert cache.get("a") is None
@@ -0,0 +1,34 @@
+import sys
+import os
+
+# Add the parent directory to the sys.path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.topic_stream import TopicStream
+
+
+def fill(stream: TopicStream, count: int):
+    for _ in range(count):
+        seq = stream.next_seq()
+        stream.append(seq, f"frame-{seq}")
+
+
+def test_gap_is_replayed():
+    stream = TopicStream(10)
+    fill(stream, 5)
+    assert stream.since(2) == ["frame-3", "frame-4", "frame-5"]
+    assert stream.since(5) == []
+
+
+def test_evicted_gap_requires_resync():
+    stream = TopicStream(3)
+    fill(stream, 5)
+    assert len(stream) == 3
+    assert stream.since(1) is None, "Frame 2 was evicted, the client must resync"
+    assert stream.since(2) == ["frame-3", "frame-4", "frame-5"]
+
+
+def test_sequence_from_the_future_requires_resync():
+    stream = TopicStream(3)
+    fill(stream, 2)
+    assert stream.since(7) is None
@@ -0,0 +1,271 @@
+import asyncio
+import json
+import sys
+import os
+
+# Add the parent directory to the sys.path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import WebSocketDisconnect
+from constants.websocket import OverflowPolicy
+from services.websocket_service import WebSocketConnection, WebSocketService
+from utils.codec import get_codec
+
+
+class FakeWebSocket:
+    """Minimal stand-in for a Starlette WebSocket that records sent frames"""
+    def __init__(self, delay: float = 0, incoming=()):
+        self.sent = []
+        self.delay = delay
+        self.incoming = asyncio.Queue()
+        for message in incoming:
+            self.incoming.put_nowait(message)
+
+    async def receive(self):
+        message = await self.incoming.get()
+        if message is None:
+            return {"type": "websocket.disconnect", "code": 1000}
+        if isinstance(message, bytes):
+            return {"type": "websocket.receive", "bytes": message}
+        return {"type": "websocket.receive", "text": json.dumps(message)}
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+    async def accept(self):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+    async def send_text(self, data):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.sent.append(data)
+
+
+def test_drop_oldest_policy():
+    connection = WebSocketConnection(FakeWebSocket(), "c1", queue_size=2, overflow_policy=OverflowPolicy.DROP_OLDEST)
+    for i in range(3):
+        assert connection.enqueue(str(i), "topic")
+    assert [frame for _, frame in connection._queue] == ["1", "2"], "Oldest frame was not dropped"
+    assert connection.dropped_frames == 1
+
+
+def test_coalesce_policy():
+    connection = WebSocketConnection(FakeWebSocket(), "c1", queue_size=2, overflow_policy=OverflowPolicy.COALESCE)
+    connection.enqueue("0", "a")
+    connection.enqueue("1", "b")
+    connection.enqueue("2", "b")
+    assert [frame for _, frame in connection._queue] == ["0", "2"], "Frame of the same topic was not coalesced"
+
+
+def test_disconnect_policy():
+    connection = WebSocketConnection(FakeWebSocket(), "c1", queue_size=1, overflow_policy=OverflowPolicy.DISCONNECT)
+    assert connection.enqueue("0", "a")
+    assert not connection.enqueue("1", "a"), "Full queue should ask for a disconnect"
+
+
+def test_writer_drains_in_order():
+    async def run():
+        websocket = FakeWebSocket(delay=0.001)
+        connection = WebSocketConnection(websocket, "c1", queue_size=10)
+        connection.start_writer()
+        for i in range(5):
+            connection.enqueue(str(i), "topic")
+        # Enqueueing must not wait for the socket
+        assert websocket.sent == []
+        await asyncio.sleep(0.05)
+        connection.stop_writer()
+        return websocket.sent
+
+    assert asyncio.run(run()) == [str(i) for i in range(5)]
+
+
+def test_subscription_indexes():
+    async def run():
+        service = WebSocketService()
+        await service.connect(FakeWebSocket(), "idx-1")
+        await service.connect(FakeWebSocket(), "idx-2")
+        await service.authenticate("idx-1", "user-a")
+        await service.subscribe("idx-1", "schedule")
+        await service.subscribe("idx-2", "schedule")
+
+        assert service.topic_subscribers["schedule"] == {"idx-1", "idx-2"}
+        assert service.user_connections["user-a"] == {"idx-1"}
+
+        await service.unsubscribe("idx-2", "schedule")
+        assert service.topic_subscribers["schedule"] == {"idx-1"}
+
+        await service.disconnect("idx-1")
+        await service.disconnect("idx-2")
+        assert "schedule" not in service.topic_subscribers, "Empty topic was not removed from the index"
+        assert "user-a" not in service.user_connections, "Disconnected user was not removed from the index"
+
+    asyncio.run(run())
+
+
+def test_broadcast_encodes_once():
+    async def run():
+        service = WebSocketService()
+        sockets = [FakeWebSocket() for _ in range(3)]
+        for i, websocket in enumerate(sockets):
+            await service.connect(websocket, f"enc-{i}")
+            await service.subscribe(f"enc-{i}", "news")
+
+        calls = []
+        serializer = service.serializer
+        original_dumps = serializer.dumps
+        serializer.dumps = lambda data: calls.append(data) or original_dumps(data)
+        try:
+            await service.broadcast_to_topic("news", {"title": "Coffee break"})
+            await asyncio.sleep(0.01)
+        finally:
+            del serializer.dumps
+            for i in range(len(sockets)):
+                await service.disconnect(f"enc-{i}")
+
+        assert len(calls) == 1, "Broadcast frame should be encoded exactly once"
+        assert all(websocket.sent == sockets[0].sent for websocket in sockets)
+        assert serializer.loads(sockets[0].sent[0])["data"] == {"title": "Coffee break"}
+
+    asyncio.run(run())
+
+
+def test_ping_is_answered_while_handler_is_busy():
+    async def run():
+        service = WebSocketService()
+        websocket = FakeWebSocket()
+        connection = await service.connect(websocket, "reader-1")
+        handled = []
+
+        async def slow_dispatch(connection, message):
+            await asyncio.sleep(0.1)
+            handled.append(message)
+
+        listener = asyncio.create_task(service.listen(connection, slow_dispatch))
+        websocket.incoming.put_nowait({"type": "subscribe", "topic": "news"})
+        websocket.incoming.put_nowait({"type": "ping"})
+        await asyncio.sleep(0.02)
+        # The PONG went out even though the dispatcher is still busy with the first frame
+        assert [service.serializer.loads(frame) for frame in websocket.sent] == [{"type": "pong"}]
+        assert handled == []
+
+        await asyncio.sleep(0.1)
+        assert handled == [{"type": "subscribe", "topic": "news"}]
+
+        websocket.incoming.put_nowait(None)
+        try:
+            await listener
+        except WebSocketDisconnect:
+            pass
+        await service.disconnect("reader-1")
+
+    asyncio.run(run())
+
+
+def test_broadcast_uses_negotiated_codec():
+    async def run():
+        service = WebSocketService()
+        text_socket, binary_socket = FakeWebSocket(), FakeWebSocket()
+        await service.connect(text_socket, "codec-text")
+        await service.connect(binary_socket, "codec-binary")
+        encoding, compression = service.negotiate_codec("msgpack", "deflate")
+        service.set_codec("codec-binary", encoding, compression)
+        for connection_id in ("codec-text", "codec-binary"):
+            await service.subscribe(connection_id, "schedule")
+
+        await service.broadcast_to_topic("schedule", {"talk": "Keynote"})
+        await asyncio.sleep(0.01)
+        for connection_id in ("codec-text", "codec-binary"):
+            await service.disconnect(connection_id)
+
+        assert isinstance(text_socket.sent[0], str)
+        assert isinstance(binary_socket.sent[0], bytes)
+        assert get_codec(encoding, compression).decode(binary_socket.sent[0])["data"] == {"talk": "Keynote"}
+
+    asyncio.run(run())
+
+
+def test_unsupported_codec_falls_back_to_json():
+    assert WebSocketService.negotiate_codec("xml", "brotli") == ("json", None)
+
+
+def test_resume_replays_missed_frames():
+    async def run():
+        service = WebSocketService()
+        await service.connect(FakeWebSocket(), "resume-old")
+        await service.subscribe("resume-old", "agenda")
+        for i in range(3):
+            await service.broadcast_to_topic("agenda", {"n": i})
+        await service.disconnect("resume-old")
+        last_seq = service.last_seq("agenda")
+
+        await service.broadcast_to_topic("agenda", {"n": 3})
+        await service.broadcast_to_topic("agenda", {"n": 4})
+
+        websocket = FakeWebSocket()
+        await service.connect(websocket, "resume-new")
+        assert await service.resume("resume-new", "agenda", service.stream_id, last_seq)
+        await service.broadcast_to_topic("agenda", {"n": 5})
+        await asyncio.sleep(0.01)
+        await service.disconnect("resume-new")
+
+        frames = [service.serializer.loads(frame) for frame in websocket.sent]
+        assert frames[0]["type"] == "resume_result" and frames[0]["status"] == "success"
+        assert [frame["data"]["n"] for frame in frames[1:]] == [3, 4, 5]
+        assert [frame["seq"] for frame in frames[1:]] == [last_seq + 1, last_seq + 2, last_seq + 3]
+
+    asyncio.run(run())
+
+
+def test_resume_from_another_worker_requires_resync():
+    async def run():
+        service = WebSocketService()
+        websocket = FakeWebSocket()
+        await service.connect(websocket, "resume-other")
+        assert not await service.resume("resume-other", "agenda", "other-worker", 3)
+        await asyncio.sleep(0.01)
+        subscribed = service.connections["resume-other"].has_subscription("agenda")
+        await service.disconnect("resume-other")
+        assert subscribed, "Resume should subscribe even when a resync is needed"
+        assert service.serializer.loads(websocket.sent[0])["status"] == "resync"
+
+    asyncio.run(run())
+
+
+def test_resume_of_notifications_requires_resync():
+    async def run():
+        service = WebSocketService()
+        await service.connect(FakeWebSocket(), "notified-phone")
+        # Notifications are sent to the connections of a user, the way NotificationService does
+        phone = service.connections["notified-phone"]
+        phone.send_frame("notifications", service.encode_message("notifications", {"title": "Missed"}))
+
+        websocket = FakeWebSocket()
+        await service.connect(websocket, "notified-laptop")
+        resumed = await service.resume("notified-laptop", "notifications", service.stream_id, service.last_seq("notifications"))
+        await asyncio.sleep(0.01)
+        await service.disconnect("notified-phone")
+        await service.disconnect("notified-laptop")
+        assert not resumed
+        assert service.serializer.loads(websocket.sent[0])["status"] == "resync"
+
+    asyncio.run(run())
+
+
+def test_authenticate_without_a_valid_token_is_answered():
+    from routes.websocket import handle_client_message
+
+    async def run():
+        service = WebSocketService()
+        websocket = FakeWebSocket()
+        connection = await service.connect(websocket, "auth-1")
+        for message in ({"type": "authenticate"}, {"type": "authenticate", "token": {"not": "a string"}}):
+            await handle_client_message(connection, message)
+        await asyncio.sleep(0.01)
+        await service.disconnect("auth-1")
+        return [service.serializer.loads(frame) for frame in websocket.sent]
+
+    results = asyncio.run(run())
+    assert [(result["type"], result["status"]) for result in results] == [("authentication_result", "error")] * 2
@@ -0,0 +1,140 @@
+import asyncio
+import sys
+import os
+import tempfile
+
+# Add the parent directory to the sys.path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.worker_bus import WorkerBus, UnixSocketWorkerBus, default_socket_dir
+
+
+def test_local_bus_delivers_in_process():
+    async def run():
+        received = []
+
+        async def handler(payload):
+            received.append(payload)
+
+        bus = WorkerBus()
+        bus.register("websocket", handler)
+        await bus.publish("websocket", {"topic": "news"})
+        return received
+
+    assert asyncio.run(run()) == [{"topic": "news"}]
+
+
+def test_unix_bus_relays_to_peers():
+    async def run(directory):
+        received = {"a": [], "b": []}
+        buses = {}
+        for name in received:
+            async def handler(payload, name=name):
+                received[name].append(payload)
+
+            buses[name] = UnixSocketWorkerBus(directory, name=name)
+            buses[name].register("websocket", handler)
+            await buses[name].start()
+
+        try:
+            await buses["a"].publish("websocket", {"frame": "hello"})
+            await asyncio.sleep(0.05)
+        finally:
+            for bus in buses.values():
+                await bus.stop()
+        return received
+
+    with tempfile.TemporaryDirectory() as directory:
+        received = asyncio.run(run(directory))
+    assert received["a"] == [{"frame": "hello"}], "Publisher should deliver locally"
+    assert received["b"] == [{"frame": "hello"}], "Peer worker did not receive the payload"
+
+
+def test_unix_bus_removes_stale_peers():
+    async def run(directory):
+        stale = UnixSocketWorkerBus(directory, name="stale")
+        await stale.start()
+        # Simulate a crashed worker: the socket file stays but nobody listens on it
+        stale._socket.close()
+        stale._socket = None
+
+        bus = UnixSocketWorkerBus(directory, name="alive")
+        await bus.start()
+        try:
+            await bus.publish("websocket", {"frame": "hello"})
+        finally:
+            await bus.stop()
+        return os.listdir(directory)
+
+    with tempfile.TemporaryDirectory() as directory:
+        assert asyncio.run(run(directory)) == []
+
+
+def test_unix_bus_relays_payloads_larger_than_a_datagram():
+    async def run(directory):
+        received = []
+
+        async def handler(payload):
+            received.append(payload)
+
+        sender = UnixSocketWorkerBus(directory, name="sender", chunk_size=4096)
+        receiver = UnixSocketWorkerBus(directory, name="receiver")
+        receiver.register("websocket", handler)
+        await receiver.start()
+        await sender.start()
+        try:
+            await sender.publish("websocket", {"frame": "x" * 500_000})
+            await asyncio.sleep(0.1)
+        finally:
+            await sender.stop()
+            await receiver.stop()
+        return received
+
+    with tempfile.TemporaryDirectory() as directory:
+        received = asyncio.run(run(directory))
+    assert received == [{"frame": "x" * 500_000}]
+
+
+def test_unix_bus_waits_for_busy_peers():
+    async def run(directory):
+        received = []
+
+        async def handler(payload):
+            received.append(payload["index"])
+
+        sender = UnixSocketWorkerBus(directory, name="sender")
+        receiver = UnixSocketWorkerBus(directory, name="receiver")
+        receiver.register("websocket", handler)
+        await receiver.start()
+        await sender.start()
+        try:
+            # Published without yielding to the loop, so the receiver reads nothing until the end
+            for index in range(2000):
+                await sender.publish("websocket", {"index": index, "frame": "x" * 1000})
+            assert sender._connections[receiver._path].pending, "The receiver queue should have filled up"
+            for _ in range(100):
+                await asyncio.sleep(0.01)
+                if len(received) == 2000:
+                    break
+        finally:
+            await sender.stop()
+            await receiver.stop()
+        return received
+
+    with tempfile.TemporaryDirectory() as directory:
+        received = asyncio.run(run(directory))
+    assert sorted(received) == list(range(2000))
+
+
+def test_default_socket_directory_is_per_deployment():
+    async def run():
+        bus = UnixSocketWorkerBus(None, name="worker")
+        await bus.start()
+        try:
+            return bus._directory
+        finally:
+            await bus.stop()
+
+    directory = asyncio.run(run())
+    assert directory == default_socket_dir()
+    assert directory.endswith(f"_{os.getppid()}")
@@ -0,0 +1,48 @@
+import asyncio
+import sys
+import os
+
+# Add the parent directory to the sys.path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+
+from models.event import Event
+from services.write_batcher import WriteBatcher
+
+
+def test_concurrent_rows_share_transactions(session_factory):
+    commits = []
+    event.listen(session_factory.kw["bind"], "commit", lambda connection: commits.append(1))
+
+    async def scenario():
+        batcher = WriteBatcher(session_factory, max_size=4, max_delay=0.01)
+        events = [Event(event_type="check-in", payload=str(i), details={}) for i in range(10)]
+        ids = await asyncio.gather(*(batcher.add(e) for e in events))
+        await batcher.stop()
+        return events, ids
+
+    events, ids = asyncio.run(scenario())
+    assert ids == [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+    # The rows are still loaded once returned
+    assert [e.payload for e in events] == [str(i) for i in range(10)]
+    assert len(commits) == 3
+
+
+def test_failing_row_only_fails_its_own_add(session_factory):
+    async def scenario():
+        batcher = WriteBatcher(session_factory)
+        first = await batcher.add(Event(event_type="check-in", payload="first", details={}))
+        results = await asyncio.gather(
+            batcher.add(Event(event_type="check-in", payload="ok", details={})),
+            batcher.add(Event(id=first, event_type="duplicate")),
+            return_exceptions=True
+        )
+        await batcher.stop()
+        return results
+
+    ok, duplicate = asyncio.run(scenario())
+    assert ok == 2
+    assert isinstance(duplicate, Exception)
+    with session_factory() as db:
+        assert [e.payload for e in db.query(Event).order_by(Event.id)] == ["first", "ok"]
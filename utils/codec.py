@@ -0,0 +1,135 @@
+import io
+import zlib
+import logging
+from functools import lru_cache
+from typing import Any, List, Optional
+from utils.serializer import get_serializer
+from constants.websocket import WEBSOCKET_MAX_DECOMPRESSED_SIZE
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional, only the JSON encoding is offered without it
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional, only deflate compression is offered without it
+    zstandard = None
+
+logger = logging.getLogger("coffeebreak.core")
+
+
+def available_encodings() -> List[str]:
+    """Get the frame encodings supported by this server"""
+    return ["json", "msgpack"] if msgpack is not None else ["json"]
+
+
+def available_compressions() -> List[str]:
+    """Get the frame compressions supported by this server"""
+    return ["deflate", "zstd"] if zstandard is not None else ["deflate"]
+
+
+class FrameCodec:
+    """
+    Encodes and decodes WebSocket frames for one encoding/compression pair
+
+    Plain JSON frames are sent as text, every other combination is sent as binary frames.
+    Codecs are stateless, get them through get_codec so connections share instances.
+    Decoded frames come from clients, they may not decompress to more than `max_size` bytes.
+    """
+    def __init__(self, encoding: str = "json", compression: Optional[str] = None, max_size: int = WEBSOCKET_MAX_DECOMPRESSED_SIZE):
+        if encoding not in available_encodings():
+            raise ValueError(f"Unsupported encoding: {encoding}")
+        if compression is not None and compression not in available_compressions():
+            raise ValueError(f"Unsupported compression: {compression}")
+        self.encoding = encoding
+        self.compression = compression
+        self.max_size = max_size
+        self._serializer = get_serializer()
+        if compression == "zstd":
+            self._compressor = zstandard.ZstdCompressor()
+            self._decompressor = zstandard.ZstdDecompressor()
+
+    @property
+    def binary(self) -> bool:
+        """Whether frames are sent as binary instead of text"""
+        return self.encoding != "json" or self.compression is not None
+
+    def encode(self, data: Any) -> str | bytes:
+        """Encode a frame"""
+        if self.encoding == "msgpack":
+            payload = msgpack.packb(data, default=str, use_bin_type=True)
+        else:
+            payload = self._serializer.dumps(data)
+            if self.compression is None:
+                return payload
+            payload = payload.encode()
+        return self._compress(payload)
+
+    def decode(self, frame: str | bytes) -> Any:
+        """Decode a frame"""
+        if isinstance(frame, str):
+            return self._serializer.loads(frame)
+        payload = self._decompress(frame)
+        if self.encoding == "msgpack":
+            return msgpack.unpackb(payload, raw=False)
+        return self._serializer.loads(payload)
+
+    def _compress(self, payload: bytes) -> bytes:
+        if self.compression == "deflate":
+            return zlib.compress(payload)
+        if self.compression == "zstd":
+            return self._compressor.compress(payload)
+        return payload
+
+    def _decompress(self, payload: bytes) -> bytes:
+        """Decompress a received frame, raises ValueError past max_size instead of inflating it"""
+        if self.compression == "deflate":
+            decompressor = zlib.decompressobj()
+            data = decompressor.decompress(payload, self.max_size)
+            if decompressor.unconsumed_tail:
+                raise ValueError(f"Frame decompresses to more than {self.max_size} bytes")
+            return data
+        if self.compression == "zstd":
+            # Read through a stream, the size declared in the frame header cannot be trusted
+            with self._decompressor.stream_reader(io.BytesIO(payload)) as reader:
+                data = reader.read(self.max_size + 1)
+            if len(data) > self.max_size:
+                raise ValueError(f"Frame decompresses to more than {self.max_size} bytes")
+            return data
+        return payload
+
+    def __repr__(self):
+        return f"FrameCodec(encoding={self.encoding}, compression={self.compression})"
+
+
+@lru_cache(maxsize=None)
+def get_codec(encoding: str = "json", compression: Optional[str] = None) -> FrameCodec:
+    """Get the shared codec of an encoding/compression pair, raises ValueError if unsupported"""
+    return FrameCodec(encoding, compression)
+
+
+class FrameCache:
+    """
+    A broadcast frame encoded once per codec
+
+    The frame starts as JSON text, which is what connections without a negotiated codec get.
+    The first connection with another codec decodes it once and every codec encodes it once,
+    so a broadcast costs one encoding per distinct codec and not one per recipient.
+    """
+    def __init__(self, frame: str, serializer=None):
+        self.frame = frame
+        self._serializer = serializer or get_serializer()
+        self._data = None
+        self._encoded = {}
+
+    def for_codec(self, codec: Optional[FrameCodec]) -> str | bytes:
+        """Get the frame encoded for a codec, None being the default JSON text"""
+        if codec is None:
+            return self.frame
+        encoded = self._encoded.get(codec)
+        if encoded is None:
+            if self._data is None:
+                self._data = self._serializer.loads(self.frame)
+            encoded = self._encoded[codec] = codec.encode(self._data)
+        return encoded
@@ -0,0 +1,58 @@
+import json
+import logging
+from typing import Any, Optional
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the standard library encoder is used as fallback
+    orjson = None
+
+logger = logging.getLogger("coffeebreak.core")
+
+
+class JSONSerializer:
+    """
+    JSON serializer backed by the standard library
+    """
+    name = "json"
+
+    def dumps(self, data: Any) -> str:
+        """Encode data to a compact JSON string"""
+        return json.dumps(data, separators=(",", ":"), ensure_ascii=False, default=str)
+
+    def loads(self, data: str | bytes) -> Any:
+        """Decode a JSON string"""
+        return json.loads(data)
+
+
+class OrjsonSerializer(JSONSerializer):
+    """
+    JSON serializer backed by orjson
+    """
+    name = "orjson"
+
+    def dumps(self, data: Any) -> str:
+        return orjson.dumps(data, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, data: str | bytes) -> Any:
+        return orjson.loads(data)
+
+
+def get_serializer(name: Optional[str] = None) -> JSONSerializer:
+    """
+    Get a JSON serializer by name, defaults to the fastest one available
+
+    Args:
+        name (str): "orjson" or "json", None picks orjson when installed
+    """
+    if name is None:
+        name = "orjson" if orjson is not None else "json"
+
+    if name == "orjson":
+        if orjson is None:
+            logger.warning("orjson is not installed, falling back to the json serializer")
+            return JSONSerializer()
+        return OrjsonSerializer()
+    if name == "json":
+        return JSONSerializer()
+    raise ValueError(f"Unknown serializer: {name}")